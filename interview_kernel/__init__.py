@@ -1,3 +1,10 @@
-from . import string_handling, mmtinterface, exaoutput, pde_state_machine
-#from .interview_kernel import Interview
-from . import interview_kernel
+import importlib
+
+# the submodules are imported on first access, so that e.g. install.py does not have to load the kernel
+_submodules = ["string_handling", "mmtinterface", "exaoutput", "pde_state_machine", "interview_kernel"]
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+"""A non-interactive driver for the PDE_States interview, and a process pool that runs many of them in parallel.
+
+Each model specification is a dict with a "name" and the list of "answers" a user would type into the notebook, e.g.
+    {"name": "poisson", "answers": ["Ω = [0;1]", "u : Ω → ℝ", "f = x ⋅ x", "n", "Δu = f(x)", "u = 0", "n", "y"]}
+
+Every interview runs in its own process with its own ExaStencils workspace. Since the ephemeral theory names
+(ephdomain, ephbcs, ...) are fixed, interviews talking to the same MMT server would overwrite each other's theories -
+so to run them concurrently, give the pool one MMT server URL per worker process.
+
+    python -m interview_kernel.batch specs.json --processes 4 --timeout 600 \\
+        --mmt-url http://localhost:9000 --mmt-url http://localhost:9001 ...
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import statistics
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from distutils.util import strtobool
+from pathlib import Path
+from tempfile import gettempdir
+
+from . import string_handling
+from .exaoutput import create_workspace
+
+
+class InterviewTimeout(Exception):
+    """Raised inside a worker process if a model takes longer than the configured timeout"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        super(InterviewTimeout, self).__init__("Interview timed out after " + str(seconds) + " s")
+
+
+class BatchInterview:
+    """Walks a PDE_States instance through a given list of answers, the way the kernel would do it for a user"""
+
+    def __init__(self, name="batch"):
+        # import here, so that the pool's parent process does not need to load the state machine
+        from .pde_state_machine import PDE_States
+
+        self.name = name
+        self.output = []
+        self.errors = []
+        self.num_html_displays = 0
+        # seconds spent handling input, per state
+        self.stage_latency = OrderedDict()
+
+        self.state_machine = PDE_States(self.poutput, self.update_prompt, self.please_prompt,
+                                        self.display_html, False, self.toggle_show_button)
+
+    def poutput(self, text, outstream_name='stdout'):
+        self.output.append(str(text))
+        if outstream_name == 'stderr':
+            self.errors.append(str(text))
+
+    def update_prompt(self):
+        return
+
+    def display_html(self, code=None, needs_bokeh=False, display_id=None):
+        self.num_html_displays += 1
+
+    def toggle_show_button(self, button_text, hidden_text):
+        return
+
+    def please_prompt(self, query, if_yes, if_no=None, pass_other=False):
+        self.poutput(str(query))
+        self.state_machine.prompted = True
+        self.state_machine.if_yes = if_yes
+        self.state_machine.if_no = if_no
+        self.state_machine.pass_other = pass_other
+
+    def prompt_input_handling(self, arg):
+        """ If we asked for a yes-no answer, execute what was specified in please_prompt.
+        return true if the input was handled here, and false if not."""
+        if self.state_machine.prompted:
+            if arg == "":
+                ret = True
+            else:
+                try:
+                    ret = strtobool(str(arg).strip().lower())
+                except ValueError:
+                    if self.state_machine.pass_other:
+                        return False
+                    self.poutput("Please answer with y/n")
+                    return True
+            self.state_machine.prompted = False
+            if ret:
+                if self.state_machine.if_yes is not None:
+                    self.state_machine.if_yes()
+            elif self.state_machine.if_no is not None:
+                self.state_machine.if_no()
+            return True
+        return False
+
+    def handle_input(self, answer):
+        arg = string_handling.replace_times_to_cdot(string_handling.latex_to_text(answer)).strip()
+        state = self.state_machine.state
+        start = time.perf_counter()
+        try:
+            if not self.prompt_input_handling(arg):
+                self.state_machine.handle_state_dependent_input(arg)
+        finally:
+            self.stage_latency[state] = self.stage_latency.get(state, 0.0) + time.perf_counter() - start
+
+    def run(self, answers):
+        """feeds the answers to the state machine, starting with the greeting"""
+        self.handle_input("anything")
+        for answer in answers:
+            self.handle_input(answer)
+        return self.state_machine.state
+
+
+def _set_timeout(seconds):
+    def handler(signum, frame):
+        raise InterviewTimeout(seconds)
+    signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+
+
+def _clear_timeout():
+    signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _init_worker(mmt_url_queue):
+    """pool initializer: every worker process takes its own MMT server, if there are enough"""
+    try:
+        os.environ['MMT_BASE_URL'] = mmt_url_queue.get_nowait()
+    except Exception:
+        pass
+
+
+def run_interview(spec, timeout=None, workspace_root=None):
+    """runs a single model specification, to be called in a worker process. Never raises, but reports the status."""
+    name = spec.get("name", "model")
+    if workspace_root is None:
+        workspace_root = Path(gettempdir()).joinpath("mosis_batch")
+    workspace = create_workspace(Path(workspace_root).joinpath(name + "_" + uuid.uuid4().hex[:8]))
+    os.environ['EXASTENCILS_PATH'] = str(workspace)
+
+    result = {
+        "name": name,
+        "status": "ok",
+        "final_state": None,
+        "elapsed": None,
+        "stage_latency": {},
+        "workspace": str(workspace),
+        "mmt_base_url": os.environ.get('MMT_BASE_URL'),
+        "error": None,
+        "output": "",
+    }
+    start = time.perf_counter()
+    interview = None
+    try:
+        if timeout:
+            _set_timeout(timeout)
+        interview = BatchInterview(name)
+        result["final_state"] = interview.run(spec.get("answers", []))
+        if interview.errors:
+            result["status"] = "failed"
+            result["error"] = interview.errors[-1]
+    except InterviewTimeout as error:
+        result["status"] = "timeout"
+        result["error"] = str(error)
+    except Exception as error:
+        result["status"] = "error"
+        result["error"] = repr(error)
+    finally:
+        if timeout:
+            _clear_timeout()
+    result["elapsed"] = time.perf_counter() - start
+    if interview is not None:
+        result["final_state"] = interview.state_machine.state
+        result["stage_latency"] = dict(interview.stage_latency)
+        result["output"] = "\n".join(interview.output)
+        interview.state_machine.close()
+    return result
+
+
+class BatchReport:
+    """The aggregated results of an InterviewPool run"""
+
+    def __init__(self, results, wall_time, processes):
+        self.results = results
+        self.wall_time = wall_time
+        self.processes = processes
+
+    def count(self, status):
+        return len([r for r in self.results if r["status"] == status])
+
+    def throughput(self):
+        """finished interviews per second of wall time"""
+        if self.wall_time <= 0:
+            return 0.0
+        return self.count("ok") / self.wall_time
+
+    def stage_statistics(self):
+        """mean, median and maximum latency per interview stage, over all models"""
+        per_stage = OrderedDict()
+        for result in self.results:
+            for stage, seconds in result["stage_latency"].items():
+                per_stage.setdefault(stage, []).append(seconds)
+        stats = OrderedDict()
+        for stage, latencies in per_stage.items():
+            stats[stage] = {
+                "count": len(latencies),
+                "mean": statistics.mean(latencies),
+                "median": statistics.median(latencies),
+                "max": max(latencies),
+            }
+        return stats
+
+    def to_dict(self):
+        return {
+            "processes": self.processes,
+            "wall_time": self.wall_time,
+            "throughput": self.throughput(),
+            "ok": self.count("ok"),
+            "failed": self.count("failed"),
+            "timeout": self.count("timeout"),
+            "error": self.count("error"),
+            "stages": self.stage_statistics(),
+            "results": self.results,
+        }
+
+    def summary(self):
+        lines = [
+            str(len(self.results)) + " models on " + str(self.processes) + " processes in " +
+            "{:.2f}".format(self.wall_time) + " s: " + str(self.count("ok")) + " ok, " +
+            str(self.count("failed")) + " failed, " + str(self.count("timeout")) + " timed out, " +
+            str(self.count("error")) + " errors",
+            "throughput: {:.3f} models/s".format(self.throughput()),
+            "",
+            "stage".ljust(12) + "count".rjust(7) + "mean [s]".rjust(12) + "median [s]".rjust(12) + "max [s]".rjust(12),
+        ]
+        for stage, s in self.stage_statistics().items():
+            lines.append(stage.ljust(12) + str(s["count"]).rjust(7) + "{:12.3f}{:12.3f}{:12.3f}".format(
+                s["mean"], s["median"], s["max"]))
+        for result in self.results:
+            if result["status"] != "ok":
+                lines.append(result["name"] + ": " + result["status"] + " in state " + str(result["final_state"]) +
+                             " - " + str(result["error"]))
+        return "\n".join(lines)
+
+
+class InterviewPool:
+    """Runs independent interviews in parallel worker processes"""
+
+    def __init__(self, processes=None, timeout=None, mmt_base_urls=None, workspace_root=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.mmt_base_urls = list(mmt_base_urls or [])
+        self.workspace_root = workspace_root
+
+    def run(self, specs):
+        url_queue = multiprocessing.Manager().Queue()
+        for url in self.mmt_base_urls:
+            url_queue.put(url)
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(self.processes, initializer=_init_worker, initargs=(url_queue,)) as pool:
+            pending = [pool.apply_async(run_interview, (spec, self.timeout, self.workspace_root)) for spec in specs]
+            results = [p.get() for p in pending]
+        return BatchReport(results, time.perf_counter() - start, self.processes)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Run many MoSIS interviews in parallel")
+    ap.add_argument('specs', help="JSON file with a list of {\"name\": ..., \"answers\": [...]} model specifications")
+    ap.add_argument('--processes', '-j', type=int, default=None,
+                    help="Number of worker processes. Default: number of cores")
+    ap.add_argument('--timeout', type=float, default=None, help="Timeout per model, in seconds")
+    ap.add_argument('--mmt-url', action='append', dest='mmt_urls', default=[],
+                    help="MMT server URL for one worker. Repeat to give every worker its own server")
+    ap.add_argument('--workspace-root', default=None, help="Where to put the per-model ExaStencils workspaces")
+    ap.add_argument('--report', default=None, help="Write the full report as JSON to this file")
+    args = ap.parse_args(argv)
+
+    with open(args.specs) as f:
+        specs = json.load(f)
+
+    if len(args.mmt_urls) > 1 and (args.processes or multiprocessing.cpu_count()) > len(args.mmt_urls):
+        print("Warning: fewer MMT servers than processes, some workers will share the default server")
+
+    report = InterviewPool(args.processes, args.timeout, args.mmt_urls, args.workspace_root).run(specs)
+    print(report.summary())
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report.to_dict(), f, indent=2, ensure_ascii=False)
+    return 0 if report.count("ok") == len(specs) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
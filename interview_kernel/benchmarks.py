@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""Small performance checks for the kernel, meant to be run by hand or in CI, e.g.
+
+    python -m interview_kernel.benchmarks startup --max-seconds 1.0
+    python -m interview_kernel.benchmarks first-prompt --repeat 3
+    python -m interview_kernel.benchmarks load-field --points 1048577
+    python -m interview_kernel.benchmarks preview --levels 5 10 15
+
+exits with a non-zero status if the check regresses.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# heavy modules that must not be loaded just by starting the kernel;
+# (ipywidgets is not in here because metakernel itself imports it)
+lazy_modules = ["bokeh", "pandas", "numpy", "pylatexenc"]
+
+_import_script = """
+import json, sys, time
+start = time.perf_counter()
+import interview_kernel.interview_kernel
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def measure_cold_import(repeat=5):
+    """imports the kernel module in fresh interpreters, returns the list of import times and the heavy modules seen"""
+    times = []
+    loaded = set()
+    for i in range(repeat):
+        completed = subprocess.run([sys.executable, "-c", _import_script % (lazy_modules,)],
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        result = json.loads(completed.stdout.decode().strip().splitlines()[-1])
+        times.append(result["seconds"])
+        loaded.update(result["loaded"])
+    return times, sorted(loaded)
+
+
+def startup(args):
+    times, loaded = measure_cold_import(args.repeat)
+    median = statistics.median(times)
+    print("cold import of interview_kernel: median {:.3f} s, min {:.3f} s, max {:.3f} s over {} runs".format(
+        median, min(times), max(times), len(times)))
+    failed = False
+    if loaded:
+        print("FAIL: loaded at import time, should be lazy: " + ", ".join(loaded))
+        failed = True
+    if args.max_seconds is not None and median > args.max_seconds:
+        print("FAIL: median import time above the budget of {:.3f} s".format(args.max_seconds))
+        failed = True
+    return 1 if failed else 0
+
+
+def wait_until_ready(kernel, timeout=60):
+    """connects to a kernel process of the warm pool and waits for its kernel_info reply"""
+    from jupyter_client import BlockingKernelClient
+    client = BlockingKernelClient()
+    client.load_connection_info(kernel.connection_info)
+    client.start_channels()
+    try:
+        client.wait_for_ready(timeout=timeout)
+    finally:
+        client.stop_channels()
+
+
+def first_prompt(args):
+    """the time from asking for a kernel to the kernel answering, started cold or taken from a warm pool"""
+    from .install import kernel_json
+    from .warm_pool import WarmPool
+
+    pool = WarmPool(kernel_json["argv"], size=1)
+    cold = []
+    warm = []
+    try:
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            kernel = pool.start_kernel()
+            wait_until_ready(kernel)
+            cold.append(time.perf_counter() - start)
+            kernel.process.kill()
+            pool.remove_connection_file(kernel)
+
+            pool.fill()
+            # the kernel in the pool had time to start up, as it would between two notebooks being opened
+            wait_until_ready(pool.kernels[0])
+            start = time.perf_counter()
+            kernel = pool.take()
+            wait_until_ready(kernel)
+            warm.append(time.perf_counter() - start)
+            kernel.process.kill()
+    finally:
+        pool.shutdown()
+
+    print("time to first prompt, cold start: median {:.3f} s over {} runs".format(statistics.median(cold), len(cold)))
+    print("time to first prompt, warm pool:  median {:.3f} s over {} runs".format(statistics.median(warm), len(warm)))
+    print("warm pool: " + json.dumps(pool.metrics()))
+    if args.max_seconds is not None and statistics.median(warm) > args.max_seconds:
+        print("FAIL: median time to first prompt from the warm pool above the budget of {:.3f} s".format(
+            args.max_seconds))
+        return 1
+    return 0
+
+
+def load_field(args):
+    """the time to load a field of the given size from ExaStencils' text output and from the binary file"""
+    import tempfile
+    from pathlib import Path
+    import numpy as np
+    from . import fieldfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        x = np.linspace(0.0, 1.0, args.points)
+        np.savetxt(str(Path(directory).joinpath("u.dat")), np.column_stack([x, x * (1 - x)]), fmt="%.17g",
+                   delimiter=" ", newline=" \n")
+        text = []
+        binary = []
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            fieldfile.read_text_field(Path(directory).joinpath("u.dat"), "u")
+            text.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        fieldfile.convert_all(directory)
+        conversion = time.perf_counter() - start
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            x, values = fieldfile.load_field(directory, "u")
+            # touch the data, so that it is actually read
+            float(values.sum())
+            binary.append(time.perf_counter() - start)
+    print("loading a field of {} points: text median {:.4f} s, binary median {:.4f} s (converting once {:.3f} s)"
+          .format(args.points, statistics.median(text), statistics.median(binary), conversion))
+    return 0
+
+
+def preview_solve(args):
+    """the time the finite difference preview takes for Δu = x ⋅ x, u = 0 on the boundary, per level"""
+    import numpy as np
+    from . import preview
+
+    simdata = {
+        "num_dimensions": 1,
+        "domain": {"from": "0", "to": "1"},
+        "unknowns": {"u": {}},
+        "pdes": {"pdes": [{"lhsstring": "Δu", "rhsstring": "x ⋅ x"}]},
+        "bcs": {"bcs": [{"lhsstring": "u", "rhsstring": "0", "type": ["Dirichlet"]}]},
+    }
+    failed = False
+    for level in args.levels:
+        times = []
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            x, values = preview.solve(simdata, level)
+            times.append(time.perf_counter() - start)
+        error = np.abs(values - (x ** 4 - x) / 12).max()
+        print("preview on 2^{} intervals: median {:.4f} s, max error {:.2e}".format(level, statistics.median(times),
+                                                                                 error))
+        if args.max_seconds is not None and statistics.median(times) > args.max_seconds:
+            failed = True
+    if failed:
+        print("FAIL: median preview time above the budget of {:.3f} s".format(args.max_seconds))
+        return 1
+    return 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="MoSIS kernel performance checks")
+    sub = ap.add_subparsers(dest="benchmark")
+    sub.required = True
+
+    sp = sub.add_parser("startup", help="Time the cold import of the kernel")
+    sp.add_argument("--repeat", type=int, default=5, help="Number of fresh interpreters to time")
+    sp.add_argument("--max-seconds", type=float, default=None, help="Fail if the median import time is above this")
+    sp.set_defaults(run=startup)
+
+    sp = sub.add_parser("first-prompt", help="Time until a new kernel answers, cold and from the warm pool")
+    sp.add_argument("--repeat", type=int, default=3, help="Number of kernels to start")
+    sp.add_argument("--max-seconds", type=float, default=None,
+                    help="Fail if the median time with the warm pool is above this")
+    sp.set_defaults(run=first_prompt)
+
+    sp = sub.add_parser("load-field", help="Time loading solver output, text versus binary")
+    sp.add_argument("--points", type=int, default=2 ** 20 + 1, help="Number of grid points of the field")
+    sp.add_argument("--repeat", type=int, default=3, help="Number of loads to time")
+    sp.set_defaults(run=load_field)
+
+    sp = sub.add_parser("preview", help="Time the NumPy/SciPy finite difference preview")
+    sp.add_argument("--levels", type=int, nargs="+", default=[5, 10, 15], help="Grid levels, 2^level intervals")
+    sp.add_argument("--repeat", type=int, default=3, help="Number of solves to time per level")
+    sp.add_argument("--max-seconds", type=float, default=None, help="Fail if a median time is above this")
+    sp.set_defaults(run=preview_solve)
+
+    args = ap.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+"""Directory caches on disk, for what ExaStencils builds and computes.
+
+Every entry is a directory named by the hash of what it was made from (its key), holding a copy of the files
+and an entry.json with its size, when it was made and last used, and whatever else the caller wants to remember.
+When the entries take up more than max_bytes, the least recently used ones are removed. Several kernels can share
+a cache: entries are written to a temporary directory first and then renamed into place."""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+import uuid
+from pathlib import Path
+
+from .exaoutput import ExaOutput, default_exastencils_path
+
+entry_file_name = "entry.json"
+
+
+def hash_strings(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        h.update(hashlib.sha256(part).digest())
+    return h.hexdigest()
+
+
+_file_hashes = {}
+
+
+def file_identity(path):
+    """the hash of a file's contents, remembered as long as its size and modification time do not change"""
+    path = Path(path)
+    try:
+        stat = path.stat()
+    except OSError:
+        return "missing"
+    key = (str(path.resolve()), stat.st_size, stat.st_mtime)
+    if key not in _file_hashes:
+        h = hashlib.sha256()
+        with open(str(path), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        _file_hashes[key] = h.hexdigest()
+    return _file_hashes[key]
+
+
+_compiler_versions = {}
+
+
+def compiler_version(compiler=None):
+    """the first line of `<compiler> --version`, e.g. of the g++ the generated Makefile calls"""
+    if compiler is None:
+        compiler = os.environ.get("CXX", "g++")
+    if compiler not in _compiler_versions:
+        try:
+            completed = subprocess.run([compiler, "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            _compiler_versions[compiler] = completed.stdout.decode(errors='replace').split("\n")[0]
+        except OSError:
+            _compiler_versions[compiler] = "none"
+    return _compiler_versions[compiler]
+
+
+def directory_size(path):
+    size = 0
+    for root, dirs, files in os.walk(str(path)):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class DiskCache:
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        os.makedirs(str(self.root), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, key):
+        return self.root.joinpath(key)
+
+    def read_entry(self, path):
+        try:
+            with open(str(Path(path).joinpath(entry_file_name))) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_entry(self, path, entry):
+        temp_path = Path(path).joinpath(entry_file_name + "." + uuid.uuid4().hex)
+        with open(str(temp_path), 'w') as f:
+            json.dump(entry, f, indent=1)
+        os.replace(str(temp_path), str(Path(path).joinpath(entry_file_name)))
+
+    def get(self, key):
+        """the directory of the entry, or None; marks the entry as used"""
+        path = self.entry_path(key)
+        entry = self.read_entry(path)
+        if entry is None:
+            self.misses += 1
+            return None
+        entry["last_used"] = time.time()
+        try:
+            self.write_entry(path, entry)
+        except OSError:  # evicted in the meantime
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def metadata(self, key):
+        entry = self.read_entry(self.entry_path(key))
+        return entry.get("metadata") if entry is not None else None
+
+    def put(self, key, source_path, metadata=None, ignore=None):
+        """copies the directory source_path into the cache, returns the entry's directory"""
+        path = self.entry_path(key)
+        temp_path = self.root.joinpath("tmp-" + uuid.uuid4().hex)
+        shutil.copytree(str(source_path), str(temp_path), symlinks=True, ignore=ignore)
+        now = time.time()
+        self.write_entry(temp_path, {
+            "key": key,
+            "size": directory_size(temp_path),
+            "created": now,
+            "last_used": now,
+            "metadata": metadata or {},
+        })
+        try:
+            os.rename(str(temp_path), str(path))
+        except OSError:
+            # somebody else put the same entry in the meantime
+            shutil.rmtree(str(temp_path), ignore_errors=True)
+        self.evict()
+        return path
+
+    def copy_to(self, key, target_path):
+        """copies the entry's files (without entry.json) to target_path, returns False if that failed"""
+        path = self.get(key)
+        if path is None:
+            return False
+        try:
+            if os.path.lexists(str(target_path)):
+                shutil.rmtree(str(target_path))
+            shutil.copytree(str(path), str(target_path), symlinks=True,
+                            ignore=shutil.ignore_patterns(entry_file_name))
+        except OSError:
+            return False
+        return True
+
+    def entries(self):
+        entries = []
+        for path in self.root.iterdir():
+            if path.name.startswith("tmp-"):
+                continue
+            entry = self.read_entry(path)
+            if entry is not None:
+                entries.append((path, entry))
+        return entries
+
+    def total_size(self):
+        return sum(entry["size"] for path, entry in self.entries())
+
+    def evict(self):
+        """removes the least recently used entries until the cache fits into max_bytes"""
+        entries = sorted(self.entries(), key=lambda e: e[1]["last_used"])
+        total = sum(entry["size"] for path, entry in entries)
+        while entries and total > self.max_bytes:
+            path, entry = entries.pop(0)
+            shutil.rmtree(str(path), ignore_errors=True)
+            total -= entry["size"]
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            "entries": len(entries),
+            "bytes": sum(entry["size"] for path, entry in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def build_key(exaout, platform_file):
+    """the hash of everything the generated code and the executable depend on: the ExaStencils input files,
+        the platform and library files they import, the generator and the C++ compiler"""
+    parts = []
+    for suffix in [".exa1", ".settings", ".knowledge"]:
+        with open(str(exaout.filespath) + suffix, 'rb') as f:
+            parts.append(f.read())
+    lib_path = exaout.exastencils_path.joinpath("lib")
+    parts.append(file_identity(exaout.exastencils_path.joinpath(platform_file)))
+    if lib_path.is_dir():
+        for path in sorted(lib_path.glob("*.knowledge")):
+            parts.append(path.name + ":" + file_identity(path))
+    parts.append(file_identity(exaout.exastencils_path.joinpath("compiler.jar")))
+    parts.append(compiler_version())
+    return hash_strings(*parts)
+
+
+_build_cache = None
+
+
+def get_build_cache():
+    """the cache of generated and compiled code, by default in the exastencils directory and up to 2 GB,
+        cf. MOSIS_BUILD_CACHE_PATH and MOSIS_BUILD_CACHE_BYTES"""
+    global _build_cache
+    if _build_cache is None:
+        root = os.environ.get("MOSIS_BUILD_CACHE_PATH", str(default_exastencils_path().joinpath("cache", "build")))
+        max_bytes = int(os.environ.get("MOSIS_BUILD_CACHE_BYTES", 2 * 1024 ** 3))
+        _build_cache = DiskCache(root, max_bytes)
+    return _build_cache
+
+
+# to be increased whenever the way results are computed or stored changes, so that old results are not used
+result_format_version = 1
+
+
+def problem_spec(simdata, max_level=None):
+    """the parts of simdata that determine the solution - but not the names of the theories, views or the problem;
+        max_level is the finest level solved on, by default ExaOutput's"""
+    return {
+        "version": result_format_version,
+        "num_dimensions": simdata["num_dimensions"],
+        "domain": {key: simdata["domain"].get(key) for key in ["from", "to", "axes"]},
+        "unknowns": {name: unknown.get("type") for name, unknown in simdata["unknowns"].items()},
+        "pdes": [{key: pde.get(key) for key in ["op", "lhsstring", "rhsstring_expanded"]}
+                 for pde in simdata["pdes"]["pdes"]],
+        "bcs": [{key: bc.get(key) for key in ["type", "on", "lhsstring", "rhsstring_expanded"]}
+                for bc in simdata["bcs"]["bcs"]],
+        "sim": simdata["sim"].get("type"),
+        "levels": [ExaOutput.min_level, max_level or ExaOutput.max_level],
+        "solver": ExaOutput.knowledge_imports,
+    }
+
+
+def result_key(simdata, max_level=None):
+    return hash_strings(json.dumps(problem_spec(simdata, max_level), sort_keys=True, ensure_ascii=False, default=str))
+
+
+def only_fields(directory, names):
+    """for DiskCache.put: copy nothing but the fields the solver wrote, in the binary format if they were converted"""
+    binary = set(name[:-len(".field")] for name in names if name.endswith(".field"))
+    return [name for name in names
+            if not (name.endswith(".field") or (name.endswith(".dat") and name[:-len(".dat")] not in binary))]
+
+
+_result_store = None
+
+
+def get_result_store():
+    """the solutions of the problems solved so far, by default in the exastencils directory and up to 1 GB,
+        cf. MOSIS_RESULT_STORE_PATH and MOSIS_RESULT_STORE_BYTES"""
+    global _result_store
+    if _result_store is None:
+        root = os.environ.get("MOSIS_RESULT_STORE_PATH", str(default_exastencils_path().joinpath("cache", "results")))
+        max_bytes = int(os.environ.get("MOSIS_RESULT_STORE_BYTES", 1024 ** 3))
+        _result_store = DiskCache(root, max_bytes)
+    return _result_store
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""A local index of everything worth completing - keywords, the differential operators, unicode symbols and their
+LaTeX names, the constants of the background theories and whatever the user declared so far - so that tab completion
+does not need to ask the MMT server on every keystroke."""
+
+import re
+import threading
+
+from . import symbolic
+
+# LaTeX commands that pylatexenc turns into the symbols, and a few plain names for them
+latex_aliases = [
+    ("\\Omega", "Ω"),
+    ("\\Delta", "Δ"),
+    ("\\nabla", "∇"),
+    ("\\partial", "∂"),
+    ("\\cdot", "⋅"),
+    ("\\to", "→"),
+    ("\\rightarrow", "→"),
+    ("\\mathbb{R}", "ℝ"),
+    ("\\R", "ℝ"),
+    ("\\in", "∈"),
+    ("\\alpha", "α"),
+    ("\\beta", "β"),
+    ("\\gamma", "γ"),
+    ("\\lambda", "λ"),
+    ("\\mu", "μ"),
+    ("\\sigma", "σ"),
+    ("\\pi", "π"),
+]
+name_aliases = [
+    ("Omega", "Ω"),
+    ("Delta", "Δ"),
+    ("laplace", "Δ"),
+    ("nabla", "∇"),
+    ("partial", "∂"),
+    ("reals", "ℝ"),
+]
+keywords = ["explain", "recap", "tgview", "undo", "omdoc", "widget", "jobs"]
+
+# the (LaTeX-)word in front of the cursor
+_prefix_regex = re.compile(r"(\\[A-Za-z{}]*|[^\W\d]\w*)$")
+
+
+class PrefixTrie:
+    """maps strings to sets of completions, and finds all completions for keys starting with a prefix"""
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def insert(self, key, completion):
+        node = self.root
+        for character in key:
+            node = node.setdefault(character, {})
+        completions = node.setdefault(None, [])
+        if completion not in completions:
+            completions.append(completion)
+            self.size += 1
+
+    def find(self, prefix, limit=50):
+        """the completions of all keys with the prefix, shorter keys first"""
+        node = self.root
+        for character in prefix:
+            if character not in node:
+                return []
+            node = node[character]
+        found = []
+        level = [node]
+        # breadth-first, so that the closest matches come first
+        while level and len(found) < limit:
+            next_level = []
+            for node in level:
+                for completion in node.get(None, []):
+                    if completion not in found:
+                        found.append(completion)
+                for character, child in node.items():
+                    if character is not None:
+                        next_level.append(child)
+            level = next_level
+        return found[:limit]
+
+
+class SymbolIndex:
+
+    def __init__(self):
+        self.trie = PrefixTrie()
+        self.lock = threading.Lock()
+        self.indexed_theories = set()
+        for alias, symbol in latex_aliases + name_aliases:
+            self.add(alias, symbol)
+        for name in keywords:
+            self.add(name)
+        for name in list(symbolic.differential_operator_names) + list(symbolic.differential_operators):
+            self.add(name)
+
+    def add(self, name, completion=None):
+        if not name:
+            return
+        with self.lock:
+            self.trie.insert(name, completion or name)
+
+    def add_simdata(self, simdata):
+        """the names the user declared: domain, axes, unknowns and parameters"""
+        self.add(simdata["domain"].get("name"))
+        for axis in simdata["domain"].get("axes", {}):
+            self.add(axis)
+        for name in simdata["unknowns"]:
+            self.add(name)
+        for name in simdata["parameters"]:
+            self.add(name)
+
+    def add_theory(self, mmtinterface, theoryname):
+        """the names of the constants declared in a theory"""
+        reply = mmtinterface.query_for(theoryname)
+        if reply.ok and reply.root is not None:
+            for element in reply.getConstants():
+                self.add(element.get("name"))
+        self.indexed_theories.add(theoryname)
+
+    def index_theories_in_background(self, theorynames):
+        """queries the theories one by one in a daemon thread; completions work meanwhile, just without them"""
+        def index():
+            from .mmtinterface import MMTInterface
+            mmtinterface = MMTInterface()
+            for theoryname in theorynames:
+                try:
+                    self.add_theory(mmtinterface, theoryname)
+                except Exception:
+                    # no server, or the theory does not exist (yet) - nothing to complete from it
+                    pass
+        thread = threading.Thread(target=index, name="completion-index", daemon=True)
+        thread.start()
+        return thread
+
+    def complete(self, code, cursor_pos):
+        """the completions for the word in front of the cursor, and where it starts"""
+        match = _prefix_regex.search(code[:cursor_pos])
+        if match is None:
+            return [], cursor_pos
+        with self.lock:
+            return self.trie.find(match.group(1)), match.start(1)
@@ -1,25 +1,117 @@
 
 import os
+import errno
+import fcntl
+import queue
+import sys
+import threading
+import time
 from pathlib import Path
 from tempfile import gettempdir
+import shutil
+import signal
 import subprocess
 from collections import OrderedDict
-from pylatexenc.latexencode import utf8tolatex, utf82latex
+from contextlib import contextmanager
+
+from .worker import Cancelled
 
 
 def remove_ensuremaths():
     """remove ensuremath wrappers in utf82latex before translating back from unicode to latex"""
+    from pylatexenc.latexencode import utf82latex
     for key, value in utf82latex.items():
         if value.startswith('\\ensuremath{'):
             utf82latex[key] = value.replace('\\ensuremath{', '', 1)[:-1]
 
 
+def default_exastencils_path():
+    """the exastencils directory copied by install.py, unless overridden by the EXASTENCILS_PATH environment variable"""
+    return Path(os.environ.get('EXASTENCILS_PATH', str(Path.home().joinpath("./exastencils"))))
+
+
+def exastencils_installed(exastencils_path=None):
+    """whether there is an ExaStencils compiler to generate code with, and a java to run it"""
+    if exastencils_path is None:
+        exastencils_path = default_exastencils_path()
+    return Path(exastencils_path).joinpath("compiler.jar").exists() and shutil.which("java") is not None
+
+
+def create_workspace(workspace_path, template_path=None):
+    """creates an isolated exastencils working directory, so that several runs do not clobber each other's
+        examples.sh, Debug and generated folders. The (large) compiler and libraries are only linked."""
+    if template_path is None:
+        template_path = default_exastencils_path()
+    workspace_path = Path(workspace_path)
+    os.makedirs(str(workspace_path), exist_ok=True)
+    for name in ["compiler.jar", "generate_compile_and_run_list.sh", "lib"]:
+        src = Path(template_path).joinpath(name)
+        dest = workspace_path.joinpath(name)
+        if src.exists() and not os.path.lexists(str(dest)):
+            os.symlink(str(src.resolve()), str(dest))
+    return workspace_path
+
+
+def write_if_changed(path, text):
+    """writes the file only if its content differs, so that its modification time says when it last changed;
+        returns whether it was written"""
+    data = text.encode() if isinstance(text, str) else text
+    try:
+        with open(str(path), 'rb') as f:
+            if f.read() == data:
+                return False
+    except OSError:
+        pass
+    temp_path = str(path) + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, str(path))
+    return True
+
+
+# the files of generated code that disappear from a build tree when the generator does not write them any more
+source_suffixes = (".cpp", ".cc", ".c", ".h", ".hpp", ".cu", ".cuh")
+
+
+def sync_tree(source_path, target_path):
+    """makes target_path contain the files of source_path, only writing the ones that differ, so that make
+        rebuilds only what changed; files make built in target_path stay. Returns the number of files written"""
+    written = 0
+    source_path = Path(source_path)
+    target_path = Path(target_path)
+    for root, dirs, files in os.walk(str(source_path)):
+        target_root = target_path.joinpath(os.path.relpath(root, str(source_path)))
+        os.makedirs(str(target_root), exist_ok=True)
+        for name in files:
+            with open(os.path.join(root, name), 'rb') as f:
+                if write_if_changed(target_root.joinpath(name), f.read()):
+                    shutil.copymode(os.path.join(root, name), str(target_root.joinpath(name)))
+                    written += 1
+    for root, dirs, files in os.walk(str(target_path)):
+        source_root = source_path.joinpath(os.path.relpath(root, str(target_path)))
+        for name in files:
+            if name.endswith(source_suffixes) and not source_root.joinpath(name).exists():
+                os.remove(os.path.join(root, name))
+    return written
+
+
 class ExaOutput:
     """generates configuration files for exastencils,
         but only if simdata is given"""
-    def __init__(self, simdata=None, username="user", probname=None):
+    # the multigrid levels; the finest has 2^max_level intervals
+    min_level = 5
+    max_level = 15
+    # the domain partitioning and parallelization
+    knowledge_imports = ["../lib/domain_onePatch.knowledge", "../lib/parallelization_pureOmp.knowledge"]
+
+    def __init__(self, simdata=None, username="user", probname=None, exastencils_path=None, max_level=None):
         remove_ensuremaths()
-        self.exastencils_path = Path.home().joinpath("./exastencils")
+        if max_level is not None:
+            # e.g. a coarser solution, to be shown before the one on the finest level
+            self.max_level = max_level
+        if exastencils_path is None:
+            exastencils_path = default_exastencils_path()
+        self.exastencils_path = Path(exastencils_path)
 
         self.username = username
         self.l1_string = ""
@@ -76,6 +168,7 @@ class ExaOutput:
     #        self.create_l4()
 
     def create_l1(self, simdata):
+        from pylatexenc.latexencode import utf8tolatex
         l1path = str(self.filespath.with_suffix('.exa1'))
         domain_name = utf8tolatex(simdata["domain"]["name"], non_ascii_only=True, brackets=False)
         op = utf8tolatex(self.replace_cdot(simdata["pdes"]["pdes"][-1]["op"]), non_ascii_only=True, brackets=False)
@@ -88,8 +181,8 @@ class ExaOutput:
                 "Knowledge { \n"
                 "  dimensionality = " + str(simdata["num_dimensions"]) + " \n"
                 " \n"
-                "  minLevel       = 5 \n"
-                "  maxLevel       = 15 \n"
+                "  minLevel       = " + str(self.min_level) + " \n"
+                "  maxLevel       = " + str(self.max_level) + " \n"
                 "} \n"
                 " \n"
                 "/// problem specification \n"
@@ -133,8 +226,7 @@ class ExaOutput:
                 "  l4_genDefaultApplication = true \n"
                 "  l4_defAppl_FieldToPrint = \"" + first_unknown + "\" \n" #TODO
                 "} \n")
-        with open(l1path, 'w') as l1:
-            l1.write(self.l1_string)
+        write_if_changed(l1path, self.l1_string)
 
     def replace_x(self, string):
         return string.replace("x", "vf_nodePosition_x@current")
@@ -147,8 +239,7 @@ class ExaOutput:
 
     def create_l2(self, simdata):
         l2path = str(self.filespath.with_suffix('.exa2'))
-        with open(l2path,'w') as l2:
-            l2.write(
+        write_if_changed(l2path,
                 "Domain global< " + simdata["domain"]["from"] + " to " + simdata["domain"]["to"] + " > \n" # TODO domain goes here
                 "\n"
                 "Field Solution with Real on Node of global = 0.0 \n" #TODO codomain goes here
@@ -173,15 +264,13 @@ class ExaOutput:
 
     def create_l3(self):
         l3path = str(self.filespath.with_suffix('.exa3'))
-        with open(l3path, 'w') as l3:
-            l3.write(
+        write_if_changed(l3path,
                 "generate solver for Solution in solEq \n"
             )
 
     def create_l4(self):
         l4path = str(self.filespath.with_suffix('.exa4'))
-        with open(l4path, 'w') as l4:
-            l4.write(
+        write_if_changed(l4path,
                 "Function Application ( ) : Unit { \n"
                 "   startTimer ( 'setup' ) \n"
                 "\n"
@@ -219,64 +308,289 @@ class ExaOutput:
 
     def create_settings(self):
         settingspath = str(self.filespath) + '.settings'
-        with open(settingspath, 'w') as settingsfile:
-            for key in self.settings:
-                if key == "buildfileGenerators":
-                    settingsfile.write(self.key_val(key, self.settings[key]))
-                else:
-                    settingsfile.write(self.format_key(key, self.settings))
+        lines = []
+        for key in self.settings:
+            if key == "buildfileGenerators":
+                lines.append(self.key_val(key, self.settings[key]))
+            else:
+                lines.append(self.format_key(key, self.settings))
+        write_if_changed(settingspath, "".join(lines))
 
     def create_platform(self):
         platformpath = str(self.filespath) + '.platform'
-        with open(platformpath, 'w') as platformfile:
-            for key in self.platform:
-                platformfile.write(self.format_key(key, self.platform))
+        write_if_changed(platformpath, "".join(self.format_key(key, self.platform) for key in self.platform))
 
     def create_knowledge(self):
         knowledgepath = str(self.filespath) + '.knowledge'
-        with open(knowledgepath, 'w') as knowledgefile:
-#            for key in self.knowledge:
-#                knowledgefile.write(self.format_key(key, self.knowledge))
-            knowledgefile.write(
-                "// omp parallelization on exactly one fragment in one block \n"
-                "import '../lib/domain_onePatch.knowledge' \n"
-                "import '../lib/parallelization_pureOmp.knowledge'"
-            )
+#        for key in self.knowledge:
+#            knowledgefile.write(self.format_key(key, self.knowledge))
+        write_if_changed(knowledgepath,
+            "// omp parallelization on exactly one fragment in one block \n" +
+            " \n".join("import '" + path + "'" for path in self.knowledge_imports)
+        )
 
     def create_examples_list_file(self):
         examples_path = str(self.exastencils_path.joinpath("examples").with_suffix('.sh'))
-        with open(examples_path, 'w') as shell_file:
-            shell_file.write(
-                "#!/usr/bin/env bash \n"\
-                "\n"
-                "\n"
-                "configList=\"\" \n"\
-                "configList+=\"{}/{} \" \n".format(self.probname, self.probname)) #(self.dirpath, self.probname))
+        write_if_changed(examples_path,
+            "#!/usr/bin/env bash \n"\
+            "\n"
+            "\n"
+            "configList=\"\" \n"\
+            "configList+=\"{}/{} \" \n".format(self.probname, self.probname)) #(self.dirpath, self.probname))
+
+# seconds each phase of a run may take before it is killed, can be overridden per ExaRunner
+phase_timeouts = OrderedDict([
+    ("generate", 600),
+    ("compile", 1800),
+    ("run", 3600),
+])
 
-class ExaRunner:
-    """A class to run exastencils using the files generated by an Exaoutput class, and to get the results"""
 
-    from functools import lru_cache
+class ExaRunResult:
+    """what happened in a run of ExaStencils: the exit code of the last phase that ran, how long each phase took,
+        which phase failed (if any) and where the complete output was logged"""
+
+    def __init__(self, log_path):
+        self.returncode = None
+        self.phase_durations = OrderedDict()
+        self.failed_phase = None
+        self.timed_out = False
+        self.log_path = log_path
+        # whether generating and compiling were skipped, because the build cache had the executable
+        self.build_cached = False
+
+    @property
+    def ok(self):
+        return self.failed_phase is None
+
+    def __repr__(self):
+        return "ExaRunResult(returncode={}, phase_durations={}, failed_phase={}, log_path={})".format(
+            self.returncode, dict(self.phase_durations), self.failed_phase, self.log_path)
+
+
+class ExaRunner:
+    """A class to run exastencils using the files generated by an Exaoutput class, and to get the results.
+        Does what generate_compile_and_run_list.sh does for a single configuration, phase by phase, passing
+        every line of output to output_function as it comes."""
 
-    def __init__(self, exaout):
+    def __init__(self, exaout, output_function=None, timeouts=None, make_jobs=None, build_cache=None,
+                 generator=None, build_tree=None, binary_fields=True):
         self.exaout = exaout
+        self.build_cache = build_cache
+        # a directory kept from run to run, where make only rebuilds what changed, cf. sync_tree
+        self.build_tree = Path(build_tree) if build_tree is not None else None
+        # whether to convert the fields the solver writes to binary files, cf. fieldfile.py
+        self.binary_fields = binary_fields
+        # a generator_daemon.GeneratorDaemon, to generate without starting a JVM
+        self.generator = generator
+        self.output_function = output_function
+        self.make_jobs = make_jobs or os.cpu_count() or 8
+        self.timeouts = OrderedDict(phase_timeouts)
+        if timeouts is not None:
+            self.timeouts.update(timeouts)
+        self.process = None
+        self.cancelled = False
+        self.current_phase = None
+        self.phase_started = None
+
+    def platform_file(self):
+        if sys.platform == "darwin":
+            return "lib/mac.platform"
+        return "lib/linux.platform"
+
+    def generated_path(self):
+        return self.exaout.exastencils_path.joinpath("generated").joinpath(self.exaout.probname)
+
+    def phases(self):
+        """the name, command line and working directory of each phase"""
+        exastencils_path = self.exaout.exastencils_path
+        config = self.exaout.probname + "/" + self.exaout.probname
+        generated_path = self.generated_path()
+        return [
+            ("generate", ["java", "-cp", "compiler.jar", "Main", config + ".settings", config + ".knowledge",
+                          self.platform_file()], exastencils_path),
+            # make does not start more compilers while the machine is loaded, e.g. by other jobs compiling
+            ("compile", ["make", "-j", str(self.make_jobs), "-l", str(os.cpu_count() or 8)], generated_path),
+            ("run", ["./exastencils"], generated_path),
+        ]
+
+    def output(self, line):
+        if self.output_function is not None:
+            self.output_function(line)
+
+    def phase_elapsed(self):
+        """the name of the running phase and for how many seconds it has been running, or None"""
+        phase, started = self.current_phase, self.phase_started
+        if phase is None:
+            return None
+        return phase, time.monotonic() - started
 
     def run_exastencils(self):
-        # print(str(os.path.abspath(self.exaout.exastencils_path)))
-        p = subprocess.run(["./generate_compile_and_run_list.sh"], cwd=str(self.exaout.exastencils_path),
-                           stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        out = p.stdout
-        if p.returncode != 0:
-            print(out)
-
-    @lru_cache()
-    def load_data(self, data_name="u"):  # TODO more dimensions
-        import pandas as pd
-        data_path = self.exaout.exastencils_path.joinpath("generated").joinpath(self.exaout.probname)\
-                                                .joinpath(data_name).with_suffix(".dat")
-        df = pd.read_csv(data_path, sep=' ', index_col=0)
+        debug_path = self.exaout.exastencils_path.joinpath("Debug")
+        os.makedirs(str(debug_path), exist_ok=True)
+        result = ExaRunResult(debug_path.joinpath(self.exaout.probname + "_runLog.txt"))
+        build_key = None
+        if self.build_cache is not None:
+            from .cache import build_key as make_build_key
+            build_key = make_build_key(self.exaout, self.platform_file())
+            if self.build_cache.copy_to(build_key, self.generated_path()):
+                result.build_cached = True
+                self.output("using the generated code and executable from the build cache")
+        from .fieldfile import field_cache
+        # the fields of the last run in this directory are about to be overwritten
+        field_cache.invalidate(self.generated_path())
+        with open(str(result.log_path), 'w') as log:
+            for phase, args, cwd in self.phases():
+                if result.build_cached and phase != "run":
+                    continue
+                if phase == "compile" and self.build_tree is not None:
+                    with self.locked_build_tree():
+                        written = sync_tree(self.generated_path(), self.build_tree)
+                        self.output(str(written) + " generated files changed since the last build")
+                        ok = self.run_step(phase, args, self.build_tree, log, result)
+                        if ok:
+                            shutil.copy2(str(self.build_tree.joinpath("exastencils")),
+                                         str(self.generated_path().joinpath("exastencils")))
+                else:
+                    ok = self.run_step(phase, args, cwd, log, result)
+                if not ok:
+                    break
+                if phase == "run" and self.binary_fields:
+                    self.convert_fields()
+                if phase == "compile" and build_key is not None:
+                    try:
+                        self.build_cache.put(build_key, self.generated_path())
+                    except OSError as error:
+                        self.output("could not add the build to the cache: " + str(error))
+        return result
+
+    def run_step(self, phase, args, cwd, log, result):
+        """runs one phase, returns whether it succeeded"""
+        if self.cancelled:
+            raise Cancelled("ExaStencils run cancelled")
+        self.output(phase + " " + self.exaout.probname + " ...")
+        log.write("### " + phase + ": " + " ".join(args) + "\n")
+        start = time.monotonic()
+        self.current_phase, self.phase_started = phase, start
+        try:
+            outcome = None
+            if phase == "generate" and self.generator is not None:
+                # the arguments to Main
+                outcome = self.generator.generate(cwd, args[4:], lambda line: self.log_line(line, log),
+                                                  self.timeouts.get(phase), lambda: self.cancelled)
+                if outcome is None and not self.cancelled:
+                    self.output("the generator daemon is not available, starting java")
+            if outcome is None:
+                outcome = self.run_phase(args, cwd, self.timeouts.get(phase), log)
+            result.returncode, timed_out = outcome
+        finally:
+            self.current_phase = None
+        result.phase_durations[phase] = time.monotonic() - start
+        if self.cancelled:
+            raise Cancelled("ExaStencils run cancelled")
+        if timed_out or result.returncode != 0:
+            result.failed_phase = phase
+            result.timed_out = timed_out
+            if timed_out:
+                self.output(phase + " timed out after {:.1f} s".format(result.phase_durations[phase]))
+            else:
+                self.output(phase + " failed with exit code " + str(result.returncode))
+            return False
+        self.output(phase + " done in {:.1f} s".format(result.phase_durations[phase]))
+        return True
+
+    def convert_fields(self):
+        """converts the text output to the binary format, which loads much faster, cf. fieldfile.py"""
+        from .fieldfile import convert_all
+        try:
+            convert_all(self.generated_path())
+        except (OSError, ValueError) as error:
+            self.output("could not convert the results, keeping the text files: " + str(error))
+
+    @contextmanager
+    def locked_build_tree(self):
+        """so that only one run at a time syncs and builds in the build tree"""
+        os.makedirs(str(self.build_tree), exist_ok=True)
+        with open(str(self.build_tree) + ".lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def run_phase(self, args, cwd, timeout, log):
+        """runs one command, passing on its output line by line, returns its exit code and whether it timed out"""
+        if not Path(cwd).is_dir():
+            self.log_line("no such directory: " + str(cwd), log)
+            return 1, False
+        # in a new session, so that cancel() can kill the command together with everything it started
         try:
-            df.columns = [data_name]
-        except ValueError:  # length mismatch because additional column of nans was read
-            df.columns = [data_name, 'nan']
-        return df
+            self.process = subprocess.Popen(args, cwd=str(cwd), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT, start_new_session=True)
+        except OSError as error:
+            self.log_line(str(error), log)
+            return 127, False
+        process = self.process
+        # the lines are read in a thread and handed over here, so that the output is sent from the calling thread
+        lines = queue.Queue()
+
+        def read_lines():
+            for raw_line in iter(process.stdout.readline, b''):
+                lines.put(raw_line.decode(errors='replace').rstrip("\n"))
+            process.stdout.close()
+            lines.put(None)
+
+        reader = threading.Thread(target=read_lines, name="exastencils-output", daemon=True)
+        reader.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        timed_out = False
+        try:
+            while True:
+                try:
+                    line = lines.get(timeout=0.1)
+                except queue.Empty:
+                    if deadline is not None and time.monotonic() > deadline and not timed_out:
+                        timed_out = True
+                        self.kill(process)
+                    continue
+                if line is None:
+                    break
+                self.log_line(line, log)
+            process.wait()
+        finally:
+            self.process = None
+        log.flush()
+        return process.returncode, timed_out
+
+    def log_line(self, line, log):
+        log.write(line + "\n")
+        self.output(line)
+
+    def kill(self, process, grace_period=3.0):
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            try:
+                process.wait(grace_period)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def cancel(self, grace_period=3.0):
+        """kills the running ExaStencils process group, can be called from another thread"""
+        self.cancelled = True
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        self.kill(process, grace_period)
+
+    def load_data(self, data_name="u"):  # TODO more dimensions
+        return load_data(self.generated_path(), data_name)
+
+
+def load_data(result_path, data_name="u"):
+    """reads a field the solver wrote into result_path, e.g. generated/<probname>, as a DataFrame indexed by x"""
+    import pandas as pd
+    from .fieldfile import field_cache
+    x, values = field_cache.load(result_path, data_name)
+    return pd.DataFrame({data_name: values}, index=x)
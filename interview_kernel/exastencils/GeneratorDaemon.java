@@ -0,0 +1,273 @@
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.io.Writer;
+import java.lang.management.ManagementFactory;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.net.SocketTimeoutException;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.DirectoryStream;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.nio.file.StandardCopyOption;
+import java.security.Permission;
+import java.util.Enumeration;
+import java.util.UUID;
+import java.util.jar.JarEntry;
+import java.util.jar.JarFile;
+
+/**
+ * Keeps the ExaStencils compiler loaded and runs its Main for requests on a local socket, one at a time,
+ * cf. generator_daemon.py, which starts it and talks to it.
+ *
+ * java -cp classes GeneratorDaemon compiler.jar run_directory state_file idle_seconds
+ *
+ * A request is the token (from the state file), the workspace directory, the number of arguments and the arguments
+ * to Main, one per line. The answer is the start marker, once the request is taken up (the requests before it have
+ * to finish first); the client then sends the go marker, or closes the connection if the run was cancelled while it
+ * waited, and the request is dropped. Then follows everything Main prints, and a last line with the exit marker and
+ * status.
+ * Main reads and writes paths relative to the working directory, which cannot be changed in the JVM - so the daemon
+ * is started in the run directory, which gets a link to every entry of the workspace before each run.
+ * Every run gets a fresh class loader, so that no settings or knowledge stay behind from the run before; the next
+ * one loads all classes of compiler.jar (without initializing them) while the daemon waits for a request.
+ */
+public class GeneratorDaemon {
+
+    static final String START_MARKER = "@@mosis-generator-start";
+    static final String GO_MARKER = "@@mosis-generator-go";
+    static final String EXIT_MARKER = "@@mosis-generator-exit ";
+
+    static class ExitCalled extends SecurityException {
+        final int status;
+
+        ExitCalled(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    final File compilerJar;
+    final Path runDirectory;
+    final Path stateFile;
+    final int idleSeconds;
+    final String token = UUID.randomUUID().toString();
+    Thread loaderThread;
+    URLClassLoader nextLoader;
+
+    GeneratorDaemon(File compilerJar, Path runDirectory, Path stateFile, int idleSeconds) {
+        this.compilerJar = compilerJar;
+        this.runDirectory = runDirectory;
+        this.stateFile = stateFile;
+        this.idleSeconds = idleSeconds;
+    }
+
+    public static void main(String[] args) throws Exception {
+        forbidExit();
+        GeneratorDaemon daemon = new GeneratorDaemon(new File(args[0]), Paths.get(args[1]), Paths.get(args[2]),
+                args.length > 3 ? Integer.parseInt(args[3]) : 1800);
+        daemon.serve();
+    }
+
+    /** makes System.exit in Main throw instead of ending the daemon; not possible any more in newer JVMs */
+    static void forbidExit() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkPermission(Permission perm) {
+                }
+
+                @Override
+                public void checkPermission(Permission perm, Object context) {
+                }
+
+                @Override
+                public void checkExit(int status) {
+                    throw new ExitCalled(status);
+                }
+            });
+        } catch (UnsupportedOperationException e) {
+            System.err.println("cannot catch System.exit, the daemon ends if the generator calls it");
+        }
+    }
+
+    void serve() throws IOException {
+        Files.createDirectories(runDirectory);
+        prepareNextLoader();
+        try (ServerSocket server = new ServerSocket(0, 50, InetAddress.getLoopbackAddress())) {
+            server.setSoTimeout(idleSeconds * 1000);
+            writeState(server.getLocalPort());
+            while (true) {
+                Socket socket;
+                try {
+                    socket = server.accept();
+                } catch (SocketTimeoutException e) {
+                    break;
+                }
+                try {
+                    handle(socket);
+                } catch (Exception e) {
+                    e.printStackTrace();
+                } finally {
+                    socket.close();
+                }
+            }
+        } finally {
+            Files.deleteIfExists(stateFile);
+        }
+        Runtime.getRuntime().halt(0);
+    }
+
+    void writeState(int port) throws IOException {
+        String pid = ManagementFactory.getRuntimeMXBean().getName().split("@")[0];
+        Path temp = stateFile.resolveSibling(stateFile.getFileName() + "." + pid);
+        try (Writer writer = Files.newBufferedWriter(temp, StandardCharsets.UTF_8)) {
+            writer.write("{\"port\": " + port + ", \"token\": \"" + token + "\", \"pid\": " + pid + "}\n");
+        }
+        Files.move(temp, stateFile, StandardCopyOption.REPLACE_EXISTING, StandardCopyOption.ATOMIC_MOVE);
+    }
+
+    void handle(Socket socket) throws Exception {
+        BufferedReader in = new BufferedReader(new InputStreamReader(socket.getInputStream(), StandardCharsets.UTF_8));
+        if (!token.equals(in.readLine())) {
+            return;
+        }
+        Path workspace = Paths.get(in.readLine());
+        String[] args = new String[Integer.parseInt(in.readLine().trim())];
+        for (int i = 0; i < args.length; i++) {
+            args[i] = in.readLine();
+        }
+        PrintStream out = new PrintStream(socket.getOutputStream(), true, "UTF-8");
+        out.println(START_MARKER);
+        String go;
+        try {
+            go = in.readLine();
+        } catch (IOException e) {
+            go = null;
+        }
+        if (!GO_MARKER.equals(go)) {
+            // cancelled while it waited for the requests before it
+            return;
+        }
+        int status;
+        try {
+            linkWorkspace(workspace);
+            status = run(args, out);
+        } catch (IOException e) {
+            e.printStackTrace(out);
+            status = 1;
+        }
+        out.println(EXIT_MARKER + status);
+        out.flush();
+    }
+
+    void linkWorkspace(Path workspace) throws IOException {
+        try (DirectoryStream<Path> links = Files.newDirectoryStream(runDirectory)) {
+            for (Path link : links) {
+                if (Files.isSymbolicLink(link)) {
+                    Files.delete(link);
+                }
+            }
+        }
+        try (DirectoryStream<Path> entries = Files.newDirectoryStream(workspace)) {
+            for (Path entry : entries) {
+                Files.createSymbolicLink(runDirectory.resolve(entry.getFileName()), entry.toAbsolutePath());
+            }
+        }
+    }
+
+    int run(String[] args, PrintStream out) {
+        PrintStream stdout = System.out;
+        PrintStream stderr = System.err;
+        URLClassLoader loader = takeLoader();
+        System.setOut(out);
+        System.setErr(out);
+        Thread.currentThread().setContextClassLoader(loader);
+        try {
+            Method main = loader.loadClass("Main").getMethod("main", String[].class);
+            main.invoke(null, (Object) args);
+            return 0;
+        } catch (InvocationTargetException e) {
+            if (e.getCause() instanceof ExitCalled) {
+                return ((ExitCalled) e.getCause()).status;
+            }
+            e.getCause().printStackTrace(out);
+            return 1;
+        } catch (ExitCalled e) {
+            return e.status;
+        } catch (Throwable e) {
+            e.printStackTrace(out);
+            return 1;
+        } finally {
+            out.flush();
+            System.setOut(stdout);
+            System.setErr(stderr);
+            Thread.currentThread().setContextClassLoader(GeneratorDaemon.class.getClassLoader());
+            try {
+                loader.close();
+            } catch (IOException e) {
+                e.printStackTrace();
+            }
+            prepareNextLoader();
+        }
+    }
+
+    synchronized void prepareNextLoader() {
+        loaderThread = new Thread(() -> {
+            URLClassLoader loader = newLoader();
+            synchronized (GeneratorDaemon.this) {
+                nextLoader = loader;
+            }
+        }, "class-preloader");
+        loaderThread.setDaemon(true);
+        loaderThread.start();
+    }
+
+    URLClassLoader takeLoader() {
+        try {
+            loaderThread.join();
+        } catch (InterruptedException e) {
+            Thread.currentThread().interrupt();
+        }
+        synchronized (this) {
+            URLClassLoader loader = nextLoader;
+            nextLoader = null;
+            return loader != null ? loader : newLoader();
+        }
+    }
+
+    URLClassLoader newLoader() {
+        URLClassLoader loader;
+        try {
+            loader = new URLClassLoader(new URL[]{compilerJar.toURI().toURL()},
+                    ClassLoader.getSystemClassLoader().getParent());
+        } catch (IOException e) {
+            throw new RuntimeException(e);
+        }
+        try (JarFile jar = new JarFile(compilerJar)) {
+            Enumeration<JarEntry> entries = jar.entries();
+            while (entries.hasMoreElements()) {
+                String name = entries.nextElement().getName();
+                if (name.endsWith(".class") && !name.startsWith("META-INF")) {
+                    try {
+                        Class.forName(name.substring(0, name.length() - 6).replace('/', '.'), false, loader);
+                    } catch (Throwable e) {
+                        // e.g. optional dependencies that are not in the jar
+                    }
+                }
+            }
+        } catch (IOException e) {
+            e.printStackTrace();
+        }
+        return loader;
+    }
+}
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+"""A compact binary file format for solver output, which can be memory-mapped instead of parsed.
+
+    8 bytes     magic, b"MOSISFLD"
+    4 bytes     length of the header, unsigned little-endian
+    header      JSON: version, dtype, shape (the grid points per dimension), columns (their names, coordinates first),
+                coordinates (the names of the coordinate columns) and offset (where the data starts)
+    padding     to a multiple of 64 bytes
+    data        one array of shape per column, one after the other
+
+ExaStencils writes its fields as text (<field>.dat: coordinates and value per line); ExaRunner converts them once
+after the run, and load_field reads the binary file if there is one and the text file otherwise."""
+
+import json
+import os
+import struct
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+magic = b"MOSISFLD"
+format_version = 1
+suffix = ".field"
+alignment = 64
+
+
+def write_field(path, columns, coordinates=("x",), dtype="<f8"):
+    """writes the columns (an OrderedDict name -> array, coordinates first, all of the same shape)"""
+    columns = OrderedDict((name, np.ascontiguousarray(values, dtype=dtype)) for name, values in columns.items())
+    shape = list(next(iter(columns.values())).shape)
+    header = {
+        "version": format_version,
+        "dtype": np.dtype(dtype).str,
+        "shape": shape,
+        "columns": list(columns),
+        "coordinates": list(coordinates),
+        "offset": 0,
+    }
+    # the offset is part of the header, so find out how long the header is with it
+    for i in range(2):
+        header_bytes = json.dumps(header).encode()
+        header["offset"] = -(-(len(magic) + 4 + len(header_bytes)) // alignment) * alignment
+    header_bytes = json.dumps(header).encode()
+    temp_path = str(path) + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(magic)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (header["offset"] - f.tell()))
+        for values in columns.values():
+            f.write(values.tobytes())
+    os.replace(temp_path, str(path))
+
+
+def read_header(path):
+    with open(str(path), 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(str(path) + " is not a field file")
+        length, = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length).decode())
+    if header.get("version") != format_version:
+        raise ValueError(str(path) + " has field file version " + str(header.get("version")))
+    return header
+
+
+def open_field(path):
+    """the header and an OrderedDict of the columns, as read-only arrays mapped from the file, without copying"""
+    header = read_header(path)
+    data = np.memmap(str(path), dtype=np.dtype(header["dtype"]), mode='r', offset=header["offset"],
+                     shape=tuple([len(header["columns"])] + header["shape"]))
+    return header, OrderedDict((name, data[i]) for i, name in enumerate(header["columns"]))
+
+
+def read_text_field(path, data_name):
+    """ExaStencils' text output: x and the value per line, separated by spaces (and a trailing one)"""
+    import pandas as pd
+    df = pd.read_csv(str(path), sep=' ', header=None, index_col=0)
+    try:
+        df.columns = [data_name]
+    except ValueError:  # length mismatch because additional column of nans was read
+        df.columns = [data_name, 'nan']
+    return df.index.values.astype(float), df[data_name].values.astype(float)
+
+
+def convert_text_field(path):
+    """writes <field>.field next to <field>.dat, returns its path"""
+    path = Path(path)
+    x, values = read_text_field(path, path.stem)
+    field_path = path.with_suffix(suffix)
+    write_field(field_path, OrderedDict([("x", x), (path.stem, values)]))
+    return field_path
+
+
+def convert_all(directory):
+    """converts every text field in the directory"""
+    return [convert_text_field(path) for path in sorted(Path(directory).glob("*.dat"))]
+
+
+def load_field(result_path, data_name="u"):
+    """the coordinates and the values of a field the solver wrote into result_path, memory-mapped if it was
+        converted, parsed from the text output otherwise"""
+    field_path = Path(result_path).joinpath(data_name + suffix)
+    if field_path.exists():
+        header, columns = open_field(field_path)
+        return columns[header["coordinates"][0]], columns[data_name]
+    return read_text_field(Path(result_path).joinpath(data_name + ".dat"), data_name)
+
+
+def field_file(result_path, data_name):
+    """the file load_field reads the field from"""
+    field_path = Path(result_path).joinpath(data_name + suffix)
+    if field_path.exists():
+        return field_path
+    return Path(result_path).joinpath(data_name + ".dat")
+
+
+class FieldCache:
+    """the fields loaded last, up to max_bytes of them, by result directory and field name. An entry is only used
+        while the file it was loaded from is unchanged, so a run that overwrites its output is never shown stale"""
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.fields = OrderedDict()  # (result path, field name) -> (file identity, (x, values), size)
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def load(self, result_path, data_name="u"):
+        """like load_field, but from the cache if possible"""
+        path = field_file(result_path, data_name)
+        stat = path.stat()
+        identity = (str(path), stat.st_mtime_ns, stat.st_size)
+        key = (str(Path(result_path).resolve()), data_name)
+        with self.lock:
+            entry = self.fields.get(key)
+            if entry is not None and entry[0] == identity:
+                self.fields.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self.remove(key)
+                self.invalidations += 1
+            self.misses += 1
+        data = load_field(result_path, data_name)
+        size = sum(array.nbytes for array in data)
+        with self.lock:
+            if size <= self.max_bytes:
+                if key in self.fields:
+                    self.remove(key)
+                self.fields[key] = (identity, data, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    self.remove(next(iter(self.fields)))
+                    self.evictions += 1
+        return data
+
+    def remove(self, key):
+        identity, data, size = self.fields.pop(key)
+        self.bytes -= size
+
+    def invalidate(self, result_path):
+        """forgets the fields of a result directory, e.g. before a run writes into it again"""
+        result_path = str(Path(result_path).resolve())
+        with self.lock:
+            for key in [key for key in self.fields if key[0] == result_path]:
+                self.remove(key)
+                self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "fields": len(self.fields),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+# shared by everything in the kernel that loads results, cf. MOSIS_FIELD_CACHE_BYTES
+field_cache = FieldCache(int(os.environ.get("MOSIS_FIELD_CACHE_BYTES", 256 * 1024 ** 2)))
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""Talks to a long-lived JVM that keeps the ExaStencils compiler loaded (cf. exastencils/GeneratorDaemon.java),
+so that generating code does not start a new JVM every time.
+
+The daemon is compiled with javac on first use and started on demand; it is shared by all kernels of the user,
+through the state file with its port and token in ~/exastencils/daemon, and ends after half an hour without
+requests. It generates one configuration at a time. If there is no JDK, or the daemon cannot be started,
+ExaRunner starts java itself, as before. Set MOSIS_GENERATOR_DAEMON=0 to never use the daemon."""
+
+import fcntl
+import json
+import os
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from .exaoutput import default_exastencils_path
+
+start_marker = "@@mosis-generator-start"
+go_marker = "@@mosis-generator-go"
+exit_marker = "@@mosis-generator-exit "
+source_path = Path(os.path.dirname(__file__)).joinpath("exastencils", "GeneratorDaemon.java")
+
+
+def java_major_version(java="java"):
+    """e.g. 8 for 'version "1.8.0_292"', 17 for 'version "17.0.2"', or None"""
+    try:
+        completed = subprocess.run([java, "-version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError:
+        return None
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', completed.stdout.decode(errors='replace'))
+    if match is None:
+        return None
+    major = int(match.group(1))
+    if major == 1 and match.group(2) is not None:
+        major = int(match.group(2))
+    return major
+
+
+class GeneratorDaemon:
+
+    def __init__(self, compiler_jar, daemon_path=None, idle_seconds=1800, start_timeout=30):
+        self.compiler_jar = Path(compiler_jar).resolve()
+        if daemon_path is None:
+            daemon_path = default_exastencils_path().joinpath("daemon")
+        self.daemon_path = Path(daemon_path)
+        self.classes_path = self.daemon_path.joinpath("classes")
+        self.run_path = self.daemon_path.joinpath("run")
+        self.state_path = self.daemon_path.joinpath("daemon.json")
+        self.idle_seconds = idle_seconds
+        self.start_timeout = start_timeout
+        # set when the daemon could not be compiled or started, so that it is not tried for every run
+        self.broken = False
+        self.lock = threading.Lock()
+
+    def read_state(self):
+        """the port, token and pid of the running daemon, or None"""
+        try:
+            with open(str(self.state_path)) as f:
+                state = json.load(f)
+            os.kill(state["pid"], 0)
+        except (OSError, ValueError, KeyError):
+            return None
+        return state
+
+    def compile(self):
+        class_file = self.classes_path.joinpath("GeneratorDaemon.class")
+        if class_file.exists() and class_file.stat().st_mtime >= source_path.stat().st_mtime:
+            return
+        os.makedirs(str(self.classes_path), exist_ok=True)
+        subprocess.run(["javac", "-nowarn", "-d", str(self.classes_path), str(source_path)],
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True)
+
+    def start(self):
+        self.compile()
+        args = ["java"]
+        if 12 <= (java_major_version() or 8) < 24:
+            # to be allowed to catch System.exit in the generator; from 24 on there is no security manager at all
+            args.append("-Djava.security.manager=allow")
+        args += ["-cp", str(self.classes_path), "GeneratorDaemon", str(self.compiler_jar), str(self.run_path),
+                 str(self.state_path), str(self.idle_seconds)]
+        # Main resolves its relative paths against the working directory, where the workspace gets linked
+        os.makedirs(str(self.run_path), exist_ok=True)
+        with open(str(self.daemon_path.joinpath("daemon.log")), 'a') as log:
+            process = subprocess.Popen(args, cwd=str(self.run_path), stdin=subprocess.DEVNULL, stdout=log,
+                                       stderr=subprocess.STDOUT, start_new_session=True)
+        deadline = time.monotonic() + self.start_timeout
+        while time.monotonic() < deadline:
+            state = self.read_state()
+            if state is not None and state["pid"] == process.pid:
+                return state
+            if process.poll() is not None:
+                break
+            time.sleep(0.05)
+        process.kill()
+        raise OSError("the generator daemon did not start, cf. " + str(self.daemon_path.joinpath("daemon.log")))
+
+    def ensure_running(self):
+        """the state of the daemon, started if need be, or None if there is none and cannot be one"""
+        if self.broken:
+            return None
+        with self.lock:
+            state = self.read_state()
+            if state is not None:
+                return state
+            os.makedirs(str(self.daemon_path), exist_ok=True)
+            # so that kernels starting at the same time do not start a daemon each
+            with open(str(self.daemon_path.joinpath("start.lock")), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                state = self.read_state()
+                if state is not None:
+                    return state
+                try:
+                    return self.start()
+                except (OSError, subprocess.CalledProcessError):
+                    self.broken = True
+                    return None
+
+    def generate(self, workspace, args, output_function, timeout=None, is_cancelled=None):
+        """runs the generator's Main with args in the workspace, passing on the output line by line.
+            Returns the exit status and whether it timed out, or None if the daemon is not available.
+            The timeout counts from when the daemon starts this request, not while it is busy with another kernel's.
+            A request cancelled while it waits is dropped by the daemon, which only runs it after the go marker;
+            on timeout or cancellation during the run the daemon is killed, and the next run starts a new one"""
+        state = self.ensure_running()
+        if state is None:
+            return None
+        try:
+            connection = socket.create_connection(("127.0.0.1", state["port"]), timeout=5)
+        except OSError:
+            return None
+        started = False
+        deadline = None
+        # the daemon links what is in the workspace; the generator writes to generated/<probname>
+        os.makedirs(str(Path(workspace).joinpath("generated")), exist_ok=True)
+        with connection:
+            request = [state["token"], str(Path(workspace).resolve()), str(len(args))] + list(args)
+            connection.sendall(("\n".join(request) + "\n").encode())
+            connection.settimeout(0.1)
+            buffered = b''
+            while True:
+                timed_out = deadline is not None and time.monotonic() > deadline
+                if timed_out or (is_cancelled is not None and is_cancelled()):
+                    if started:
+                        # it is running this request, nobody else's
+                        self.stop(state)
+                    return 1, timed_out
+                try:
+                    chunk = connection.recv(1 << 16)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    # the daemon died, e.g. because the generator called System.exit - better run it again
+                    return None
+                lines = (buffered + chunk).split(b'\n')
+                buffered = lines.pop()
+                for line in lines:
+                    line = line.decode(errors='replace')
+                    if line == start_marker:
+                        if is_cancelled is not None and is_cancelled():
+                            # closing the connection without the go marker drops the request
+                            return 1, False
+                        connection.sendall((go_marker + "\n").encode())
+                        started = True
+                        if timeout is not None:
+                            deadline = time.monotonic() + timeout
+                        continue
+                    if line.startswith(exit_marker):
+                        return int(line[len(exit_marker):]), False
+                    output_function(line)
+
+    def stop(self, state=None):
+        state = state or self.read_state()
+        if state is None:
+            return
+        try:
+            os.killpg(state["pid"], signal.SIGKILL)
+        except OSError:
+            pass
+        try:
+            os.remove(str(self.state_path))
+        except OSError:
+            pass
+
+
+_generator = None
+
+
+def get_generator():
+    """the daemon for the installed compiler.jar, or None if it is disabled or there is no JDK"""
+    global _generator
+    if _generator is None:
+        compiler_jar = default_exastencils_path().joinpath("compiler.jar")
+        if os.environ.get("MOSIS_GENERATOR_DAEMON", "1") == "0" or not compiler_jar.exists() \
+                or shutil.which("java") is None or shutil.which("javac") is None:
+            return None
+        _generator = GeneratorDaemon(compiler_jar)
+    return _generator
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+"""The texts the interview starts with. They do not depend on anything the user says,
+so the greeting is rendered here as static text - for kernel.js at install time, and on kernel launch -
+without constructing a kernel or a state machine."""
+
+import getpass
+
+banner_template = \
+"""**Hello, {username}! I am MoSIS 1.0, your partial differential equations and simulations tool.**
+Let's set up a model and simulation.
+
+To see a recap of what we know so far, enter `recap <optional keyword>`. 
+To interactively visualize the current theory graph, enter `tgwiev` or `tgview mpd`. 
+Otherwise, you can always answer with \\LaTeX-type input.
+
+
+"""
+#To get explanations, enter `explain <optional keyword>`.
+#You can inspect the currently loaded MMT theories under http://localhost:43397  #TODO
+
+# what the state machine says on the way from the greeting to the first question
+modeling_heading = "Modeling"
+dimensions_question = "How many dimensions does your model have?"
+dimensions_assumption = "I am just assuming it's 1, since that is all we can currently handle."
+domain_question = "What is the domain in your model?     Ω : type ❘ = [?;?], e.g. `\\\\Omega = [0.0;1.0]`"
+# double to actually make it a Markdown newline
+empty_line = "\n\n"
+
+
+def banner(username=None):
+    if username is None:
+        username = getpass.getuser()
+    return banner_template.format(username=username)
+
+
+def render_greeting(username=None):
+    """the banner and the first question, as the state machine would put them out after the first input"""
+    lines = [
+        "## " + modeling_heading,
+        empty_line,
+        dimensions_question,
+        empty_line,
+        dimensions_assumption,
+        empty_line,
+        empty_line,
+        domain_question,
+    ]
+    return banner(username) + "".join(line + "\n" for line in lines)
@@ -3,7 +3,8 @@ import json
 import os
 import sys
 
-from .interview_kernel import Interview
+from . import greeting
+from . import payloads
 
 from jupyter_client.kernelspec import KernelSpecManager
 from IPython.utils.tempdir import TemporaryDirectory
@@ -21,17 +22,23 @@ kernel_json = {
 }
 
 
-def install_my_kernel_spec(user=True, prefix=None):
+def install_my_kernel_spec(user=True, prefix=None, warm_pool=0):
     with TemporaryDirectory() as td:
         os.chmod(td, 0o755)  # Starts off as 700, not user readable
+        spec = dict(kernel_json)
+        if warm_pool > 0:
+            # keep kernels started ahead of time, cf. warm_pool.py
+            spec["metadata"] = {"kernel_provisioner": {"provisioner_name": "mosis-warm-pool",
+                                                       "config": {"pool_size": warm_pool}}}
         with open(os.path.join(td, 'kernel.json'), 'w') as f:
-            json.dump(kernel_json, f, sort_keys=True)
+            json.dump(spec, f, sort_keys=True)
         try:
-            interview = Interview(True)
             with open(os.path.join(td, 'kernel.js'), 'w') as f:
-                # javascript code that sets an initial markdown cell in every new notebook
+                # javascript code that sets an initial markdown cell in every new notebook,
+                # and defines the function behind the toggle buttons
                 js = """define(['base/js/namespace'], function(Jupyter)
                         {{
+                            {}
                             function onload()
                             {{
                                 if (Jupyter.notebook.get_cells().length ===1)
@@ -44,7 +51,7 @@ def install_my_kernel_spec(user=True, prefix=None):
                             return {{
                                 onload: onload
                             }};
-                        }});""".format(interview.my_markdown_greeting.replace("`", "\\`"))
+                        }});""".format(payloads.toggle_script, greeting.render_greeting().replace("`", "\\`"))
 
                 f.write(js)
                 # print(js)
@@ -83,6 +90,8 @@ def main(argv=None):
     ap.add_argument('--prefix',
         help="Install to the given prefix. "
              "Kernelspec will be installed in {PREFIX}/share/jupyter/kernels/")
+    ap.add_argument('--warm-pool', type=int, default=0, metavar='N',
+        help="Have the Jupyter server keep N kernels started ahead of time, for faster notebook startup")
     args = ap.parse_args(argv)
 
     if args.sys_prefix:
@@ -90,7 +99,7 @@ def main(argv=None):
     if not args.prefix and not _is_root():
         args.user = True
 
-    install_my_kernel_spec(user=args.user, prefix=args.prefix)
+    install_my_kernel_spec(user=args.user, prefix=args.prefix, warm_pool=args.warm_pool)
 
 if __name__ == '__main__':
     main()
@@ -230,4 +230,8 @@ class Interview(cmd.Cmd):
         }
 
 if __name__ == '__main__':
-    Interview().cmdloop()
+    interview = Interview()
+    try:
+        interview.cmdloop()
+    finally:
+        interview.state_machine.close()
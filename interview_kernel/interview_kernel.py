@@ -4,23 +4,29 @@ from os.path import join
 from metakernel import MetaKernel
 from IPython.display import HTML, Javascript
 from metakernel import IPythonKernel
-import ipywidgets as widgets
 
 # http://mattoc.com/python-yes-no-prompt-cli.html
-# https://github.com/phfaist/pylatexenc for directly converting Latex commands to unicode
-from pylatexenc.latex2text import LatexNodes2Text
 import getpass
-from bokeh.io import output_notebook
+import threading
 
 from . import pde_state_machine
 #import pde_state_machine
 from . import string_handling
 #import string_handling
+from .outputstream import OutputStream
+from .worker import BackgroundWorker, Cancelled
+from . import payloads
+from . import completion
+from . import greeting
+from . import jobqueue
+from html import escape
 from distutils.util import strtobool
 
 
 """This is a Jupyter kernel derived from MetaKernel. To use it, install it with the install.py script and run 
-"jupyter notebook --debug --NotebookApp.token='' " from terminal. """
+"jupyter notebook --debug --NotebookApp.token='' " from terminal. 
+The plotting, widget and LaTeX libraries are only imported where they are first used, to keep kernel startup fast;
+cf. benchmarks.py."""
 
 
 class Interview(MetaKernel):
@@ -36,18 +42,7 @@ class Interview(MetaKernel):
         'help_links': MetaKernel.help_links,
     }
 
-    banner = \
-"""**Hello, """ + getpass.getuser() + """! I am MoSIS 1.0, your partial differential equations and simulations tool.**
-Let's set up a model and simulation.
-
-To see a recap of what we know so far, enter `recap <optional keyword>`. 
-To interactively visualize the current theory graph, enter `tgwiev` or `tgview mpd`. 
-Otherwise, you can always answer with \LaTeX-type input.
-
-
-"""
-    #To get explanations, enter `explain <optional keyword>`.
-    #You can inspect the currently loaded MMT theories under http://localhost:43397  #TODO
+    banner = greeting.banner(getpass.getuser())
 
     def __init__(self, install_run=False, **kwargs):
 
@@ -59,62 +54,101 @@ Otherwise, you can always answer with \LaTeX-type input.
         # from metakernel import register_ipython_magics
         # register_ipython_magics()
 
-        self.poutstring = ""# to collect string output to send
-        self.outstream_name = 'stdout'
+        # to stream string output to the front end while the cell is running
+        self.output_stream = OutputStream(self.send_output)
+
+        # the texts behind the toggle buttons, served to the front end through a comm
+        self.payload_store = payloads.PayloadStore()
+        # the scripts (toggle buttons, BokehJS) already sent, per front end session
+        self.frontend_resources = {}
+        # the ids of the displays that are updated in place, e.g. plots of ever finer solutions
+        self.display_ids = set()
+        self.comm_manager.register_target(payloads.comm_target_name, self.payload_comm_opened)
+        # the zoom requests of result plots
+        self.comm_manager.register_target("mosis_plot", self.plot_comm_opened)
 
         self.state_machine, self.my_markdown_greeting = self.set_initial_message(install_run)
-        self.toggle_button_counter = 0
+        # for tab completion; the background theories' constants are added as soon as MMT answers
+        self.completion_index = completion.SymbolIndex()
+        if not install_run:
+            self.completion_index.index_theories_in_background(pde_state_machine.PDE_States.background_theory_names())
+            threading.Thread(target=self.state_machine.mmtinterface.warm_up, daemon=True).start()
+        # the input is handled in a worker thread, so that kernel interrupts can cancel it
+        self.worker = BackgroundWorker(self.state_machine.cancel, self.report_progress)
 
         self.update_prompt()
-        # bokeh notebook setup
-        output_notebook()
 
     def set_initial_message(self, install_run=False):
+        # a new interview replaces the old one, which must let go of the shared state machine
+        if getattr(self, "state_machine", None) is not None:
+            self.state_machine.close()
         # set it up -- without server communication capabilities if we are just installing
         self.state_machine = pde_state_machine.PDE_States(self.poutput, self.update_prompt, self.please_prompt,
                                                      self.display_html, install_run, self.toggle_show_button)
-        # already send some input to state machine, to capture initial output and have it displayed via kernel.js
-        # /  not displayed in the real thing
-        self.state_machine.handle_state_dependent_input("anything")   # TODO compatibility with not-notebook?
-        my_markdown_greeting = Interview.banner + self.poutstring
-        self.poutstring = ""
+        # already send some input to state machine, to get to the first question; what it says there is
+        # displayed via kernel.js, cf. greeting.py - not displayed in the real thing
+        with self.output_stream.capture():
+            self.state_machine.handle_state_dependent_input("anything")   # TODO compatibility with not-notebook?
+        my_markdown_greeting = greeting.render_greeting(getpass.getuser())
         return self.state_machine, my_markdown_greeting
 
+    def do_shutdown(self, restart):
+        # let go of the shared state machine; on a restart, restart_kernel sets up a new interview instead
+        if not restart:
+            self.state_machine.close()
+        return super(Interview, self).do_shutdown(restart)
+
+    def restart_kernel(self):
+        self.state_machine, self.my_markdown_greeting = self.set_initial_message()
+        self.worker.cancel_function = self.state_machine.cancel
+        self.update_prompt()
+
     def poutput(self, text, outstream_name='stdout'):
-        """Accumulate the output here"""
-        self.poutstring += str(text) + "\n"
-        self.outstream_name = outstream_name
+        """Stream the output to the front end"""
+        self.output_stream.write(str(text) + "\n", outstream_name)
+
+    def send_output(self, msg_type, content):
+        self.send_response(self.iopub_socket, msg_type, content)
+
+    def Display(self, *objects, **kwargs):
+        # send the text that came before, and have text that comes after appear below
+        self.output_stream.end_segment()
+        super(Interview, self).Display(*objects, **kwargs)
 
     ############# input processing if not explain or undo
     # def do_execute(self, code, silent=False, store_history=True, user_expressions=None,
     #                allow_stdin=False):
     def do_execute_direct(self, code, silent=False, allow_stdin=True):
         """This is where the user input enters our code"""
-
-        arg = string_handling.replace_times_to_cdot(LatexNodes2Text().latex_to_text(code)).strip()
-
+        arg = string_handling.replace_times_to_cdot(string_handling.latex_to_text(code)).strip()
+
+        self.output_stream.silent = silent
+        self.state_machine.resume()
+        try:
+            self.worker.run(self.handle_input, arg)
+        except Cancelled:
+            self.poutput("Cancelled. We are still at " + self.state_machine.state + ".", 'stderr')
+        finally:
+            # the rest of the output, and the next cell's output goes into a new display
+            self.output_stream.end_segment()
+            self.output_stream.silent = False
+            self.completion_index.add_simdata(self.state_machine.simdata)
+
+        return
+
+    def handle_input(self, arg):
         if not self.keyword_handling(arg):
             if not self.prompt_input_handling(arg):
                 self.state_machine.handle_state_dependent_input(arg)
 
-        if not silent:
-            if self.outstream_name == "stderr": #TODO make errors markdown but red
-                # string output
-                stream_content = {'name': self.outstream_name, 'text': self.poutstring}
-                self.send_response(self.iopub_socket, 'stream', stream_content)
-            else:
-                # for other mime types, cf. http://ipython.org/ipython-doc/stable/notebook/nbformat.html
-                data_content = {"data": {
-                                            "text/markdown": self.poutstring,
-                                        },
-                                "metadata": {}
-                                }
-                self.send_response(self.iopub_socket, 'display_data', data_content)
-
-        self.poutstring = ""
-        self.outstream_name = 'stdout'
-
-        return  # stream_content['text']
+    def report_progress(self, seconds):
+        exarunner = self.state_machine.exarunner
+        phase = exarunner.phase_elapsed() if exarunner is not None else None
+        if phase is not None:
+            self.poutput("still working... (" + str(int(seconds)) + " s, ExaStencils " + phase[0] + " phase for "
+                         + str(int(phase[1])) + " s)")
+        else:
+            self.poutput("still working... (" + str(int(seconds)) + " s)")
 
     def please_prompt(self, query, if_yes, if_no=None, pass_other=False):
         self.poutput(str(query)) # + " [y/n]? ")
@@ -166,11 +200,32 @@ Otherwise, you can always answer with \LaTeX-type input.
         if arg.startswith("widget"):
             self.display_widget()
             return True
+        if arg.startswith("jobs"):
+            self.display_jobs(arg)
+            return True
         if arg.startswith("omdoc"):
-            self.poutput(self.state_machine.mmtinterface.get_omdoc_theories())
+            self.toggle_show_button("Show omdoc", escape(self.state_machine.mmtinterface.get_omdoc_theories()))
             return True
         return False
 
+    def display_jobs(self, arg):
+        """'jobs' shows the ExaStencils jobs of this kernel, 'jobs cancel <id>' cancels one"""
+        queue = jobqueue.get_queue()
+        words = arg.split()
+        if len(words) == 3 and words[1] == "cancel":
+            if not queue.cancel(words[2]):
+                self.poutput("There is no job " + words[2], 'stderr')
+                return
+        if not queue.jobs:
+            self.poutput("No ExaStencils jobs so far.")
+            return
+        self.poutput(queue.status_table())
+        from .fieldfile import field_cache
+        stats = field_cache.stats()
+        self.poutput("Loaded fields: {fields} in memory, {mb:.1f} of {max_mb:.0f} MB, {hits} hits, {misses} misses, "
+                     "{evictions} evicted, {invalidations} invalidated".format(
+                         mb=stats["bytes"] / 1024 ** 2, max_mb=stats["max_bytes"] / 1024 ** 2, **stats))
+
     # called when user types 'explain [expression]'
     def do_explain(self, expression):
         "Explain an expression or the theoretical background to what we are currently looking for"
@@ -199,52 +254,75 @@ Otherwise, you can always answer with \LaTeX-type input.
         self.prompt = "(" + self.state_machine.state + ")" #TODO
 
     def toggle_show_button(self, button_text, hidden_text):
-        # have a running id to uniquely identify the texts and buttons
-        self.toggle_button_counter += 1
-        counter_str = str(self.toggle_button_counter)
         # use html line breaks and have html display verbatim
         hidden_text = hidden_text.replace("\n", "<br>")
+        payload_id = self.payload_store.put(hidden_text)
+
+        html = payloads.button_html(button_text, payload_id)
+        if self.first_use_in_frontend("toggle"):
+            # in case kernel.js did not define it already
+            html = "<script>" + payloads.toggle_script + "</script>" + html
+        self.Display(HTML(html))
+
+    def first_use_in_frontend(self, resource):
+        """whether the resource (some script) still has to be sent to the front end that sent the current request.
+        Every notebook connection has its own session id, so a reloaded or second browser tab gets its own copy"""
+        try:
+            frontend = self.get_parent()["header"]["session"]
+        except (AttributeError, KeyError):
+            frontend = None
+        loaded = self.frontend_resources.setdefault(frontend, set())
+        if resource in loaded:
+            return False
+        loaded.add(resource)
+        return True
+
+    def payload_comm_opened(self, comm, msg):
+        """the front end asks for the text behind a toggle button"""
+        payload_id = msg['content']['data'].get('id')
+        comm.send({'id': payload_id, 'text': self.payload_store.get(payload_id)})
+        comm.close()
+
+    def plot_comm_opened(self, comm, msg):
+        """the front end asks for the data of a zoomed-in plot range"""
+        if self.state_machine.plots is None:
+            comm.send({"data": None})
+            comm.close()
+        else:
+            self.state_machine.plots.comm_opened(comm, msg)
 
-        self.Display(HTML('''
-                    <div id="stacktrace''' + counter_str + '''"  style="display:none;"> ''' + hidden_text + '''</div>
-                    <input id="button''' + counter_str + '''" type="button" name="button''' + counter_str + '''" value="''' + button_text + '''" onclick="toggle()" />
-                    <script>
-                        function toggle() {
-                            var elem = document.getElementById("button''' + counter_str + '''")
-                            if(elem.value == "''' + button_text + '''"){
-                                elem.value = "Hide";
-                                document.getElementById("stacktrace''' + counter_str + '''").style.display = "block";
-                            }
-                            else {
-                                elem.value = "''' + button_text + '''";
-                                document.getElementById("stacktrace''' + counter_str + '''").style.display = "none";
-                            }
-                        }
-                    </script>
-            '''))
-
-    # tab completion for empty lines
+    # tab completion
     def do_complete(self, code, cursor_pos):
-        """Override of cmd2 method which completes command names both for command completion and help."""
+        """Completes the default input for the current state on empty lines, and names from the local symbol index
+        otherwise, without asking MMT"""
         # define the "default" input for the different states we can be in
         state_dependent_default_input = {
             'greeting': 'hi',
             'dimensions': '1',
-            'domain': ['Ω = [ 0 ; 1 ]'],
-            'unknowns': ['u : Ω → ℝ'],
-            'parameters': ['f :  ℝ → ℝ = [x: ℝ] x '],  # ['f : Ω → ℝ = [x:Ω] x ⋅ x'],
-            'pdes': ['∆u = f(x)'],
-            'bcs': ['u = 0'],  # ,'u (1) = x_1**2'],
-            'sim': ['FD'],
+            'domain': 'Ω = [ 0 ; 1 ]',
+            'unknowns': 'u : Ω → ℝ',
+            'parameters': 'f :  ℝ → ℝ = [x: ℝ] x ',  # 'f : Ω → ℝ = [x:Ω] x ⋅ x',
+            'pdes': '∆u = f(x)',
+            'bcs': 'u = 0',  # ,'u (1) = x_1**2',
+            'sim': 'FD',
         }
-        if not code or state_dependent_default_input[self.state_machine.state].startswith(code):
-            return state_dependent_default_input[self.state_machine.state]
+        if cursor_pos is None:
+            cursor_pos = len(code)
+        default_input = state_dependent_default_input.get(self.state_machine.state)
+        if not code[:cursor_pos].strip() and default_input:
+            matches, cursor_start = [default_input], 0
         else:
-            # Call super class method.
-            super(Interview, self).do_complete(code, cursor_pos)
-            return
+            matches, cursor_start = self.completion_index.complete(code, cursor_pos)
+        return {
+            'matches': matches,
+            'cursor_start': cursor_start,
+            'cursor_end': cursor_pos,
+            'metadata': {},
+            'status': 'ok',
+        }
 
-    def display_html(self, code=None):
+    def display_html(self, code=None, needs_bokeh=False, display_id=None):
+        """displays the html; with a display_id, it replaces what was displayed with the same id before"""
 
         # highlight some of the code entered and show line numbers (just to play around)
         #self.Display(HTML("""
@@ -265,9 +343,21 @@ Otherwise, you can always answer with \LaTeX-type input.
         #</script>
         #                    """ % (1, 0, 3, 0)))
 
-        output_notebook()
         if code:
-            self.Display(HTML(code))
+            if needs_bokeh and self.first_use_in_frontend("bokeh"):
+                # load BokehJS lazily with the first plot
+                from .plotting import bokeh_resources_html
+                code = bokeh_resources_html() + code
+            if display_id is None:
+                self.Display(HTML(code))
+                return
+            self.output_stream.end_segment()
+            msg_type = 'update_display_data' if display_id in self.display_ids else 'display_data'
+            self.display_ids.add(display_id)
+            self.send_output(msg_type, {"data": {"text/html": code},
+                                        "metadata": {},
+                                        "transient": {"display_id": display_id},
+                                        })
 
     def display_tgview(self, args=''):
         """displays the theory graph viewer as html, cf. https://github.com/UniFormal/TGView/wiki/"""
@@ -311,6 +401,7 @@ Otherwise, you can always answer with \LaTeX-type input.
 
     def display_widget(self):
         # needs jupyter nbextension enable --py widgetsnbextension
+        import ipywidgets as widgets
         from IPython.display import display
         from IPython.core.formatters import IPythonDisplayFormatter
         w = widgets.ToggleButton(
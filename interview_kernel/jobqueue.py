@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+"""Runs ExaStencils jobs in parallel, each in its own workspace.
+
+Every job gets a copy of the exastencils directory (cf. create_workspace) with its own examples.sh, Debug and
+generated folders, so simulations from several kernels, or several models of a sweep, do not clobber each other.
+A kernel's jobs run on a thread pool; how many run at once on the whole machine is bounded by lock files, one per
+core, that all kernels share. The workspaces of finished jobs are removed, oldest first, once they take up more
+than 2 GB."""
+
+import contextvars
+import fcntl
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import gettempdir
+
+from .cache import directory_size, get_build_cache
+from .exaoutput import ExaOutput, ExaRunner, create_workspace, default_exastencils_path
+from .generator_daemon import get_generator
+from .worker import Cancelled
+
+
+def default_workspace_root():
+    return default_exastencils_path().joinpath("jobs")
+
+
+# held by a job from when it is submitted until it is finished, cf. prune_workspaces
+workspace_lock_name = "job.lock"
+
+
+def prune_workspaces(workspace_root, max_bytes, min_age=600):
+    """removes the workspaces of finished jobs, oldest first, until the rest take up no more than max_bytes.
+        A job is finished when nobody holds its lock file; its workspace stays for min_age seconds after that,
+        so that its results can still be shown and stored. Returns the number of workspaces removed"""
+    workspace_root = Path(workspace_root)
+    if not workspace_root.is_dir():
+        return 0
+    finished = []
+    total = 0
+    now = time.time()
+    for path in workspace_root.iterdir():
+        if not path.is_dir():
+            continue
+        size = directory_size(path)
+        total += size
+        lock_path = path.joinpath(workspace_lock_name)
+        try:
+            # the lock file is touched when the job finishes; a workspace without one is still being created
+            age = now - os.stat(str(lock_path if lock_path.exists() else path)).st_mtime
+            with open(str(lock_path), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        except OSError:
+            continue
+        if age >= min_age:
+            finished.append((now - age, size, path))
+    removed = 0
+    for finished_time, size, path in sorted(finished, key=lambda f: f[0]):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(str(path), ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+def progressive_levels(output_function=None):
+    """the coarser levels to solve on as well, so that there is something to see before the finest level is done;
+        from MOSIS_PROGRESSIVE_LEVELS, e.g. "8,11", none by default. What is not such a level is skipped, and
+        passed to output_function"""
+    levels = set()
+    for level in os.environ.get("MOSIS_PROGRESSIVE_LEVELS", "").split(","):
+        if not level.strip():
+            continue
+        try:
+            if ExaOutput.min_level <= int(level) < ExaOutput.max_level:
+                levels.add(int(level))
+                continue
+        except ValueError:
+            pass
+        if output_function is not None:
+            output_function("ignoring " + repr(level.strip()) + " in MOSIS_PROGRESSIVE_LEVELS, the levels are from "
+                            + str(ExaOutput.min_level) + " to " + str(ExaOutput.max_level - 1))
+    return sorted(levels)
+
+
+def default_build_tree_root():
+    """where each configuration is built, so that the next build of the same configuration is incremental"""
+    return default_exastencils_path().joinpath("builds")
+
+
+class NodeSlots:
+    """at most size runs at the same time on this machine, across processes, with one lock file per slot"""
+
+    def __init__(self, size=None, lock_path=None):
+        self.size = size or os.cpu_count() or 1
+        if lock_path is None:
+            lock_path = Path(gettempdir()).joinpath("mosis_exastencils_slots")
+        self.lock_path = Path(lock_path)
+        os.makedirs(str(self.lock_path), exist_ok=True)
+
+    @contextmanager
+    def acquire(self, is_cancelled=None, poll_interval=0.2):
+        """waits for a free slot; the lock goes away with the process, should it die"""
+        while True:
+            for i in range(self.size):
+                lock_file = open(str(self.lock_path.joinpath("slot" + str(i) + ".lock")), 'w')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    continue
+                try:
+                    yield i
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    lock_file.close()
+                return
+            if is_cancelled is not None and is_cancelled():
+                raise Cancelled("ExaStencils job cancelled while waiting")
+            time.sleep(poll_interval)
+
+
+class ExaJob:
+    """one generate / compile / run of a configuration; status is one of queued, running, done, failed, cancelled"""
+
+    def __init__(self, name, exaout, output_function=None, make_jobs=None, build_cache=None, generator=None,
+                 build_tree=None):
+        self.id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.exaout = exaout
+        self.runner = ExaRunner(exaout, output_function, make_jobs=make_jobs, build_cache=build_cache,
+                                generator=generator, build_tree=build_tree)
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.future = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # so that prune_workspaces leaves the workspace alone until the job is finished
+        self.lock_file = open(str(self.workspace.joinpath(workspace_lock_name)), 'w')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+
+    @property
+    def workspace(self):
+        return self.exaout.exastencils_path
+
+    def progress(self):
+        """a short description of where the job is, e.g. 'compile phase for 12 s'"""
+        if self.status == "queued":
+            return "waiting for {:.0f} s".format(time.time() - self.submitted)
+        phase = self.runner.phase_elapsed()
+        if self.status == "running" and phase is not None:
+            return "{} phase for {:.0f} s".format(*phase)
+        if self.result is not None:
+            return ", ".join("{} {:.1f} s".format(p, d) for p, d in self.result.phase_durations.items())
+        return self.error or ""
+
+    def release(self):
+        """marks the workspace as no longer used, from now on prune_workspaces may remove it"""
+        if self.lock_file is not None:
+            os.utime(self.lock_file.fileno())
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+
+    def cancel(self):
+        if self.future is not None:
+            self.future.cancel()
+        self.runner.cancel()
+
+    def wait(self):
+        """blocks until the job is finished and returns its ExaRunResult; raises Cancelled if it was cancelled"""
+        try:
+            return self.future.result()
+        except CancelledError:
+            raise Cancelled("ExaStencils job cancelled")
+
+
+class ExaJobQueue:
+    """runs up to max_workers jobs of this process at a time, and no more than the machine has slots"""
+
+    def __init__(self, max_workers=None, workspace_root=None, slots=None, build_cache=None, generator=None,
+                 build_tree_root=None, workspace_bytes=None):
+        self.build_cache = build_cache
+        self.generator = generator
+        self.cores = os.cpu_count() or 1
+        self.max_workers = max_workers or self.cores
+        self.workspace_root = Path(workspace_root) if workspace_root is not None else None
+        self.build_tree_root = Path(build_tree_root) if build_tree_root is not None else None
+        # how much the workspaces of finished jobs may take up, cf. MOSIS_JOB_WORKSPACES_BYTES
+        if workspace_bytes is None:
+            workspace_bytes = int(os.environ.get("MOSIS_JOB_WORKSPACES_BYTES", 2 * 1024 ** 3))
+        self.workspace_bytes = workspace_bytes
+        self.slots = slots if slots is not None else NodeSlots()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="exastencils-job")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, simdata, username="user", probname=None, output_function=None, max_level=None):
+        """generates the configuration files in a new workspace and queues the job, returns the ExaJob;
+            max_level overrides ExaOutput's finest level"""
+        name = probname or username
+        if max_level is not None:
+            name += "_level" + str(max_level)
+        workspace_root = self.workspace_root or default_workspace_root()
+        prune_workspaces(workspace_root, self.workspace_bytes)
+        workspace = create_workspace(workspace_root.joinpath(name + "_" + uuid.uuid4().hex[:8]))
+        exaout = ExaOutput(simdata, username, probname, exastencils_path=workspace, max_level=max_level)
+        # every compile may use all cores; make -l keeps jobs compiling at the same time from overloading them
+        job = ExaJob(name, exaout, output_function,
+                     build_cache=self.build_cache, generator=self.generator,
+                     build_tree=(self.build_tree_root or default_build_tree_root()).joinpath(name))
+        with self.lock:
+            self.jobs[job.id] = job
+        # in the submitting context, so that output still goes to the cell that started the job
+        job.future = self.executor.submit(contextvars.copy_context().run, self.run_job, job)
+        # also when the job is cancelled before it runs
+        job.future.add_done_callback(lambda future: job.release())
+        return job
+
+    def run_job(self, job):
+        try:
+            with self.slots.acquire(lambda: job.runner.cancelled):
+                job.status = "running"
+                job.started = time.time()
+                job.result = job.runner.run_exastencils()
+            job.status = "done" if job.result.ok else "failed"
+        except Cancelled:
+            job.status = "cancelled"
+            raise
+        except Exception as error:
+            job.status = "failed"
+            job.error = repr(error)
+            raise
+        finally:
+            job.finished = time.time()
+        return job.result
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancel()
+        if job.status == "queued" and job.future.cancelled():
+            job.status = "cancelled"
+        return True
+
+    def status_table(self):
+        """the jobs as a markdown table"""
+        lines = ["| job | name | status | progress | workspace |",
+                 "|---|---|---|---|---|"]
+        with self.lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            lines.append("| " + " | ".join([job.id, job.name, job.status, job.progress(), str(job.workspace)]) + " |")
+        return "\n".join(lines)
+
+    def shutdown(self, wait=False):
+        for job in list(self.jobs.values()):
+            if job.status in ("queued", "running"):
+                job.cancel()
+        self.executor.shutdown(wait=wait)
+
+
+# one queue per kernel process
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = ExaJobQueue(build_cache=get_build_cache(), generator=get_generator())
+        return _queue
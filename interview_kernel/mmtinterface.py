@@ -13,6 +13,10 @@ from contextlib import closing
 #from urllib.parse import urlencode # is what we actually want to use
 from lxml import etree
 #from openmath import openmath
+from functools import lru_cache
+
+from . import string_handling
+from .worker import Cancelled
 
 
 #def start_mmt_server(port_number, mmtjar):
@@ -93,6 +97,243 @@ class MMTServerError(Exception):
         super(MMTServerError, self).__init__("MMT server error: " + str(self.error), longerr)
 
 
+class MMTType:
+    """A type as returned by MMT: a constant, an arrow type, a Pi type or an application.
+    Instances are interned, so structurally equal types are the same object and can be compared with `is`,
+    and the predicates below are memoized per (type, argument) pair."""
+
+    _interned = {}
+    # types are made on the worker threads, too
+    _intern_lock = threading.Lock()
+
+    def __init__(self, kind, parts):
+        self.kind = kind
+        self.parts = parts
+
+    @classmethod
+    def make(cls, kind, *parts):
+        key = (kind,) + parts
+        interned = cls._interned.get(key)
+        if interned is None:
+            with cls._intern_lock:
+                interned = cls._interned.setdefault(key, cls(kind, parts))
+        return interned
+
+    @classmethod
+    def constant(cls, name):
+        return cls.make('constant', name)
+
+    @classmethod
+    def arrow(cls, args, result):
+        # A ⟶ (B ⟶ C) is the same as A ⟶ B ⟶ C
+        if result.kind == 'arrow':
+            args = tuple(args) + result.parts[0]
+            result = result.parts[1]
+        if not args:
+            return result
+        return cls.make('arrow', tuple(args), result)
+
+    @classmethod
+    def pi(cls, variable, domain, body):
+        return cls.make('pi', variable, domain, body)
+
+    @classmethod
+    def application(cls, head, args):
+        return cls.make('apply', head, tuple(args))
+
+    @classmethod
+    def unparsed(cls, text):
+        return cls.make('unparsed', text)
+
+    @classmethod
+    def parse(cls, string):
+        """The type from its string representation, e.g. Ω ⟶ ℝ or { : Ω ⟶ ℝ } ℝ"""
+        return _parse_type_string(string)
+
+    @classmethod
+    def from_openmath(cls, element):
+        """decodes an OpenMath element (OMOBJ, OMS, OMA, OMBIND, ...) as it occurs in MMT's OMDoc"""
+        tag = etree.QName(element).localname
+        children = [child for child in element if isinstance(child.tag, str)]
+        if tag == 'OMOBJ':
+            return cls.from_openmath(children[0])
+        if tag == 'OMS':
+            return cls.constant(element.get('name'))
+        if tag == 'OMV':
+            return cls.constant(element.get('name'))
+        if tag in ['OMLIT', 'OMI', 'OMF', 'OMSTR']:
+            return cls.constant(element.get('value') or element.get('dec') or element.text)
+        if tag == 'OMATTR':
+            # attributions only carry additional information, like the type of a variable
+            return cls.from_openmath(children[-1])
+        if tag == 'OMA':
+            head = children[0]
+            args = [cls.from_openmath(child) for child in children[1:]]
+            if etree.QName(head).localname == 'OMS' and head.get('name') == 'arrow':
+                return cls.arrow(args[:-1], args[-1])
+            if etree.QName(head).localname == 'OMS' and head.get('name') == 'apply':
+                return cls.application(args[0], args[1:])
+            return cls.application(cls.from_openmath(head), args)
+        if tag == 'OMBIND':
+            binder, variables, body = children[0], children[1], children[2]
+            result = cls.from_openmath(body)
+            if binder.get('name') != 'Pi':
+                return cls.application(cls.from_openmath(binder), [result])
+            for variable in reversed([v for v in variables if isinstance(v.tag, str)]):
+                name, domain = _variable_declaration(variable)
+                result = cls.pi(name, domain, result)
+            return result
+        return cls.unparsed(etree.tostring(element).decode('utf8'))
+
+    def is_function_from(self, domain):
+        return _is_function_from(self, domain)
+
+    def is_function_to(self, codomain):
+        return _is_function_to(self, codomain)
+
+    def strip_domain(self, domain):
+        """the type of the result of applying a function of this type to an argument in domain, or None"""
+        if self.kind == 'arrow' and self.parts[0][0] is domain:
+            return MMTType.arrow(self.parts[0][1:], self.parts[1])
+        if self.kind == 'pi' and self.parts[1] is domain:
+            return self.parts[2]
+        return None
+
+    def last_type(self):
+        """the type we end up with after applying all arguments"""
+        if self.kind == 'arrow':
+            return self.parts[1].last_type()
+        if self.kind == 'pi':
+            return self.parts[2].last_type()
+        return self
+
+    def __str__(self):
+        # with the local names of the constants only - declarations sent to MMT use the presentation MMT rendered
+        if self.kind in ['constant', 'unparsed']:
+            return self.parts[0]
+        if self.kind == 'arrow':
+            return " ⟶ ".join([_bracketed(arg) for arg in self.parts[0]] + [str(self.parts[1])])
+        if self.kind == 'pi':
+            variable = self.parts[0] + " " if self.parts[0] else ""
+            return "{ " + variable + ": " + str(self.parts[1]) + " } " + str(self.parts[2])
+        return " ".join([_bracketed(self.parts[0])] + [_bracketed(arg, True) for arg in self.parts[1]])
+
+    def __repr__(self):
+        return "MMTType(" + str(self) + ")"
+
+
+def _bracketed(mmttype, argument=False):
+    if mmttype.kind in ['constant', 'unparsed'] or (mmttype.kind == 'apply' and not argument):
+        return str(mmttype)
+    return "( " + str(mmttype) + " )"
+
+
+def _variable_declaration(element):
+    """name and type of a bound variable, given as OMV, possibly in an OMATTR carrying its type"""
+    if etree.QName(element).localname == 'OMATTR':
+        children = [child for child in element if isinstance(child.tag, str)]
+        attributes = [child for child in children[0] if isinstance(child.tag, str)]
+        domain = MMTType.from_openmath(attributes[1]) if len(attributes) > 1 else None
+        return children[-1].get('name'), domain
+    return element.get('name'), None
+
+
+@lru_cache(maxsize=1024)
+def _codomains(mmttype):
+    """all types that applying a function of this type to some of its arguments can result in"""
+    if mmttype.kind == 'arrow':
+        args, result = mmttype.parts
+        return frozenset([MMTType.arrow(args[i:], result) for i in range(1, len(args))] + [result]) \
+            | _codomains(result)
+    if mmttype.kind == 'pi':
+        return frozenset([mmttype.parts[2]]) | _codomains(mmttype.parts[2])
+    return frozenset()
+
+
+@lru_cache(maxsize=1024)
+def _is_function_from(mmttype, domain):
+    if mmttype.kind == 'unparsed' or domain.kind == 'unparsed':
+        return string_handling.type_is_function_from(str(mmttype), str(domain))
+    if mmttype.kind == 'arrow':
+        return mmttype.parts[0][0] is domain
+    if mmttype.kind == 'pi':
+        return mmttype.parts[1] is domain
+    return False
+
+
+@lru_cache(maxsize=1024)
+def _is_function_to(mmttype, codomain):
+    if mmttype.kind == 'unparsed' or codomain.kind == 'unparsed':
+        return string_handling.type_is_function_to(str(mmttype), str(codomain))
+    return codomain in _codomains(mmttype)
+
+
+class _TypeParser:
+    """parses the string form of types, as MMT's presentation or the user writes them"""
+
+    def __init__(self, string):
+        self.tokens = [token.text for token in string_handling.tokenize(string)]
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self):
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def expect(self, text):
+        if self.peek() != text:
+            raise ValueError("expected " + text)
+        return self.next()
+
+    def type(self):
+        if self.peek() == "{":
+            self.next()
+            variable = None
+            if self.peek() != ":":
+                variable = self.next()
+            self.expect(":")
+            domain = self.type()
+            self.expect("}")
+            return MMTType.pi(variable, domain, self.type())
+        args = [self.application()]
+        while self.peek() in string_handling.arrows:
+            self.next()
+            args.append(self.application())
+        return MMTType.arrow(args[:-1], args[-1])
+
+    def application(self):
+        head = self.atom()
+        args = []
+        while self.peek() is not None and self.peek() not in string_handling.arrows + [")", "}", ":"]:
+            args.append(self.atom())
+        return MMTType.application(head, args) if args else head
+
+    def atom(self):
+        token = self.next()
+        if token == "(":
+            inner = self.type()
+            self.expect(")")
+            return inner
+        if token == "{":
+            self.position -= 1
+            return self.type()
+        return MMTType.constant(token)
+
+
+@lru_cache(maxsize=1024)
+def _parse_type_string(string):
+    try:
+        parser = _TypeParser(string)
+        parsed = parser.type()
+        if parser.peek() is None:
+            return parsed
+    except (ValueError, IndexError):
+        pass
+    return MMTType.unparsed(string.strip())
+
+
 class MMTReply:
     """An object that holds
         ok : whether the request was successful and
@@ -148,18 +389,16 @@ class MMTReply:
                 if (child.tag) == 'type':
                     print(element_to_string(child))
                     #return child
+                    for omobj in child.iter("{*}OMOBJ"):
+                        return MMTType.from_openmath(omobj)
                     for oms in child.iter("{*}OMS"):
                         return self.get_name_or_expand_if_arrow(oms)
 
     def get_name_or_expand_if_arrow(self, oms):
         name = oms.get('name')
         if name == 'arrow':
-            next = oms.getnext()
-            name = next.get('name')
-            while next.getnext() is not None:
-                next = next.getnext()
-                name = name + " ⟶ " + next.get('name')
-        return name
+            return MMTType.from_openmath(oms.getparent())
+        return MMTType.constant(name)
 
     # (probably very volatile) accesses to concrete data structures
     def getIntervalBoundaries(self, mmtreply, intervalname):
@@ -182,6 +421,29 @@ class MMTReply:
             type_string = type_string + " " + mo.text
         return type_string.strip()
 
+    def inferred_type(self):
+        """the structured type, decoded from the OpenMath annotation of the reply if there is one, else from the
+            presentation. Only for checking types - declarations sent back to MMT use inferred_type_to_string()"""
+        omobj = self.top_level_openmath()
+        if omobj is not None:
+            return MMTType.from_openmath(omobj)
+        return MMTType.parse(self.inferred_type_to_string())
+
+    def top_level_openmath(self):
+        """the OMOBJ annotating the whole term, not one of the annotations of its sub-terms, or None"""
+        # the first semantics element in document order is the outermost one
+        for semantics in self.root.iter("{*}semantics"):
+            for annotation in semantics:
+                if isinstance(annotation.tag, str) and etree.QName(annotation).localname == 'annotation-xml':
+                    for omobj in annotation.iterchildren("{*}OMOBJ"):
+                        return omobj
+            return None
+        if etree.QName(self.root).localname == 'OMOBJ':
+            return self.root
+        for omobj in self.root.iterchildren("{*}OMOBJ"):
+            return omobj
+        return None
+
 
 def element_to_string(element):
     return etree.tostring(element, pretty_print=True).decode('utf8')
@@ -194,10 +456,9 @@ class MMTInterface:
         self.mmt_frontend_base_url = os.environ.setdefault('MMT_FRONTEND_BASE_URL', 'http://localhost:9000')
 
         # set up session
-        self.session = requests.Session()
-        self.adapter = requests.adapters.HTTPAdapter()
-        self.session.mount('https://', self.adapter)
-        self.session.mount('http://', self.adapter)
+        self.aborted = False
+        self.new_session()
+        self.poll_interval = 0.05
 
         # set parameters for communication with mmt server
         self.mmt_extension = ':interview'
@@ -207,6 +468,57 @@ class MMTInterface:
         self.debugprint = False
         self.theories = []
 
+    def warm_up(self):
+        """opens the connection to the server ahead of the first real request"""
+        try:
+            self.session.head(self.mmt_base_url, timeout=5)
+        except requests.exceptions.RequestException:
+            pass
+
+    def new_session(self):
+        self.session = requests.Session()
+        self.adapter = requests.adapters.HTTPAdapter()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def abort(self):
+        """abort the requests currently in flight (from another thread), and refuse new ones until resume() is called"""
+        self.aborted = True
+        # the aborted requests may still finish on their own, but not using our connections any more
+        self.new_session()
+
+    def resume(self):
+        self.aborted = False
+
+    def check_aborted(self):
+        if self.aborted:
+            raise Cancelled("MMT request aborted")
+
+    def send_request(self, method, url, **kwargs):
+        """does the request in a helper thread, so that abort() does not have to wait for the server's answer.
+        returns the status code and the text of the reply"""
+        self.check_aborted()
+        session = self.session
+        done = threading.Event()
+        result = {}
+
+        def target():
+            try:
+                req = session.request(method, url, **kwargs)
+                result["reply"] = (req.status_code, req.text)
+            except Exception as error:
+                result["error"] = error
+            finally:
+                done.set()
+
+        threading.Thread(target=target, daemon=True).start()
+        while not done.wait(self.poll_interval):
+            self.check_aborted()
+        self.check_aborted()
+        if "error" in result:
+            raise result["error"]
+        return result["reply"]
+
     def mmt_new_theory(self, thyname):
         # So, ich hab mal was zu MMT/devel gepusht. Es gibt jetzt eine Extension namens InterviewServer. Starten tut man die mit "extension info.kwarc.mmt.interviews.InterviewServer"
         # Wenn du dann in MMT den Server (sagen wir auf Port 8080) startest, kannst du folgende HTTP-Requests ausführen:
@@ -234,10 +546,15 @@ class MMTInterface:
         post = '/' + self.mmt_extension + '/new?term=' + quote(termname) + '&cont=' + quote(self.get_mpath(thyname))
         return self.http_request(post, termcontent)
 
-    def mmt_infer_type(self, thyname, termcontent):
+    def mmt_infer(self, thyname, termcontent):
+        """returns MMT's reply with the inferred type, cf. MMTReply.inferred_type and inferred_type_to_string"""
         post = '/' + self.mmt_extension + '/infer?cont=' + quote(self.get_mpath(thyname))
         return self.http_request(post, termcontent)
 
+    def mmt_infer_type(self, thyname, termcontent):
+        """returns the inferred type as MMTType"""
+        return self.mmt_infer(thyname, termcontent).inferred_type()
+
     def http_request(self, message, data=None):
         url = self.mmt_base_url + message
         print(url) if self.debugprint else 0
@@ -247,19 +564,19 @@ class MMTInterface:
                 print('\n' + str(data)) if self.debugprint else 0
                 headers = {'content-type': 'application/json',
                            'content-encoding': 'UTF-8'}
-                req = self.session.post(url, data=binary_data, headers=headers, stream=True)
+                status_code, text = self.send_request('POST', url, data=binary_data, headers=headers, stream=True)
             else:
-                req = requests.get(url)
+                status_code, text = self.send_request('GET', url)
         except ConnectionError as error:  # this seems to never be called
             print(error)
             print("Are you sure the mmt server is running?")
             raise
-        # print(req.text) if self.debugprint else 0
-        if req.text.startswith('<'):
-            root = etree.fromstring(req.text)
+        # print(text) if self.debugprint else 0
+        if text.startswith('<'):
+            root = etree.fromstring(text)
         else:
             root = None
-        if req.status_code == 200:
+        if status_code == 200:
             return MMTReply(True, root)
         return MMTReply(False, root)
 
@@ -284,9 +601,9 @@ class MMTInterface:
         print('\n' + str(data)) if self.debugprint else 0
         binary_data = data.encode('UTF-8')
         headers = {'content-type': 'application/xml'}
-        req = self.session.post(url, data=binary_data, headers=headers, stream=True)
-        root = etree.fromstring(req.text)
-        if req.status_code == 200:
+        status_code, text = self.send_request('POST', url, data=binary_data, headers=headers, stream=True)
+        root = etree.fromstring(text)
+        if status_code == 200:
             return MMTReply(True, root)
         return MMTReply(False, root)
 
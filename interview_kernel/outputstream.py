@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""Streams the kernel's text output to the front end while a cell is still running.
+
+Text written within a short time window is coalesced into one message. Markdown output goes into a display
+(with a display_id) that is updated in place as more text arrives, so it stays rendered as one block;
+once a display has grown past max_segment_size, a new one is started, so no message and no buffer grows without bound.
+stderr text, and "log" text such as the output of ExaStencils, is sent as plain stream messages."""
+
+import threading
+import uuid
+from contextlib import contextmanager
+
+# the output streams that are not markdown, and the name of the stream they are sent to
+plain_streams = {"stderr": "stderr", "log": "stdout"}
+
+
+class OutputStream:
+
+    def __init__(self, send_function, window=0.05, max_segment_size=64 * 1024):
+        """send_function(msg_type, content) sends one iopub message"""
+        self.send = send_function
+        self.window = window
+        self.max_segment_size = max_segment_size
+        self.silent = False
+
+        self._lock = threading.RLock()
+        self._pending = []  # chunks not sent yet
+        self._pending_name = 'stdout'
+        self._timer = None
+        self._captured = None
+
+        # the markdown display currently being updated
+        self._segment_id = None
+        self._segment = []
+        self._segment_size = 0
+
+    def write(self, text, outstream_name='stdout'):
+        with self._lock:
+            if self._captured is not None:
+                self._captured.append(text)
+                return
+            if self.silent:
+                return
+            if self._pending and outstream_name != self._pending_name:
+                self._flush_pending()
+            self._pending_name = outstream_name
+            self._pending.append(text)
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """sends everything written so far"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._flush_pending()
+
+    def end_segment(self):
+        """flushes, and makes the next markdown output go into a new display, e.g. so that it appears below html
+        that was displayed in between"""
+        with self._lock:
+            self.flush()
+            self._segment_id = None
+            self._segment = []
+            self._segment_size = 0
+
+    def _flush_pending(self):
+        if not self._pending:
+            return
+        text = "".join(self._pending)
+        self._pending = []
+        if self._pending_name in plain_streams:  # TODO make errors markdown but red
+            self.send('stream', {'name': plain_streams[self._pending_name], 'text': text})
+            return
+
+        if self._segment_id is not None and self._segment_size + len(text) > self.max_segment_size:
+            self._segment_id = None
+        if self._segment_id is None:
+            self._segment_id = uuid.uuid4().hex
+            self._segment = []
+            self._segment_size = 0
+            msg_type = 'display_data'
+        else:
+            msg_type = 'update_display_data'
+        self._segment.append(text)
+        self._segment_size += len(text)
+        # for other mime types, cf. http://ipython.org/ipython-doc/stable/notebook/nbformat.html
+        self.send(msg_type, {"data": {
+                                        "text/markdown": "".join(self._segment),
+                                    },
+                             "metadata": {},
+                             "transient": {"display_id": self._segment_id},
+                             })
+
+    @contextmanager
+    def capture(self):
+        """collects the output written inside the with-block instead of sending it;
+        yields a list that holds the written chunks afterwards"""
+        with self._lock:
+            self.flush()
+            captured = []
+            self._captured = captured
+        try:
+            yield captured
+        finally:
+            with self._lock:
+                self._captured = None
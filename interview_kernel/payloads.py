@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+"""Large texts behind "Show ..." buttons (omdoc, .exa1 code) are not put into the notebook.
+They are kept once per kernel session, addressed by their hash, and the front end fetches them
+through a comm when a button is clicked for the first time."""
+
+import hashlib
+from collections import OrderedDict
+from html import escape
+
+comm_target_name = "mosis_payload"
+
+# the one script that all buttons share; defined by kernel.js, and sent by the kernel if it is not there yet
+toggle_script = """
+if (typeof window.mosis_toggle === "undefined") {
+    window.mosis_toggle = function(button, payload_id) {
+        var container = button.previousElementSibling;
+        if (container.style.display === "none") {
+            if (!container.getAttribute("data-loaded")) {
+                var comm = Jupyter.notebook.kernel.comm_manager.new_comm("%s", {id: payload_id});
+                comm.on_msg(function(msg) {
+                    var text = msg.content.data.text;
+                    if (text === null) {
+                        text = "(This is no longer available - please run the cell again.)";
+                    }
+                    container.innerHTML = text;
+                    container.setAttribute("data-loaded", "true");
+                });
+            }
+            container.style.display = "block";
+            button.setAttribute("data-label", button.value);
+            button.value = "Hide";
+        } else {
+            container.style.display = "none";
+            button.value = button.getAttribute("data-label");
+        }
+    };
+}
+""" % comm_target_name
+
+
+class PayloadStore:
+    """content-addressed store for the texts, identical texts are only kept once"""
+
+    def __init__(self):
+        self.payloads = OrderedDict()
+
+    def put(self, text):
+        payload_id = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self.payloads[payload_id] = text
+        return payload_id
+
+    def get(self, payload_id):
+        return self.payloads.get(payload_id)
+
+    def size(self):
+        return sum(len(text) for text in self.payloads.values())
+
+
+def button_html(button_text, payload_id):
+    """the html for one button, its size does not depend on the payload"""
+    return ('<div style="display:none;"></div>'
+            '<input type="button" value="' + escape(button_text) + '" '
+            'onclick="mosis_toggle(this, \'' + payload_id + '\')" />')
@@ -3,21 +3,23 @@
 # https://github.com/pytransitions/transitions
 from transitions import Machine, State
 from collections import OrderedDict
+from concurrent import futures
 
 import getpass
 import re
+import threading
+import uuid
 from html import escape
 
 from . import string_handling
-from .exaoutput import ExaOutput, ExaRunner
+from . import symbolic
+from . import greeting
+from .exaoutput import ExaOutput, exastencils_installed
+from . import cache
+from . import jobqueue
+from .worker import Cancelled
 from .mmtinterface import *
 
-from bokeh.io import output_notebook, show, export_svgs
-from bokeh.plotting import figure
-from bokeh.resources import CDN
-from bokeh.embed import file_html, components#, notebook_div
-from bokeh.models import ColumnDataSource
-
 class InterviewError(Exception):
     """Errors that occur during the course of the interview and are not due to mmt server errors"""
 
@@ -68,6 +70,76 @@ class CriticalSubdict():
 class PDE_States:
     """A state machine using pytranisitions that walks our theory graph and creates ephemeral theories and views"""
 
+    # the states and transitions are the same for every interview, so the machine is only built once per process
+    # (cf. get_machine) and every PDE_States instance is added to it as a model
+    states = [
+        State('greeting', on_exit=['greeting_exit']),
+        State('dimensions', on_enter=['dimensions_begin']),
+        State('domain', on_enter=['domain_begin'], on_exit=['domain_exit']),
+        State('unknowns', on_enter=['unknowns_begin'], on_exit=['unknowns_exit']),
+        State('parameters', on_enter=['parameters_begin'], on_exit=['parameters_exit']),
+        State('pdes', on_enter=['pdes_begin'], on_exit=['pdes_exit']),
+        State('bcs', on_enter=['bcs_begin'], on_exit=['bcs_exit']),
+        State('props', on_enter=['props_begin'], on_exit=['props_exit']),
+        State('sim', on_enter=['sim_begin'], on_exit=['sim_exit']),
+    ]
+    states.reverse()
+    _machine = None
+    _machine_lock = threading.Lock()
+
+    # for ladder-like views
+    viewfrom = OrderedDict([
+        ('domain', "mDomain"),
+        ('unknowns', "mUnknown"),
+        ('parameters', "mParameter"),
+        ('pdes', "mPDE"),
+        ('bcs', "mBCsRequired"),
+        ('props', "mEllipticLinearDirichletBoundaryValueProblem"),
+        ('sim', "mSolvability"),
+    ])
+    # to include all the necessary theories every time
+    bgthys = OrderedDict([
+        ('domain', ["mInterval", "http://mathhub.info/MitM/smglom/arithmetics?RealArithmetics"]),
+        # new: RealArithmetics
+        ('unknowns', ["http://mathhub.info/MitM/Foundation?Strings", "ephdomain"]),
+                      #"http://mathhub.info/MitM/smglom/calculus?higherderivative"]),
+        ('parameters', ["http://mathhub.info/MitM/smglom/arithmetics?RealArithmetics", "ephdomain",
+                        "http://mathhub.info/MitM/Foundation?Math"]),
+        ('pdes', ["mDifferentialOperators", "mFunctionArithmetics"]),  # +params, unknowns,
+        ('bcs',
+         ["ephdomain", "mLinearity", "mDifferentialOperators",
+          "http://mathhub.info/MitM/smglom/arithmetics?RealArithmetics"]),  # +params, unknowns, pdes, bctypes
+        ('props',
+         ["mLinearity",
+          "http://mathhub.info/MitM/Foundation?Strings"]),  # +bcs, pde
+        ('sim',
+         ["http://mathhub.info/MitM/Foundation?Strings"]),  # +props
+    ])
+
+    @classmethod
+    def get_machine(cls):
+        """The shared transitions machine; callbacks are given by name, so they are looked up on each model"""
+        with cls._machine_lock:
+            if cls._machine is None:
+                machine = Machine(model=None, states=cls.states, initial=cls.states[-1],
+                                  after_state_change='after_state_change', queued='model')
+                # this is why we were reverting the states => can always go back
+                machine.add_ordered_transitions(
+                    trigger='last_state')  # TODO do something to avoid going back from the first state
+                machine.add_transition(trigger='greeting_over', source='greeting', dest='dimensions')
+                machine.add_transition(trigger='dimensions_parsed', source='dimensions', dest='domain',
+                                       before='print_empty_line')
+                machine.add_transition(trigger='domain_parsed', source='domain', dest='unknowns',
+                                       before='print_empty_line')
+                machine.add_transition(trigger='unknowns_parsed', source='unknowns', dest='parameters')
+                machine.add_transition(trigger='parameters_parsed', source='parameters', dest='pdes')
+                machine.add_transition(trigger='pdes_parsed', source='pdes', dest='bcs', before='print_empty_line')
+                machine.add_transition(trigger='bcs_parsed', source='bcs', dest='props', before='print_empty_line')
+                machine.add_transition(trigger='props_parsed', source='props', dest='sim', before='print_empty_line')
+                machine.add_transition(trigger='sim_finished', source='sim', dest='sim', before='print_empty_line')
+                cls._machine = machine
+        return cls._machine
+
     def __init__(self, output_function, after_state_change_function, prompt_function, display_html_function=None,
                  install_run=False, toggle_show_button=None):
         # just act like we were getting the right replies from MMT
@@ -75,40 +147,14 @@ class PDE_States:
 
         # callback handles
         self.poutput = output_function
+        self.after_state_change_function = after_state_change_function
         self.please_prompt = prompt_function
         self.display_html = display_html_function
         self.toggle_show_button = toggle_show_button
 
-        # Initialize a state machine
-        self.states = [
-            State('greeting', on_exit=['greeting_exit']),
-            State('dimensions', on_enter=['dimensions_begin']),
-            State('domain', on_enter=['domain_begin'], on_exit=['domain_exit']),
-            State('unknowns', on_enter=['unknowns_begin'], on_exit=['unknowns_exit']),
-            State('parameters', on_enter=['parameters_begin'], on_exit=['parameters_exit']),
-            State('pdes', on_enter=['pdes_begin'], on_exit=['pdes_exit']),
-            State('bcs', on_enter=['bcs_begin'], on_exit=['bcs_exit']),
-            State('props', on_enter=['props_begin'], on_exit=['props_exit']),
-            State('sim', on_enter=['sim_begin'], on_exit=['sim_exit']),
-        ]
-        self.states.reverse()
-        self.machine = Machine(model=self, states=self.states, initial=self.states[-1],
-                               after_state_change=after_state_change_function, queued=True)
-        # this is why we were reverting the states => can always go back
-        self.machine.add_ordered_transitions(
-            trigger='last_state')  # TODO do something to avoid going back from the first state
-        # self.to_dimensions()
-        self.machine.add_transition(trigger='greeting_over', source='greeting', dest='dimensions')
-        self.machine.add_transition(trigger='dimensions_parsed', source='dimensions', dest='domain',
-                                    before='print_empty_line')
-        self.machine.add_transition(trigger='domain_parsed', source='domain', dest='unknowns',
-                                    before='print_empty_line')
-        self.machine.add_transition(trigger='unknowns_parsed', source='unknowns', dest='parameters')
-        self.machine.add_transition(trigger='parameters_parsed', source='parameters', dest='pdes')
-        self.machine.add_transition(trigger='pdes_parsed', source='pdes', dest='bcs', before='print_empty_line')
-        self.machine.add_transition(trigger='bcs_parsed', source='bcs', dest='props', before='print_empty_line')
-        self.machine.add_transition(trigger='props_parsed', source='props', dest='sim', before='print_empty_line')
-        self.machine.add_transition(trigger='sim_finished', source='sim', dest='sim', before='print_empty_line')
+        # become a model of the shared state machine
+        self.machine = self.get_machine()
+        self.machine.add_model(self)
 
         # define what happens when input is received in a certain state
         self.stateDependentInputHandling = {
@@ -123,35 +169,6 @@ class PDE_States:
             'sim': self.sim_handle_input,
         }
 
-        # for ladder-like views
-        self.viewfrom = OrderedDict([
-            ('domain', "mDomain"),
-            ('unknowns', "mUnknown"),
-            ('parameters', "mParameter"),
-            ('pdes', "mPDE"),
-            ('bcs', "mBCsRequired"),
-            ('props', "mEllipticLinearDirichletBoundaryValueProblem"),
-            ('sim', "mSolvability"),
-        ])
-        # to include all the necessary theories every time
-        self.bgthys = OrderedDict([
-            ('domain', ["mInterval", "http://mathhub.info/MitM/smglom/arithmetics?RealArithmetics"]),
-            # new: RealArithmetics
-            ('unknowns', ["http://mathhub.info/MitM/Foundation?Strings", "ephdomain"]),
-                          #"http://mathhub.info/MitM/smglom/calculus?higherderivative"]),
-            ('parameters', ["http://mathhub.info/MitM/smglom/arithmetics?RealArithmetics", "ephdomain",
-                            "http://mathhub.info/MitM/Foundation?Math"]),
-            ('pdes', ["mDifferentialOperators", "mFunctionArithmetics"]),  # +params, unknowns,
-            ('bcs',
-             ["ephdomain", "mLinearity", "mDifferentialOperators",
-              "http://mathhub.info/MitM/smglom/arithmetics?RealArithmetics"]),  # +params, unknowns, pdes, bctypes
-            ('props',
-             ["mLinearity",
-              "http://mathhub.info/MitM/Foundation?Strings"]),  # +bcs, pde
-            ('sim',
-             ["http://mathhub.info/MitM/Foundation?Strings"]),  # +props
-        ])
-
         # the things we'd like to find out
         self.simdata = {
             "num_dimensions": None,
@@ -182,6 +199,11 @@ class PDE_States:
         }
 
         self.exaout = None
+        self.exarunner = None
+        # the ExaStencils jobs of the current simulation, one per level
+        self.exajobs = []
+        # the full data of the result plots, for zooming in, cf. plotting.py
+        self.plots = None
 
         self.install_run = install_run
 
@@ -197,6 +219,36 @@ class PDE_States:
         self.if_no = None
         self.pass_other = False
 
+    def cancel(self):
+        """abort what is currently running (MMT requests, ExaStencils), called from another thread"""
+        if self.mmtinterface is not None:
+            self.mmtinterface.abort()
+        if self.exarunner is not None:
+            self.exarunner.cancel()
+        for job in self.exajobs:
+            job.cancel()
+
+    def resume(self):
+        """accept requests again after cancel()"""
+        if self.mmtinterface is not None:
+            self.mmtinterface.resume()
+
+    @classmethod
+    def background_theory_names(cls):
+        """all the persistent theories the interview builds on"""
+        names = list(cls.viewfrom.values())
+        for theorynames in cls.bgthys.values():
+            names += [name for name in theorynames if not name.startswith("eph")]
+        return list(OrderedDict.fromkeys(names))
+
+    def close(self):
+        """Detaches this interview from the shared state machine, so that it can be garbage collected"""
+        self.machine.remove_model(self)
+
+    def after_state_change(self):
+        if self.after_state_change_function is not None:
+            self.after_state_change_function()
+
     def handle_state_dependent_input(self, userstring):
         """The standard input handling, depending on which state we are in"""
         # pythonic switch-case, cf. https://bytebaker.com/2008/11/03/switch-case-statement-in-python/
@@ -225,10 +277,10 @@ class PDE_States:
 
     ##### for state dimensions
     def dimensions_begin(self):
-        self.print_subheading("Modeling")
-        self.poutput("How many dimensions does your model have?")
+        self.print_subheading(greeting.modeling_heading)
+        self.poutput(greeting.dimensions_question)
         self.print_empty_line()
-        self.poutput("I am just assuming it's 1, since that is all we can currently handle.")  # TODO
+        self.poutput(greeting.dimensions_assumption)  # TODO
         self.print_empty_line()
         self.simdata["num_dimensions"] = 1
         self.dimensions_parsed()
@@ -256,7 +308,7 @@ class PDE_States:
 
     ##### for state domain
     def domain_begin(self):
-        self.poutput("What is the domain in your model?     Ω : type ❘ = [?;?], e.g. `\\\\Omega = [0.0;1.0]`")
+        self.poutput(greeting.domain_question)
         # self.poutput("By the way, you can always try and use LaTeX-type input.")
         self.simdata[self.state]["axes"] = OrderedDict()
         self.domain_mmt_preamble()
@@ -268,7 +320,7 @@ class PDE_States:
             parsestring = userstring
             mmtreply = self.mmtinterface.mmt_new_decl(domain_name, subdict["theoryname"], parsestring)
             mmttype = self.mmtinterface.mmt_infer_type(subdict["theoryname"], domain_name)
-            if mmttype.inferred_type_to_string() != "type":
+            if mmttype is not MMTType.constant("type"):
                 raise InterviewError("This seems to not be a type. It should be!")
             result = self.mmtinterface.query_for(subdict["theoryname"])
             subdict["name"] = domain_name
@@ -335,18 +387,23 @@ class PDE_States:
             test = self.mmtinterface.mmt_new_decl(unknown_name, unknown_name + "_to_go_to_trash",
                                                   parsestring)
 
-            type = self.get_inferred_type(unknown_name + "_to_go_to_trash", unknown_name)
+            reply = self.mmtinterface.mmt_infer(unknown_name + "_to_go_to_trash", unknown_name)
             #type = self.get_inferred_type(parsestring, unknown_name) #TODO in a smarter way
+            type = reply.inferred_type()
+            type_string = reply.inferred_type_to_string()
+            domain_type = MMTType.parse(self.simdata["domain"]["name"])
+            if type.strip_domain(domain_type) is None:
+                raise InterviewError("Unknown should be a function on " + self.simdata["domain"]["name"] + "!")
             usubdict[unknown_name] = {
                 "theoryname": unknown_name,
                 "string": parsestring,
-                "type": type,
-                "codomain": type.replace(self.simdata["domain"]["name"] + " ⟶", "", 1).strip(),
+                "type": type_string,
+                "codomain": type_string.replace(self.simdata["domain"]["name"] + " ⟶", "", 1).strip(),
             }
             with CriticalSubdict(self.simdata["unknowns"][unknown_name], self.poutput, False) as subdict:
                 if self.mmtinterface.query_for(unknown_name + "_to_go_to_trash").hasDefinition(unknown_name):
                     raise InterviewError("Unknowns cannot be defined!")
-                if not string_handling.type_is_function_from(subdict["type"], self.simdata["domain"]["name"]):
+                if not type.is_function_from(domain_type):
                     raise InterviewError("Unknown should be a function on " + self.simdata["domain"]["name"] + "!")
 
                 # add unknown's type as constant
@@ -408,7 +465,7 @@ class PDE_States:
                 subdict["theoryname"] = parameter_name
                 subdict["string"] = userstring
                 subdict["parsestring"] = parsestring
-                subdict["type"] = self.get_inferred_type(parameter_name, parameter_name)
+                subdict["type"] = self.get_inferred_type_string(parameter_name, parameter_name)
 
                 # if not reply_pconstant.hasDefinition(parameter_name) and not self.cheating:
                 #    InterviewError("Please define this parameter.")
@@ -449,10 +506,11 @@ class PDE_States:
                     self.include_in(subdict["theoryname"], paramentry)
 
                 # TODO use symbolic computation to order into LHS and RHS
-                parts = re.split("=", userstring)
+                parts = symbolic.split_equation(userstring)
 
-                if len(parts) is not 2:
+                if parts is None:
                     raise InterviewError("This does not look like an equation.")
+                parts = list(parts)
 
                 # store the info
                 subdict["string"] = userstring
@@ -462,11 +520,15 @@ class PDE_States:
 
                 # to make the left-hand side a function on x, place " [ variablename : domainname ] " in front
                 lambda_x = " [ x : " + self.simdata["domain"]["name"] + " ] "
-                if "x" in parts[0]:
+                if symbolic.mentions_free(parts[0], "x"):
                     parts[0] = lambda_x + parts[0]
-                # right-hand side: infer type, make function if not one yet
-                if not string_handling.type_is_function_from(self.get_inferred_type(subdict["theoryname"], parts[1]),
-                                             self.simdata["domain"]["name"]):
+                # right-hand side: make function if not one yet - only ask MMT for the type if we cannot tell locally
+                needs_lambda = symbolic.needs_function_wrapper(parts[1], [self.simdata["domain"]["name"]],
+                                                               self.get_known_types())
+                if needs_lambda is None:
+                    needs_lambda = not self.get_inferred_type(subdict["theoryname"], parts[1]).is_function_from(
+                        MMTType.parse(self.simdata["domain"]["name"]))
+                if needs_lambda:
                     parts[1] = lambda_x + parts[1]
 
                 # in lhs replace all unknown names used by more generic ones and add lambda clause in front
@@ -487,7 +549,7 @@ class PDE_States:
 
                 # create view
                 self.new_view(subdict)
-                ltype = self.get_inferred_type(subdict["theoryname"], "mylhs")
+                ltype = self.get_inferred_type_string(subdict["theoryname"], "mylhs")
                 eqtype = string_handling.get_last_type(ltype)
                 rtype = self.get_inferred_type(subdict["theoryname"], "myrhs")
                 self.mmtinterface.mmt_new_decl("eqtype", subdict["viewname"],
@@ -509,6 +571,10 @@ class PDE_States:
                 subdict["op"] = op
                 subdict["lhsparsestring"] = parts[0]
                 subdict["rhsparsestring"] = parts[1]
+                # linearity and order of the operator, as far as we can tell without MMT
+                classification = symbolic.classify(subdict["lhsstring"], self.simdata["unknowns"].keys())
+                subdict["linear"] = classification["linear"]
+                subdict["order"] = classification["order"]
 
                 # TODO query number of effective pdes and unknowns from mmt for higher dimensional PDEs
                 # => can assume each to be ==1 for now
@@ -551,10 +617,11 @@ class PDE_States:
             currentname = "bc" + str(len(subdict["bcs"]))
             subdict["bcs"].append({"name": currentname})
             # TODO use symbolic computation to order into LHS and RHS
-            parts = re.split("=", userstring)
+            parts = symbolic.split_equation(userstring)
 
-            if len(parts) is not 2:
+            if parts is None:
                 raise InterviewError("This does not look like a boundary condition.")
+            parts = list(parts)
             # store the info
             subdict["bcs"][-1]["string"] = userstring
             subdict["bcs"][-1]["lhsstring"] = parts[0].strip()
@@ -563,9 +630,9 @@ class PDE_States:
 
             domain_boundary_name = self.simdata["domain"]['boundary_name']
             # to make a function on x, place " [ variablename : boundaryname ] " in front
-            if "x" in parts[0]:
+            if symbolic.mentions_free(parts[0], "x"):
                 parts[0] = " [ x : " + domain_boundary_name + " ] " + parts[0]
-            if "x" in parts[1]:
+            if symbolic.mentions_free(parts[1], "x"):
                 parts[1] = " [ x : " + domain_boundary_name + " ] " + parts[1]
 
             first_pde_theory_name = self.simdata["pdes"]['pdes'][0]['theoryname']
@@ -574,14 +641,26 @@ class PDE_States:
                 parts[0] = parts[0].replace(unkname, " any" + unkname)
                 parts[0] = " [ any" + unkname + " : " + self.simdata["unknowns"][unkname]["type"] + " ] " + parts[0]
 
-                type = self.get_inferred_type(first_pde_theory_name, parts[0])
+                # is this a condition on the whole boundary or at a point? only ask MMT if we cannot tell locally
+                bc_kind = symbolic.boundary_condition_kind(subdict["bcs"][-1]["lhsstring"], unkname)
+                if bc_kind is None:
+                    # compared in MMT's presentation, as the unknown's types are stored
+                    type = MMTType.parse(self.get_inferred_type_string(first_pde_theory_name, parts[0]))
+                    if type.is_function_to(MMTType.parse(self.simdata["unknowns"][unkname]["type"])):
+                        bc_kind = 'function'
+                    elif type.is_function_to(MMTType.parse(self.simdata["unknowns"][unkname]["codomain"])):
+                        bc_kind = 'point'
                 bc_type_struct_name = unkname + "_boundary_types"
-                if string_handling.type_is_function_to(type, self.simdata["unknowns"][unkname]["type"]):
-                    # right-hand side: infer type, make function if not one yet
-                    rhstype = self.get_inferred_type(first_pde_theory_name, parts[1])
-                    if not string_handling.type_is_function_from(rhstype, self.simdata["domain"]["name"]) \
-                            and not string_handling.type_is_function_from(rhstype,
-                                                                          self.simdata["domain"]["boundary_name"]):
+                if bc_kind == 'function':
+                    # right-hand side: make function if not one yet
+                    needs_lambda = symbolic.needs_function_wrapper(parts[1], [self.simdata["domain"]["name"],
+                                                                              domain_boundary_name],
+                                                                   self.get_known_types())
+                    if needs_lambda is None:
+                        rhstype = self.get_inferred_type(first_pde_theory_name, parts[1])
+                        needs_lambda = not rhstype.is_function_from(MMTType.parse(self.simdata["domain"]["name"])) \
+                            and not rhstype.is_function_from(MMTType.parse(domain_boundary_name))
+                    if needs_lambda:
                         parts[1] = " [ x : " + domain_boundary_name + " ] " + parts[1]
                     #self.add_list_of_declarations(subdict["viewname"], [
                     #    "firstBC = " + bc_type_struct_name + "/DirichletBCfun " + parts[1], #TODO
@@ -600,9 +679,10 @@ class PDE_States:
 
                     subdict["bcs"][-1]["type"] = "Dirichlet",
                     subdict["bcs"][-1]["on"] = "x",
-                    subdict["bcs"][-1]["measure"] = 2,
-                    subdict["measure_given"] = 2
-                elif string_handling.type_is_function_to(type, self.simdata["unknowns"][unkname]["codomain"]):
+                    # a condition on the whole boundary is all the conditions needed
+                    subdict["bcs"][-1]["measure"] = self.required_bc_measure(),
+                    subdict["measure_given"] = self.required_bc_measure()
+                elif bc_kind == 'point':
                     # at_x = re.split('[\(\)]', subdict["bcs"][-1]["lhsstring"])[-1] #TODO
                     at_x = subdict["bcs"][-1]["lhsstring"].split('(', 1)[1].split(')')[0].strip()
                     if at_x != self.simdata["domain"]["from"] and at_x != self.simdata["domain"]["to"]:
@@ -627,9 +707,9 @@ class PDE_States:
             #    self.poutput(error.args[0])
 
             self.poutput("Ok ")
-            if subdict["measure_given"] == len(self.simdata["unknowns"]) * 2:  # TODO times inferred order of PDE
+            if subdict["measure_given"] == self.required_bc_measure():
                 self.trigger('bcs_parsed')
-            elif subdict["measure_given"] > len(self.simdata["unknowns"]):
+            elif subdict["measure_given"] > self.required_bc_measure():
                 raise InterviewError("now that's too many boundary conditions. ignoring last input.")
             else:
                 self.poutput("Please enter more boundary conditions")
@@ -638,6 +718,11 @@ class PDE_States:
         self.poutput("These are all the boundary conditions needed.")
         self.print_empty_line()
 
+    def required_bc_measure(self):
+        """how many boundary conditions we need - in 1D, one per unknown and order of the PDE"""
+        # if the order could not be inferred, assume a second order PDE
+        return sum([2 if pde.get("order") is None else pde["order"] for pde in self.simdata["pdes"]["pdes"]])
+
     def add_bc_structs(self, bc_theory_name):
         for unknown in string_handling.get_recursively(self.simdata["unknowns"], "theoryname"):
             self.add_list_of_declarations(bc_theory_name, [
@@ -674,6 +759,12 @@ class PDE_States:
                 subdict["ops"].append({})
                 subdict["ops"][-1]["name"] = pde["op"]
                 subdict["ops"][-1]["props"] = []
+                # what we could find out ourselves, can be overridden by the user
+                subdict["ops"][-1]["linear"] = pde.get("linear")
+                subdict["ops"][-1]["order"] = pde.get("order")
+                if pde.get("linear") is not None:
+                    self.poutput("To me, it looks " + ("linear" if pde["linear"] else "nonlinear") +
+                                 " and of order " + str(pde["order"]) + ".")
 
     def props_handle_input(self, userstring):
         if string_handling.means_no(userstring):
@@ -684,15 +775,17 @@ class PDE_States:
             #            "linear": True, #or false or unknown
             #            "props": ["elliptic"]
 
-            parsestring = userstring.replace("not", "¬")
+            parsestring = userstring.replace("nonlinear", "¬ linear").replace("not", "¬")
 
-            if "linear" in parsestring:
+            if symbolic.has_word(parsestring, "linear"):
                 self.add_list_of_declarations(subdict["theoryname"], [
                     string_handling.add_ods("user_linear : ⊦ " + parsestring + ' mylhs = sketch "user knowledge" ')
                 ])
                 if "¬" in parsestring:
                     subdict["ops"][-1]["linear"] = False
                 else:
+                    if subdict["ops"][-1].get("linear") is False:
+                        self.poutput("Careful, the operator does not look linear to me.")
                     subdict["ops"][-1]["linear"] = True
                     self.add_list_of_declarations(subdict["viewname"], [
                         "isLinear = user_linear"
@@ -700,7 +793,7 @@ class PDE_States:
                 self.poutput("OK!")
 
             for property in ["elliptic"]:  # TODO more properties
-                if property in parsestring:
+                if symbolic.has_word(parsestring, property):
                     self.add_list_of_declarations(subdict["theoryname"], [
                         string_handling.add_ods("user_" + property + " : ⊦ " + parsestring + ' mylhs = sketch "user knowledge" ')
                     ])
@@ -732,38 +825,151 @@ class PDE_States:
 
     def sim_exit(self, problem_name=None):
         self.simdata["sim"]["type"] = "FiniteDifferences"
-        # generate output
-        self.exaout = ExaOutput(self.simdata, getpass.getuser(), problem_name)
-        print("Generated ExaStencils input; running ExaStencils")
+        # the same problem was solved before - by this or another kernel
+        result_store = cache.get_result_store()
+        result_key = cache.result_key(self.simdata)
+        result_path = result_store.get(result_key)
+        if result_path is not None:
+            metadata = result_store.metadata(result_key) or {}
+            self.poutput("This problem was solved before, as " + str(metadata.get("probname")) + "; showing that result")
+            if "exa1" in metadata:
+                self.toggle_show_button("Show .exa1 code", metadata["exa1"])
+            self.display_result_as_bokeh(result_path)
+            return
+        if not exastencils_installed():
+            self.poutput("ExaStencils is not installed; solving with the built-in finite difference solver instead")
+            self.display_preview(ExaOutput.max_level, 'stderr')
+            return
+        # the plot that is updated in place, as finer solutions come in
+        display_id = uuid.uuid4().hex
+        shown_level = 0
+        # coarser levels first, which take less time to solve; those solved before are shown right away
+        queue = jobqueue.get_queue()
+        jobs = OrderedDict()
+        for level in jobqueue.progressive_levels(lambda message: self.poutput(message, 'log')):
+            coarse_path = result_store.get(cache.result_key(self.simdata, level))
+            if coarse_path is not None:
+                self.display_result_as_bokeh(coarse_path, "ExaStencils, level " + str(level), display_id)
+                shown_level = level
+            else:
+                jobs[level] = queue.submit(self.simdata, getpass.getuser(), problem_name,
+                                           lambda line: self.poutput(line, 'log'), max_level=level)
+        # generate output, in a workspace of its own, cf. jobqueue.py
+        job = queue.submit(self.simdata, getpass.getuser(), problem_name, lambda line: self.poutput(line, 'log'))
+        jobs[ExaOutput.max_level] = job
+        self.exajobs = list(jobs.values())
+        self.exaout = job.exaout
+        message = "Generated ExaStencils input; running ExaStencils as job " + job.id
+        if len(jobs) > 1:
+            message += ", and on the coarser levels " + ", ".join(str(level) for level in list(jobs)[:-1]) + \
+                       " as jobs " + ", ".join(coarse_job.id for coarse_job in list(jobs.values())[:-1])
+        self.poutput(message)
         self.toggle_show_button("Show .exa1 code", self.exaout.l1_string)
+        # something to look at while ExaStencils runs; only finer solutions replace it
+        if shown_level == 0:
+            shown_level = self.display_preview(display_id=display_id) or 0
         # generate and run simulation
-        runner = ExaRunner(self.exaout)
-        runner.run_exastencils()
-        print("Ran ExaStencils; preparing visualization")
-        # output
-        self.display_result_as_bokeh()
+        self.exarunner = job.runner
+        pending = OrderedDict((level_job.future, level) for level, level_job in jobs.items())
+        while job.future in pending:
+            done, not_done = futures.wait(list(pending), return_when=futures.FIRST_COMPLETED)
+            for level in sorted(pending.pop(future) for future in done):
+                if level == ExaOutput.max_level:
+                    result = job.wait()
+                else:
+                    try:
+                        result = jobs[level].wait()
+                    except Cancelled:
+                        continue
+                if not result.ok:
+                    self.poutput("ExaStencils failed in the " + result.failed_phase + " phase on level " + str(level)
+                                 + "; the complete output is in " + str(result.log_path), 'stderr')
+                    continue
+                message = "Ran ExaStencils on level " + str(level) + " in " + "{:.1f} s".format(
+                    sum(result.phase_durations.values()))
+                self.poutput(message + ("; preparing visualization" if level > shown_level else ""))
+                self.store_result(jobs[level], result, level)
+                if level > shown_level:
+                    self.display_result_as_bokeh(jobs[level].runner.generated_path(),
+                                                 "ExaStencils, level " + str(level), display_id)
+                    shown_level = level
+        # the finest level is done, the coarser ones are of no use any more
+        for coarse_job in list(jobs.values())[:-1]:
+            coarse_job.cancel()
+        self.exajobs = []
+
+    def store_result(self, job, result, level):
+        """puts the fields of a successful run into the result store, for the next time the problem is solved"""
+        try:
+            cache.get_result_store().put(
+                cache.result_key(self.simdata, level), job.runner.generated_path(), ignore=cache.only_fields,
+                metadata={
+                    "probname": job.exaout.probname,
+                    "user": job.exaout.username,
+                    "workspace": str(job.exaout.exastencils_path),
+                    "log_path": str(result.log_path),
+                    "phase_durations": result.phase_durations,
+                    "build_cached": result.build_cached,
+                    "problem": cache.problem_spec(self.simdata, level),
+                    "exa1": job.exaout.l1_string,
+                })
+        except OSError as error:
+            self.poutput("Could not store the result: " + str(error), 'stderr')
+
+    def display_preview(self, level=None, error_stream='log', display_id=None):
+        """solves the problem with the finite difference solver in preview.py on 2^level intervals (by default
+            MOSIS_PREVIEW_LEVEL) and plots it; if it cannot, says why on error_stream.
+            Returns the level shown, or None"""
+        import time
+        try:
+            from . import preview
+        except ImportError as error:
+            self.poutput("No preview: " + str(error), error_stream)
+            return
+        if level is None:
+            level = preview.default_level
+        if level <= 0:
+            return
 
-    # cf. nbviewer.jupyter.org/github/bokeh/bokeh-notebooks/blob/master/tutorial/01 - Basic Plotting.ipynb
-    def display_result_as_bokeh(self):
+        start = time.perf_counter()
+        try:
+            x, values = preview.solve(self.simdata, level)
+        except preview.PreviewError as error:
+            self.poutput("No preview: " + str(error), error_stream)
+            return
+        except Exception as error:
+            # the preview is only a bonus, it must not stop the ExaStencils run from being shown
+            self.poutput("No preview: " + repr(error), error_stream)
+            return
+        self.poutput("Solution with NumPy/SciPy finite differences on 2^" + str(level) + " intervals, in "
+                     + "{:.3f} s".format(time.perf_counter() - start))
+        self.display_field_as_bokeh(x, values, "NumPy/SciPy preview, level " + str(level), display_id)
+        return level
+
+    def display_result_as_bokeh(self, result_path, title=None, display_id=None):
+        # numpy is only loaded once there is something to plot
+        from .fieldfile import field_cache
 
         unknowns = [*self.simdata["unknowns"]]
 
-        # create a new plot with default tools, using figure
-        p = figure(plot_width=1000, plot_height=400)
+        x, values = field_cache.load(result_path, unknowns[0])  # TODO more dimensions
+        self.display_field_as_bokeh(x, values, title, display_id)
+
+    # cf. nbviewer.jupyter.org/github/bokeh/bokeh-notebooks/blob/master/tutorial/01 - Basic Plotting.ipynb
+    def display_field_as_bokeh(self, x, values, title=None, display_id=None):
+        """plots the field; with a display_id, the plot replaces the one shown with the same id before"""
+        # bokeh is only loaded once there is something to plot
+        from . import plotting
 
-        runner = ExaRunner(self.exaout)
-        data = runner.load_data(unknowns[0])  # TODO more dimensions
-        source = ColumnDataSource(data=data)
-        source.data = source.from_df(data)
-        source.add(data.index, 'index')
+        unknowns = [*self.simdata["unknowns"]]
 
-        # add a circle renderer with a size, color, and alpha
-        p.circle(x='index', y=unknowns[0], size=2, line_color="navy", fill_color="orange", fill_alpha=0.5, source=source)
-        #show(p)
+        if self.plots is None:
+            self.plots = plotting.PlotRegistry()
+        # create a new plot with default tools, decimated to the screen resolution
+        p = plotting.line_plot(self.plots, x, values, unknowns[0], title=title)
 
-        output_notebook()
-        # cf. http://bokeh.pydata.org/en/0.10.0/docs/user_guide/embed.html
-        self.display_html(file_html(p, CDN, "my plot"))  # show the results
+        # cf. https://docs.bokeh.org/en/latest/docs/user_guide/embed.html#json-items
+        self.display_html(plotting.embed_html(p), needs_bokeh=True, display_id=display_id)  # show the results
 
         # using JS requires jupyter widgets extension
         # script, div = components(p)
@@ -899,8 +1105,22 @@ class PDE_States:
     def include_trivial_assignment(self, in_view, theoryname):
         self.include_in(in_view, string_handling.assert_question_mark(theoryname) + " = " + string_handling.assert_question_mark(theoryname))
 
+    def get_known_types(self):
+        """the types of the unknowns and parameters declared so far, by name"""
+        known_types = {}
+        for section in ["unknowns", "parameters"]:
+            for name, entry in self.simdata[section].items():
+                if "type" in entry:
+                    known_types[name] = entry["type"]
+        return known_types
+
     def get_inferred_type(self, in_theory, term):
-        return self.mmtinterface.mmt_infer_type(in_theory, term).inferred_type_to_string()
+        """the MMTType of the term"""
+        return self.mmtinterface.mmt_infer_type(in_theory, term)
+
+    def get_inferred_type_string(self, in_theory, term):
+        """the type of the term as MMT renders it, to be used in declarations sent back to MMT"""
+        return self.mmtinterface.mmt_infer(in_theory, term).inferred_type_to_string()
 
     def try_expand(self, term,
                    in_theory=None):  # TODO do using mmt definition expansion, issue UniFormal/MMT/issues/295
@@ -914,7 +1134,7 @@ class PDE_States:
         return term
 
     def print_empty_line(self):
-        self.poutput("\n\n")  # double to actually make it a Markdown newline
+        self.poutput(greeting.empty_line)  # double to actually make it a Markdown newline
 
     def print_subheading(self, heading):
         self.poutput("## " + heading)
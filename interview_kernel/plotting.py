@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+"""Compact result plots for the notebook.
+
+Instead of a standalone html document per plot, only the plot's json is sent and embedded with the
+BokehJS that is loaded once per session. Large series are decimated to about two points per pixel column;
+when the user zooms in, the front end asks for the visible range again over a comm and gets it decimated
+from the full data, so the resolution is always that of the screen, whatever the grid level."""
+
+import json
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+comm_target_name = "mosis_plot"
+
+
+def lttb(x, y, threshold):
+    """largest-triangle-three-buckets downsampling, keeps the visual shape of the series with threshold points"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    # the points between first and last are divided into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        # the average of the next bucket is the third corner of the triangle
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        if next_end <= next_start:
+            next_end = next_start + 1
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        indices[i + 1] = previous
+    return x[indices], y[indices]
+
+
+def minmax_decimate(x, y, bins):
+    """keeps the minimum and the maximum of each of bins equally sized chunks, so that no peak gets lost"""
+    n = len(x)
+    if 2 * bins >= n or bins < 1:
+        return x, y
+    starts = np.linspace(0, n, bins + 1).astype(np.int64)[:-1]
+    mins = np.minimum.reduceat(y, starts)
+    maxs = np.maximum.reduceat(y, starts)
+    # the positions of minimum and maximum in each chunk, in order
+    chunk_of = np.repeat(np.arange(bins), np.diff(np.append(starts, n)))
+    is_min = y == mins[chunk_of]
+    is_max = y == maxs[chunk_of]
+    first_min = np.unique(chunk_of[is_min], return_index=True)[1]
+    first_max = np.unique(chunk_of[is_max], return_index=True)[1]
+    indices = np.unique(np.concatenate([np.flatnonzero(is_min)[first_min], np.flatnonzero(is_max)[first_max]]))
+    return x[indices], y[indices]
+
+
+def decimate(x, y, max_points, method="lttb"):
+    if len(x) <= max_points:
+        return x, y
+    if method == "minmax":
+        return minmax_decimate(x, y, max_points // 2)
+    return lttb(x, y, max_points)
+
+
+class PlotRegistry:
+    """keeps the full data of the last few plots, to answer zoom requests from the front end"""
+
+    def __init__(self, max_plots=20):
+        self.max_plots = max_plots
+        self.plots = OrderedDict()
+
+    def add(self, x, y, max_points):
+        plot_id = uuid.uuid4().hex
+        self.plots[plot_id] = (np.asarray(x), np.asarray(y), max_points)
+        while len(self.plots) > self.max_plots:
+            self.plots.popitem(last=False)
+        return plot_id
+
+    def visible_data(self, plot_id, start, end):
+        """the decimated data between start and end, or None if the plot is not known (any more)"""
+        if plot_id not in self.plots:
+            return None
+        self.plots.move_to_end(plot_id)
+        x, y, max_points = self.plots[plot_id]
+        # one more point on each side, so that lines do not stop at the border
+        first = max(int(np.searchsorted(x, start, side='left')) - 1, 0)
+        last = min(int(np.searchsorted(x, end, side='right')) + 1, len(x))
+        x, y = decimate(x[first:last], y[first:last], max_points)
+        return {"x": x.tolist(), "y": y.tolist()}
+
+    def comm_opened(self, comm, msg):
+        request = msg['content']['data']
+        comm.send({"data": self.visible_data(request.get('plot'), request.get('start'), request.get('end'))})
+        comm.close()
+
+
+# the javascript asking for the data of the zoomed-in range, debounced per plot
+rezoom_script = """
+if (typeof window.mosis_rezoom === "undefined") {
+    window.mosis_rezoom_timers = {};
+    window.mosis_rezoom = function(plot_id, start, end, source) {
+        clearTimeout(window.mosis_rezoom_timers[plot_id]);
+        window.mosis_rezoom_timers[plot_id] = setTimeout(function() {
+            var comm = Jupyter.notebook.kernel.comm_manager.new_comm("%s", {plot: plot_id, start: start, end: end});
+            comm.on_msg(function(msg) {
+                if (msg.content.data.data !== null) {
+                    source.data = msg.content.data.data;
+                }
+            });
+        }, 150);
+    };
+}
+""" % comm_target_name
+
+
+def bokeh_resources_html():
+    """the html loading BokehJS from the CDN, to be sent once per session"""
+    from bokeh.resources import CDN
+    return "".join('<script type="text/javascript" src="' + url + '"></script>' for url in CDN.js_files) + \
+        "<script>" + rezoom_script + "</script>"
+
+
+def embed_html(plot):
+    """the html embedding the plot's json, which waits for BokehJS to be loaded"""
+    from bokeh.embed import json_item
+    target_id = "mosis-plot-" + uuid.uuid4().hex
+    return ('<div id="' + target_id + '"></div>\n'
+            '<script type="text/javascript">\n'
+            '(function() {\n'
+            '    var item = ' + json.dumps(json_item(plot)) + ';\n'
+            '    function embed() {\n'
+            '        if (window.Bokeh && window.Bokeh.embed) { window.Bokeh.embed.embed_item(item, "' + target_id + '"); }\n'
+            '        else { setTimeout(embed, 50); }\n'
+            '    }\n'
+            '    embed();\n'
+            '})();\n'
+            '</script>')
+
+
+def line_plot(registry, x, y, y_label, width=1000, height=400, points_per_pixel=2, title=None):
+    """a plot of the series, decimated to the screen resolution, that re-decimates on zoom"""
+    from bokeh.plotting import figure
+    from bokeh.models import ColumnDataSource, CustomJS
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    max_points = width * points_per_pixel
+    plot_id = registry.add(x, y, max_points)
+    shown_x, shown_y = decimate(x, y, max_points)
+
+    p = figure(width=width, height=height, x_axis_label="x", y_axis_label=y_label, title=title)
+    source = ColumnDataSource(data={"x": shown_x, "y": shown_y})
+    p.line(x="x", y="y", line_color="navy", source=source)
+    p.scatter(x="x", y="y", size=2, line_color="navy", fill_color="orange", fill_alpha=0.5, source=source)
+    if len(x) > max_points:
+        p.x_range.js_on_change('end', CustomJS(args=dict(source=source, x_range=p.x_range), code="""
+            if (window.mosis_rezoom) {
+                window.mosis_rezoom("%s", x_range.start, x_range.end, source);
+            }
+        """ % plot_id))
+    return p
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""A finite-difference solver for the 1D problems of the interview, in NumPy and SciPy, for a preview of the
+solution without generating, compiling and running ExaStencils - and instead of it, if ExaStencils is not installed.
+
+It solves linear second order equations with constant coefficients, like Δu = f or -Δu + 2⋅u = f, with Dirichlet
+conditions at both ends of the domain: the right-hand side and the boundary values are evaluated on the grid from
+the strings the user typed (cf. symbolic.py), the operator is discretized with central differences on the same
+grid ExaStencils uses on a level, 2^level intervals, and the tridiagonal system is solved with scipy.sparse.
+Problems it cannot handle raise a PreviewError."""
+
+import os
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+from . import symbolic
+
+# the level of the preview shown while ExaStencils runs; 0 for none
+default_level = int(os.environ.get("MOSIS_PREVIEW_LEVEL", 10))
+
+# what the right-hand side may call, besides the lambdas the user wrote
+functions = {
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "exp": np.exp,
+    "log": np.log,
+    "ln": np.log,
+    "sqrt": np.sqrt,
+    "abs": np.abs,
+    "sinh": np.sinh,
+    "cosh": np.cosh,
+    "tanh": np.tanh,
+    "arcsin": np.arcsin,
+    "arccos": np.arccos,
+    "arctan": np.arctan,
+}
+constants = {
+    "π": np.pi,
+    "pi": np.pi,
+    "PI": np.pi,
+}
+
+
+class PreviewError(ValueError):
+    """The problem is not one the preview solver can solve - only ExaStencils can"""
+
+
+def evaluate(tree, variables):
+    """the value of a parsed expression (cf. symbolic.parse), with the variables (e.g. x) bound to numbers or
+        arrays of grid points"""
+    kind = tree[0]
+    if kind == 'num':
+        return tree[1]
+    if kind == 'name':
+        if tree[1] in variables:
+            return variables[tree[1]]
+        if tree[1] in constants:
+            return constants[tree[1]]
+        raise PreviewError("do not know the value of " + tree[1])
+    if kind == 'neg':
+        return -evaluate(tree[1], variables)
+    if kind == 'op':
+        left, right = evaluate(tree[2], variables), evaluate(tree[3], variables)
+        if tree[1] == "+":
+            return left + right
+        if tree[1] == "-":
+            return left - right
+        if tree[1] == "⋅":
+            return left * right
+        if tree[1] == "/":
+            return left / right
+        if tree[1] == "^":
+            return left ** right
+    if kind == 'apply':
+        head, args = tree[1], tree[2]
+        if head[0] == 'name' and head[1] in functions and len(args) == 1:
+            return functions[head[1]](evaluate(args[0], variables))
+        if head[0] == 'lambda' and len(args) == 1:
+            return evaluate(head[3], dict(variables, **{head[1]: evaluate(args[0], variables)}))
+        if len(args) == 1 and "x" in variables:
+            # what try_expand makes of f(x): the definition of f, applied to x, e.g. "x ⋅ x(x)"
+            return evaluate(head, dict(variables, x=evaluate(args[0], variables)))
+    if kind == 'lambda':
+        return evaluate(tree[3], variables)
+    raise PreviewError("cannot evaluate " + str(tree))
+
+
+def evaluate_string(string, **variables):
+    try:
+        tree = symbolic.parse(string.strip())
+    except symbolic.SymbolicParseError as error:
+        raise PreviewError("cannot read " + string + ": " + str(error))
+    return evaluate(tree, variables)
+
+
+def is_number(tree):
+    """whether the expression has no other names than the constants, like 2⋅π"""
+    return symbolic.free_names(tree) <= set(constants)
+
+
+def linear_coefficients(tree, unknown):
+    """the constant coefficients of the derivatives of the unknown in a linear differential expression,
+        by order, e.g. {2: -1.0, 0: 2.0} for -Δu + 2⋅u"""
+    kind = tree[0]
+    if kind == 'name' and tree[1] == unknown:
+        return {0: 1.0}
+    if kind == 'apply' and tree[1] == ('name', unknown):
+        return {0: 1.0}
+    if kind == 'diff':
+        return {order + symbolic.differential_operators[tree[1]]: coefficient
+                for order, coefficient in linear_coefficients(tree[2], unknown).items()}
+    if kind == 'apply' and tree[1][0] == 'name' and tree[1][1] in symbolic.differential_operator_names \
+            and len(tree[2]) == 1:
+        return {order + symbolic.differential_operator_names[tree[1][1]]: coefficient
+                for order, coefficient in linear_coefficients(tree[2][0], unknown).items()}
+    if kind == 'neg':
+        return {order: -coefficient for order, coefficient in linear_coefficients(tree[1], unknown).items()}
+    if kind == 'op' and tree[1] in ["+", "-"]:
+        sign = 1.0 if tree[1] == "+" else -1.0
+        coefficients = dict(linear_coefficients(tree[2], unknown))
+        for order, coefficient in linear_coefficients(tree[3], unknown).items():
+            coefficients[order] = coefficients.get(order, 0.0) + sign * coefficient
+        return coefficients
+    if kind == 'op' and tree[1] == "⋅":
+        if is_number(tree[2]):
+            factor, term = float(evaluate(tree[2], {})), tree[3]
+        elif is_number(tree[3]):
+            factor, term = float(evaluate(tree[3], {})), tree[2]
+        else:
+            raise PreviewError("only constant coefficients are supported")
+        return {order: factor * coefficient for order, coefficient in linear_coefficients(term, unknown).items()}
+    if kind == 'op' and tree[1] == "/" and is_number(tree[3]):
+        divisor = float(evaluate(tree[3], {}))
+        return {order: coefficient / divisor for order, coefficient in linear_coefficients(tree[2], unknown).items()}
+    raise PreviewError("not a linear differential expression in " + unknown)
+
+
+def boundary_values(simdata, unknown, x_from, x_to):
+    """the Dirichlet values at both ends of the domain, later conditions overriding earlier ones"""
+    values = {}
+    for bc in simdata["bcs"]["bcs"]:
+        if "Dirichlet" not in bc.get("type", ["Dirichlet"]):
+            raise PreviewError("only Dirichlet boundary conditions are supported")
+        rhs = bc.get("rhsstring_expanded", bc["rhsstring"])
+        kind = symbolic.boundary_condition_kind(bc["lhsstring"], unknown)
+        if kind == 'function':
+            values["from"] = float(evaluate_string(rhs, x=x_from))
+            values["to"] = float(evaluate_string(rhs, x=x_to))
+        elif kind == 'point':
+            point = float(evaluate(symbolic.parse(bc["lhsstring"])[2][0], {}))
+            end = "from" if np.isclose(point, x_from) else "to" if np.isclose(point, x_to) else None
+            if end is None:
+                raise PreviewError("the condition " + bc.get("string", bc["lhsstring"]) + " is not on the boundary")
+            values[end] = float(evaluate_string(rhs, x=point))
+        else:
+            raise PreviewError("cannot read the boundary condition " + bc.get("string", bc["lhsstring"]))
+    if len(values) != 2:
+        raise PreviewError("need a boundary value at both ends")
+    return values["from"], values["to"]
+
+
+def solve(simdata, level=default_level):
+    """the grid points and the solution on 2^level intervals, as ExaStencils' grid on that level"""
+    if simdata["num_dimensions"] != 1:
+        raise PreviewError("only 1D problems are supported")
+    unknowns = [*simdata["unknowns"]]
+    if len(unknowns) != 1:
+        raise PreviewError("only one unknown is supported")
+    unknown = unknowns[0]
+    pde = simdata["pdes"]["pdes"][-1]
+    try:
+        coefficients = linear_coefficients(symbolic.parse(pde["lhsstring"]), unknown)
+    except symbolic.SymbolicParseError as error:
+        raise PreviewError("cannot read " + pde["lhsstring"] + ": " + str(error))
+    a2, a1, a0 = [coefficients.pop(order, 0.0) for order in [2, 1, 0]]
+    if coefficients or a2 == 0.0:
+        raise PreviewError("only second order equations are supported")
+
+    x_from = float(evaluate_string(str(simdata["domain"]["from"])))
+    x_to = float(evaluate_string(str(simdata["domain"]["to"])))
+    intervals = 2 ** level
+    x = np.linspace(x_from, x_to, intervals + 1)
+    h = (x_to - x_from) / intervals
+    u_from, u_to = boundary_values(simdata, unknown, x_from, x_to)
+
+    # central differences on the interior points, the boundary values moved to the right-hand side
+    rhs = np.broadcast_to(evaluate_string(pde.get("rhsstring_expanded", pde["rhsstring"]), x=x[1:-1]),
+                          (intervals - 1,)).astype(float)
+    lower = a2 / h ** 2 - a1 / (2 * h)
+    diagonal = -2 * a2 / h ** 2 + a0
+    upper = a2 / h ** 2 + a1 / (2 * h)
+    matrix = scipy.sparse.diags([lower, diagonal, upper], [-1, 0, 1], shape=(intervals - 1, intervals - 1),
+                                format='csc')
+    rhs[0] -= lower * u_from
+    rhs[-1] -= upper * u_to
+    values = np.empty(intervals + 1)
+    values[0], values[-1] = u_from, u_to
+    values[1:-1] = scipy.sparse.linalg.spsolve(matrix, rhs)
+    if not np.all(np.isfinite(values)):
+        raise PreviewError("the discrete problem has no solution")
+    return x, values
@@ -2,12 +2,46 @@
 
 from distutils.util import strtobool
 import re
+from collections import namedtuple
+from functools import lru_cache
 from urllib.parse import urlparse, urlencode, ParseResult
 
 object_delimiter = "❘"
 declaration_delimiter = "❙"
 module_delimiter = "❚"
 
+# the lexer for MMT surface syntax, used for user input and for the type strings MMT returns
+Token = namedtuple("Token", ["kind", "text", "start", "end"])
+_token_regex = re.compile(r"""\s*(?:
+    (?P<number>\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+)
+    |(?P<diffop>[Δ∆∂∇])
+    |(?P<name>[^\W\d]\w*)
+    |(?P<symbol>⟶|→|->|\*\*|\S)
+    )""", re.VERBOSE)
+word_kinds = ["number", "diffop", "name"]
+arrows = ["⟶", "→", "->"]
+# what is not a type symbol when comparing types
+type_punctuation = arrows + ["(", ")", "{", "}", ":"]
+
+
+@lru_cache(maxsize=1024)
+def tokenize(string):
+    """splits the string into a tuple of Tokens, once per distinct string"""
+    tokens = []
+    position = 0
+    end = len(string.rstrip())
+    while position < end:
+        match = _token_regex.match(string, position)
+        kind = match.lastgroup
+        tokens.append(Token(kind, match.group(kind), match.start(kind), match.end(kind)))
+        position = match.end()
+    return tuple(tokens)
+
+
+def find_tokens(string, texts):
+    """all tokens in the string that are one of texts"""
+    return [token for token in tokenize(string) if token.text in texts]
+
 def means_no(answer):
     try:
         ret = strtobool(answer)
@@ -63,44 +97,20 @@ def insert_type(string, whichtype):
 
 
 def type_is_function_from(type_string, from_string):
-    if type_string.startswith(from_string + " ⟶"):
-        return True
-    if type_string.startswith("{ : " + from_string):
-        return True
-
-    from_string = make_list_of_type_symbols(from_string)
-    type_string = make_list_of_type_symbols(type_string)
-
-    if len(from_string) > len(type_string):
-        return False
-
-    for index in range(len(from_string)):
-        if from_string[index] != type_string[index]:
-            return False
-
-    return True
+    from_symbols = make_list_of_type_symbols(from_string)
+    return make_list_of_type_symbols(type_string)[:len(from_symbols)] == from_symbols
 
 
 def type_is_function_to(type_string, to_string):
-    if type_string.endswith("⟶ " + to_string):
-        return True
-    if type_string.endswith("} " + to_string):
-        return True
-    to_string = make_reverse_list_of_type_symbols(to_string)
-    type_string = make_reverse_list_of_type_symbols(type_string)
-
-    if len(to_string) > len(type_string):
-        return False
-
-    for index in range(len(to_string)):
-        if to_string[index] != type_string[index]:
-            return False
-
-    return True
+    to_symbols = make_list_of_type_symbols(to_string)
+    type_symbols = make_list_of_type_symbols(type_string)
+    return type_symbols[len(type_symbols) - len(to_symbols):] == to_symbols
 
 
 def remove_apply_brackets(string):
-    return string.split('(', 1)[0] + string.split(')', 1)[1].strip()
+    opening = find_tokens(string, ["("])[0]
+    closing = find_tokens(string, [")"])[0]
+    return string[:opening.start] + string[closing.end:].strip()
 
 
 def insert_before_def(string, insertstring):
@@ -111,26 +121,25 @@ def insert_before_def(string, insertstring):
 
 
 def get_first_word(string):
-    return re.split('\W+', string, 1)[0]
+    tokens = tokenize(string)
+    if tokens and tokens[0].start == 0 and tokens[0].kind in word_kinds:
+        return tokens[0].text
+    return ''
 
 
 def get_last_type(string):
-    string = remove_round_brackets(string)
-    string = string.rstrip()
-    return re.split('[⟶ \s]', string)[-1]
+    symbols = make_list_of_type_symbols(string)
+    return symbols[-1] if symbols else ''
 
 
 def make_reverse_list_of_type_symbols(string):
-    slist = make_list_of_type_symbols(string)
-    slist.reverse()
-    return slist
+    return list(reversed(make_list_of_type_symbols(string)))
 
 
+@lru_cache(maxsize=1024)
 def make_list_of_type_symbols(string):
-    string = remove_arrows(remove_colons(remove_curly_brackets(remove_round_brackets(string))))
-    slist = string.split(' ')
-    slist = list(filter(lambda a: a != '', slist))
-    return slist
+    """the type's symbols without brackets, colons and arrows, as a tuple to be compared structurally"""
+    return tuple([token.text for token in tokenize(string) if token.text not in type_punctuation])
 
 
 def remove_round_brackets(string):
@@ -173,25 +182,49 @@ def assert_question_mark(what):
 
 
 def add_ods(string):
-    objects = re.split(r'(\W)', string)
-    onedel = False
-    for i in range(2, len(objects)):
-        if bool(re.match('[:=]', objects[i], re.I)):  # if it starts with : or =
-            if onedel:
-                objects[i] = object_delimiter + objects[i]
-                return ''.join(objects)
-            onedel = True  # start only at second : or =
-    return ''.join(objects)
+    """puts an object delimiter before the second : or =, i.e. between type and definition"""
+    # a : or = directly after the first word does not count
+    first_word_end = len(get_first_word(string))
+    delimiters = [token for token in find_tokens(string, [":", "="]) if token.start > first_word_end]
+    if len(delimiters) < 2:
+        return string
+    # start only at second : or =
+    return string[:delimiters[1].start] + object_delimiter + string[delimiters[1].start:]
 
 
 def functionize(string, typename="Ω", varname="x"):
-    return string.replace("=", "= [ " + varname + " : " + typename + "]")
+    insertion = " [ " + varname + " : " + typename + "]"
+    functionized = ""
+    position = 0
+    for token in find_tokens(string, ["="]):
+        functionized += string[position:token.end] + insertion
+        position = token.end
+    return functionized + string[position:]
 
 
 def split_string_at_AS(string):
     return re.split('AS', string)
 
 
+# characters and ligatures pylatexenc would change; input without them is returned as is
+_latex_special_regex = re.compile(r"[\\{}%$~&]|--|``|''|\n\s*\n")
+_latex_converter = None
+
+
+@lru_cache(maxsize=512)
+def latex_to_text(string):
+    """converts LaTeX commands in the user input to unicode, e.g. \\Delta u to Δu.
+    Plain and unicode-only input skips the LaTeX parser"""
+    global _latex_converter
+    if not _latex_special_regex.search(string):
+        return string
+    if _latex_converter is None:
+        # https://github.com/phfaist/pylatexenc for directly converting Latex commands to unicode
+        from pylatexenc.latex2text import LatexNodes2Text
+        _latex_converter = LatexNodes2Text()
+    return _latex_converter.latex_to_text(string)
+
+
 def replace_times_to_cdot(string):
     return string.replace("·", "⋅").replace("*", "⋅")
 
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+"""A small local symbolic layer over the MMT surface syntax the user types in,
+to answer the easy questions about equations (does it mention x, is it linear, which order is the operator)
+without asking the MMT server. Anything it cannot decide is reported as None and left to MMT."""
+
+from functools import lru_cache
+
+from . import string_handling
+from .mmtinterface import MMTType
+
+# prefix operators that differentiate what follows, with the order they add
+differential_operators = {
+    "Δ": 2,
+    "∆": 2,
+    "∂": 1,
+    "∇": 1,
+}
+# differential operators that are applied like functions, as in mDifferentialOperators
+differential_operator_names = {
+    "derivative": 1,
+    "twodiff": 2,
+    "laplace_operator": 2,
+}
+
+class SymbolicParseError(ValueError):
+    """The input is not something the local parser understands - ask MMT instead"""
+
+
+class _Parser:
+    """Recursive descent parser producing nested tuples:
+        ('num', value), ('name', name), ('apply', head, [args]), ('op', symbol, left, right),
+        ('neg', operand), ('diff', operator, operand), ('lambda', variable, typestring, body)"""
+
+    additive = ["+", "-"]
+    multiplicative = ["⋅", "*", "·", "/"]
+    power = ["^", "**"]
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][:2]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, value):
+        kind, token = self.next()
+        if token != value:
+            raise SymbolicParseError("expected " + value + " but got " + str(token))
+
+    def parse(self):
+        tree = self.sum()
+        if self.position != len(self.tokens):
+            raise SymbolicParseError("could not parse beyond " + str(self.peek()[1]))
+        return tree
+
+    def sum(self):
+        left = self.product()
+        while self.peek()[1] in self.additive:
+            symbol = self.next()[1]
+            left = ('op', symbol, left, self.product())
+        return left
+
+    def product(self):
+        left = self.unary()
+        while self.peek()[1] in self.multiplicative:
+            symbol = self.next()[1]
+            if symbol != "/":
+                symbol = "⋅"
+            left = ('op', symbol, left, self.unary())
+        return left
+
+    def unary(self):
+        kind, token = self.peek()
+        if token == "-":
+            self.next()
+            return ('neg', self.unary())
+        if token == "+":
+            self.next()
+            return self.unary()
+        if kind == 'diffop':
+            self.next()
+            return ('diff', token, self.unary())
+        base = self.application()
+        if self.peek()[1] in self.power:
+            self.next()
+            return ('op', "^", base, self.unary())
+        return base
+
+    def starts_primary(self):
+        kind, token = self.peek()
+        return kind in ['number', 'name'] or token in ["(", "["]
+
+    def application(self):
+        head = self.primary()
+        while True:
+            kind, token = self.peek()
+            if token == "(" and head[0] != 'num':
+                self.next()
+                args = [self.sum()]
+                while self.peek()[1] == ",":
+                    self.next()
+                    args.append(self.sum())
+                self.expect(")")
+                head = ('apply', head, args)
+            elif self.starts_primary() and head[0] in ['name', 'apply']:
+                # juxtaposition is application in MMT, e.g. "twodiff u"
+                head = ('apply', head, [self.primary()])
+            elif kind == 'name' and head[0] == 'num':
+                # "2 x" is a product
+                head = ('op', "⋅", head, self.application())
+            else:
+                return head
+
+    def primary(self):
+        kind, token = self.next()
+        if kind == 'number':
+            return ('num', float(token))
+        if kind == 'name':
+            return ('name', token)
+        if token == "(":
+            inner = self.sum()
+            self.expect(")")
+            return inner
+        if token == "[":
+            # lambda binder [ x : Ω ] body
+            kind, variable = self.next()
+            if kind != 'name':
+                raise SymbolicParseError("expected a variable name in binder")
+            type_tokens = []
+            if self.peek()[1] == ":":
+                self.next()
+                while self.peek()[1] not in ["]", None]:
+                    type_tokens.append(self.next()[1])
+            self.expect("]")
+            return ('lambda', variable, " ".join(type_tokens), self.sum())
+        raise SymbolicParseError("unexpected " + str(token))
+
+
+@lru_cache(maxsize=256)
+def parse(string):
+    """parses an expression into a tree of tuples, raises SymbolicParseError if it is not understood"""
+    tokens = string_handling.tokenize(string)
+    if not tokens:
+        raise SymbolicParseError("empty expression")
+    return _Parser(tokens).parse()
+
+
+def try_parse(string):
+    try:
+        return parse(string)
+    except SymbolicParseError:
+        return None
+
+
+def split_equation(string):
+    """splits an equation into its left- and right-hand side, or returns None if there is not exactly one ="""
+    parts = string.split("=")
+    if len(parts) != 2:
+        return None
+    return parts[0].strip(), parts[1].strip()
+
+
+def free_names(tree, bound=frozenset()):
+    """all names occurring unbound in the expression"""
+    kind = tree[0]
+    if kind == 'num':
+        return set()
+    if kind == 'name':
+        return set() if tree[1] in bound else {tree[1]}
+    if kind == 'apply':
+        names = free_names(tree[1], bound)
+        for arg in tree[2]:
+            names |= free_names(arg, bound)
+        return names
+    if kind == 'op':
+        return free_names(tree[2], bound) | free_names(tree[3], bound)
+    if kind in ['neg', 'diff']:
+        return free_names(tree[-1], bound)
+    if kind == 'lambda':
+        return free_names(tree[3], bound | {tree[1]})
+    return set()
+
+
+def mentions_free(string, name="x"):
+    """whether name occurs freely in the string; falls back to a substring test if the string cannot be parsed"""
+    tree = try_parse(string)
+    if tree is None:
+        return name in string
+    return name in free_names(tree)
+
+
+def is_constant(tree):
+    """whether the expression only consists of number literals"""
+    return len(free_names(tree)) == 0
+
+
+_nonlinear = float("inf")
+
+
+def degree(tree, unknowns):
+    """polynomial degree of the expression in the unknowns (and their derivatives), inf if not polynomial"""
+    kind = tree[0]
+    if kind == 'num':
+        return 0
+    if kind == 'name':
+        return 1 if tree[1] in unknowns else 0
+    if kind in ['neg', 'diff']:
+        return degree(tree[-1], unknowns)
+    if kind == 'lambda':
+        return degree(tree[3], unknowns - {tree[1]})
+    if kind == 'op':
+        symbol, left, right = tree[1], degree(tree[2], unknowns), degree(tree[3], unknowns)
+        if symbol in ["+", "-"]:
+            return max(left, right)
+        if symbol == "⋅":
+            return left + right
+        if symbol == "/":
+            return left if right == 0 else _nonlinear
+        if symbol == "^":
+            if left == 0 and right == 0:
+                return 0
+            if right == 0 and tree[3][0] == 'num' and float(tree[3][1]).is_integer():
+                return left * int(tree[3][1])
+            return _nonlinear
+    if kind == 'apply':
+        head, args = tree[1], tree[2]
+        arg_degree = max([degree(arg, unknowns) for arg in args])
+        if head[0] == 'name' and head[1] in unknowns:
+            # u(x) is linear, u(u(x)) is not
+            return 1 if arg_degree == 0 else _nonlinear
+        if head[0] == 'name' and head[1] in differential_operator_names:
+            return arg_degree
+        if arg_degree == 0:
+            return degree(head, unknowns)
+        return _nonlinear
+    return _nonlinear
+
+
+def order(tree, unknowns):
+    """the highest order of derivatives of the unknowns in the expression"""
+    kind = tree[0]
+    if kind in ['num', 'name']:
+        return 0
+    if kind == 'diff':
+        inner = order(tree[2], unknowns)
+        if degree(tree[2], unknowns) == 0 and inner == 0:
+            return 0
+        return differential_operators[tree[1]] + inner
+    if kind == 'neg':
+        return order(tree[1], unknowns)
+    if kind == 'lambda':
+        return order(tree[3], unknowns)
+    if kind == 'op':
+        return max(order(tree[2], unknowns), order(tree[3], unknowns))
+    if kind == 'apply':
+        head, args = tree[1], tree[2]
+        inner = max([order(arg, unknowns) for arg in args])
+        if head[0] == 'name' and head[1] in differential_operator_names:
+            return differential_operator_names[head[1]] + inner
+        return max(inner, order(head, unknowns))
+    return 0
+
+
+def classify(lhs_string, unknowns):
+    """linearity and order of the differential operator on the left-hand side,
+    each None if the local parser does not understand it"""
+    tree = try_parse(lhs_string)
+    if tree is None:
+        return {"linear": None, "order": None}
+    unknowns = frozenset(unknowns)
+    return {
+        "linear": degree(tree, unknowns) <= 1,
+        "order": order(tree, unknowns),
+    }
+
+
+def needs_function_wrapper(string, domain_names, known_types):
+    """whether the expression still has to be made a function on the domain, by placing [ x : domain ] in front.
+    known_types maps names (unknowns, parameters) to their type strings.
+    Returns None for the genuinely ambiguous cases, where MMT has to infer the type."""
+    tree = try_parse(string)
+    if tree is None:
+        return None
+    if tree[0] == 'lambda':
+        return False
+    names = free_names(tree)
+    if "x" in names:
+        # an expression in x, like f(x) or x ⋅ x
+        return True
+    if not names:
+        # a constant
+        return True
+    if not names.issubset(known_types):
+        return None
+    is_function = [any(MMTType.parse(known_types[name]).is_function_from(MMTType.parse(domain))
+                       for domain in domain_names)
+                   for name in names]
+    if all(is_function):
+        return False
+    if not any(is_function) and tree[0] != 'apply':
+        return True
+    return None
+
+
+def boundary_condition_kind(lhs_string, unknown):
+    """'function' if the left-hand side is the unknown itself (a condition on the whole boundary),
+    'point' if it is the unknown at a number (a condition at one point), None otherwise"""
+    tree = try_parse(lhs_string)
+    if tree == ('name', unknown):
+        return 'function'
+    if tree is not None and tree[0] == 'apply' and tree[1] == ('name', unknown) \
+            and len(tree[2]) == 1 and is_constant(tree[2][0]):
+        return 'point'
+    return None
+
+
+def has_word(string, word):
+    """whether word occurs as a whole word, so that e.g. "nonlinear" does not count as "linear" """
+    return word in [token.text for token in string_handling.tokenize(string) if token.kind == 'name']
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+"""A pool of pre-started MoSIS kernels, for JupyterHub / Jupyter server deployments.
+
+Starting a kernel means starting Python, importing metakernel and the state machine, constructing the interview
+and opening the connection to MMT. The WarmPoolProvisioner does all that ahead of time for pool_size kernels,
+and hands one of them to the next notebook that asks for a kernel. It is enabled in the kernel spec, cf.
+python -m interview_kernel.install --warm-pool 2
+
+    "metadata": {"kernel_provisioner": {"provisioner_name": "mosis-warm-pool", "config": {"pool_size": 2}}}
+
+Kernels taken from the pool were started before the notebook asked for them, so they do not see environment
+variables the server sets per launch (e.g. JPY_SESSION_NAME), and run in the server's working directory."""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from tempfile import gettempdir
+
+from jupyter_client.connect import write_connection_file
+from jupyter_client.launcher import launch_kernel
+from jupyter_client.provisioning import LocalProvisioner
+from jupyter_client.provisioning.local_provisioner import LocalPortCache
+from traitlets import Integer
+
+
+class WarmKernel:
+    """a kernel process started ahead of time, with its own connection file"""
+
+    def __init__(self, process, connection_file, connection_info):
+        self.process = process
+        self.connection_file = connection_file
+        self.connection_info = connection_info
+        self.started = time.monotonic()
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+
+class WarmPool:
+    """keeps size kernels started with argv, one of which take() returns"""
+
+    def __init__(self, argv, size=2, env=None, ip="127.0.0.1"):
+        self.argv = list(argv)
+        self.size = size
+        self.env = env
+        self.ip = ip
+        self.kernels = deque()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.started = 0
+
+    def start_kernel(self):
+        connection_file = os.path.join(gettempdir(), "mosis-warm-" + uuid.uuid4().hex + ".json")
+        connection_file, info = write_connection_file(connection_file, ip=self.ip, key=uuid.uuid4().hex.encode())
+        info["key"] = info["key"].encode() if isinstance(info["key"], str) else info["key"]
+        cmd = [arg.replace("{connection_file}", connection_file).replace("{prefix}", sys.prefix)
+               for arg in self.argv]
+        env = dict(os.environ if self.env is None else self.env)
+        # so that the kernel exits with the server
+        env["JPY_PARENT_PID"] = str(os.getpid())
+        process = launch_kernel(cmd, env=env)
+        self.started += 1
+        return WarmKernel(process, connection_file, info)
+
+    def fill(self):
+        """starts kernels until there are size of them; does not wait for them to be ready"""
+        with self.lock:
+            for kernel in [k for k in self.kernels if not k.is_alive()]:
+                self.kernels.remove(kernel)
+                self.remove_connection_file(kernel)
+            while len(self.kernels) < self.size:
+                self.kernels.append(self.start_kernel())
+
+    def take(self):
+        """the oldest (and hence warmest) running kernel, or None if the pool is empty"""
+        with self.lock:
+            while self.kernels:
+                kernel = self.kernels.popleft()
+                if kernel.is_alive():
+                    self.hits += 1
+                    # the kernel has read it already, the kernel manager writes its own
+                    self.remove_connection_file(kernel)
+                    return kernel
+                self.remove_connection_file(kernel)
+            self.misses += 1
+            return None
+
+    def remove_connection_file(self, kernel):
+        try:
+            os.remove(kernel.connection_file)
+        except OSError:
+            pass
+
+    def shutdown(self):
+        with self.lock:
+            while self.kernels:
+                kernel = self.kernels.popleft()
+                if kernel.is_alive():
+                    kernel.process.kill()
+                    kernel.process.wait()
+                self.remove_connection_file(kernel)
+
+    def metrics(self):
+        requests = self.hits + self.misses
+        return {
+            "size": self.size,
+            "ready": len(self.kernels),
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else None,
+        }
+
+
+# one pool per kernel command line, shared by all provisioner instances of the server process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(argv, size):
+    with _pools_lock:
+        key = tuple(argv)
+        if key not in _pools:
+            _pools[key] = WarmPool(argv, size)
+        return _pools[key]
+
+
+@atexit.register
+def _shutdown_pools():
+    for pool in _pools.values():
+        pool.shutdown()
+
+
+class WarmPoolProvisioner(LocalProvisioner):
+    """hands out pre-started kernels, and falls back to starting one like the LocalProvisioner if there are none"""
+
+    pool_size = Integer(2, config=True, help="Number of kernels to keep started ahead of time")
+
+    # whether this provisioner has launched its kernel; restarts keep the ports and key, so never use the pool
+    launched = False
+
+    async def launch_kernel(self, cmd, **kwargs):
+        if self.launched:
+            return await super(WarmPoolProvisioner, self).launch_kernel(cmd, **kwargs)
+        self.launched = True
+        pool = get_pool(self.kernel_spec.argv, self.pool_size)
+        kernel = pool.take()
+        if kernel is None:
+            connection_info = await super(WarmPoolProvisioner, self).launch_kernel(cmd, **kwargs)
+        else:
+            self.process = kernel.process
+            self.pid = kernel.process.pid
+            self.pgid = os.getpgid(self.pid) if hasattr(os, "getpgid") else None
+            self.cwd = kwargs.get("cwd", os.getcwd())
+            self.swap_ports(kernel.connection_info)
+            self.connection_info = kernel.connection_info
+            connection_info = self.connection_info
+        # replace the kernel we took, for the next notebook
+        pool.fill()
+        self.log.info("MoSIS warm pool: " + ("hit" if kernel is not None else "miss") + " " +
+                      json.dumps(pool.metrics()))
+        return connection_info
+
+    def swap_ports(self, connection_info):
+        """returns the ports pre_launch reserved for a kernel we did not start, and holds the pooled kernel's
+            instead, which cleanup() returns"""
+        if not self.ports_cached:
+            return
+        port_cache = LocalPortCache.instance()
+        for name in ["shell_port", "iopub_port", "stdin_port", "hb_port", "control_port"]:
+            port_cache.return_port(self.connection_info[name])
+            port_cache.currently_used_ports.add(connection_info[name])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""Runs the (possibly long) handling of a cell in a worker thread, while the kernel's main thread waits in a way that
+can be interrupted. On a kernel interrupt, the work is cancelled through a cancel function, which is expected to
+kill subprocesses and abort HTTP requests, so that the worker thread returns soon."""
+
+import contextvars
+import threading
+import time
+
+
+class Cancelled(Exception):
+    """Raised inside the worker when its work was cancelled by the user"""
+
+
+class BackgroundWorker:
+
+    def __init__(self, cancel_function=None, heartbeat_function=None, heartbeat_interval=10.0, cancel_timeout=10.0):
+        """cancel_function() is called from the main thread on interrupt,
+        heartbeat_function(seconds) every heartbeat_interval seconds while the work is still running"""
+        self.cancel_function = cancel_function
+        self.heartbeat_function = heartbeat_function
+        self.heartbeat_interval = heartbeat_interval
+        self.cancel_timeout = cancel_timeout
+        self.thread = None
+        self.poll_interval = 0.1
+
+    def is_busy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self, function, *args, **kwargs):
+        """runs function in the worker thread and returns its result, or raises its exception.
+        Raises Cancelled if the main thread was interrupted (KeyboardInterrupt) meanwhile"""
+        if self.is_busy():
+            # the last cancelled work has not given up yet, we cannot run two at a time
+            self.wait(self.thread, heartbeat=False)
+
+        result = {}
+
+        def target():
+            try:
+                result["value"] = function(*args, **kwargs)
+            except BaseException as error:
+                result["error"] = error
+
+        # run in a copy of the current context, so that e.g. output goes to the right cell
+        context = contextvars.copy_context()
+        self.thread = threading.Thread(target=context.run, args=(target,), name="interview-worker", daemon=True)
+        self.thread.start()
+        try:
+            self.wait(self.thread)
+        except KeyboardInterrupt:
+            self.cancel()
+            raise Cancelled("Interrupted")
+
+        if "error" in result:
+            raise result["error"]
+        return result.get("value")
+
+    def wait(self, thread, heartbeat=True):
+        """wait for the thread in small steps, so that KeyboardInterrupt gets through"""
+        start = time.monotonic()
+        next_heartbeat = start + self.heartbeat_interval
+        while thread.is_alive():
+            thread.join(self.poll_interval)
+            now = time.monotonic()
+            if heartbeat and self.heartbeat_function is not None and now >= next_heartbeat:
+                self.heartbeat_function(now - start)
+                next_heartbeat = now + self.heartbeat_interval
+
+    def cancel(self):
+        """cancel the running work, and give it cancel_timeout seconds to wind down"""
+        if self.cancel_function is not None:
+            self.cancel_function()
+        if self.thread is not None:
+            self.thread.join(self.cancel_timeout)
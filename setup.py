@@ -16,12 +16,13 @@ setup(
     author_email='theresa.pollinger@fau.de',
     description='A Jupyter kernel that interviews you for a PDE model and \
                     transforms it into an ExaStencils simulation.',
-    python_requires=">=3.4",
+    python_requires=">=3.7",
     # replicating contents of MANIFEST,
     # cf.https://stackoverflow.com/questions/7522250/how-to-include-package-data-with-setuptools-distribute/14159430#14159430
     package_data={
         'interview_kernel': ['exastencils/compiler.jar',
                              'exastencils/generate_compile_and_run_list.sh',
+                             'exastencils/GeneratorDaemon.java',
                              'exastencils/lib/*.*'],
     },
 #    data_files=[
@@ -29,6 +30,11 @@ setup(
     zip_safe=False,
     # use_scm_version=True,
     setup_requires=['setuptools_scm'],  # or possibly https://pypi.python.org/pypi/setuptools-git
-    install_requires=['transitions', 'bokeh', 'pandas', 'requests', 'pylatexenc', 'metakernel', 'lxml',
-                      'IPython', 'jupyter_client', 'ipywidgets']
+    install_requires=['transitions', 'bokeh', 'pandas', 'numpy', 'scipy', 'requests', 'pylatexenc', 'metakernel',
+                      'lxml', 'IPython', 'jupyter_client', 'ipywidgets'],
+    entry_points={
+        'jupyter_client.kernel_provisioners': [
+            'mosis-warm-pool = interview_kernel.warm_pool:WarmPoolProvisioner',
+        ],
+    },
 )
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from interview_kernel import fieldfile
+
+
+def write_text_field(path, x, values):
+    # as ExaStencils writes it: x and value per line, with a trailing space
+    with open(str(path), 'w') as f:
+        for point, value in zip(x, values):
+            f.write("%.17g %.17g \n" % (point, value))
+
+
+def test_write_and_open(tmp_path):
+    x = np.linspace(0.0, 1.0, 33)
+    path = tmp_path.joinpath("u.field")
+    fieldfile.write_field(path, OrderedDict([("x", x), ("u", x * x)]))
+    header, columns = fieldfile.open_field(path)
+    assert header["columns"] == ["x", "u"]
+    assert header["shape"] == [33]
+    assert header["offset"] % fieldfile.alignment == 0
+    assert np.array_equal(columns["x"], x)
+    assert np.array_equal(columns["u"], x * x)
+
+
+def test_not_a_field_file(tmp_path):
+    path = tmp_path.joinpath("u.field")
+    path.write_bytes(b"0 0 \n1 1 \n")
+    with pytest.raises(ValueError):
+        fieldfile.read_header(path)
+
+
+def test_convert_keeps_every_point(tmp_path):
+    x = np.linspace(0.0, 1.0, 17)
+    write_text_field(tmp_path.joinpath("u.dat"), x, np.sin(x))
+    text_x, text_values = fieldfile.load_field(tmp_path, "u")
+    assert len(text_x) == 17
+    fieldfile.convert_all(tmp_path)
+    assert tmp_path.joinpath("u.field").exists()
+    binary_x, binary_values = fieldfile.load_field(tmp_path, "u")
+    assert np.array_equal(binary_x, text_x)
+    assert np.array_equal(binary_values, text_values)
+    assert np.allclose(binary_values, np.sin(x), rtol=1e-15, atol=0)
+
+
+def test_field_cache(tmp_path):
+    x = np.linspace(0.0, 1.0, 100)
+    fieldfile.write_field(tmp_path.joinpath("u.field"), OrderedDict([("x", x), ("u", x)]))
+    fieldfile.write_field(tmp_path.joinpath("v.field"), OrderedDict([("x", x), ("v", x)]))
+    cache = fieldfile.FieldCache(max_bytes=2 * x.nbytes)
+    cache.load(tmp_path, "u")
+    cache.load(tmp_path, "u")
+    assert cache.stats()["hits"] == 1
+    # does not fit next to u
+    cache.load(tmp_path, "v")
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 2 * x.nbytes
+    # a run rewrites v
+    fieldfile.write_field(tmp_path.joinpath("v.field"), OrderedDict([("x", x), ("v", 2 * x)]))
+    assert np.array_equal(cache.load(tmp_path, "v")[1], 2 * x)
+    cache.invalidate(tmp_path)
+    assert cache.stats()["fields"] == 0
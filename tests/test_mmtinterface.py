@@ -0,0 +1,28 @@
+from lxml import etree
+
+from interview_kernel.mmtinterface import MMTReply, MMTType
+
+math = '<math xmlns="http://www.w3.org/1998/Math/MathML">%s</math>'
+openmath = '<om:OMOBJ xmlns:om="http://www.openmath.org/OpenMath">%s</om:OMOBJ>'
+
+
+def reply(body):
+    return MMTReply(True, etree.fromstring(math % body))
+
+
+def test_inferred_type_from_the_presentation():
+    answer = reply("<mo>Ω</mo><mo>⟶</mo><mo>ℝ</mo>")
+    assert answer.inferred_type_to_string() == "Ω ⟶ ℝ"
+    assert answer.inferred_type() is MMTType.arrow([MMTType.constant("Ω")], MMTType.constant("ℝ"))
+
+
+def test_inferred_type_from_the_top_level_annotation():
+    # the sub-term Ω comes first in the document, with an annotation of its own
+    inner = '<semantics><mo>Ω</mo><annotation-xml encoding="OpenMath">' + \
+            openmath % '<om:OMS name="Ω"/>' + '</annotation-xml></semantics>'
+    outer = '<annotation-xml encoding="OpenMath">' + \
+            openmath % '<om:OMA><om:OMS name="arrow"/><om:OMS name="Ω"/><om:OMS name="ℝ"/></om:OMA>' + \
+            '</annotation-xml>'
+    answer = reply("<semantics><mrow>" + inner + "<mo>⟶</mo><mo>ℝ</mo></mrow>" + outer + "</semantics>")
+    assert answer.inferred_type() is MMTType.arrow([MMTType.constant("Ω")], MMTType.constant("ℝ"))
+    assert answer.inferred_type_to_string() == "Ω ⟶ ℝ"
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from interview_kernel import preview
+
+
+def simdata(lhs="Δu", rhs="x ⋅ x", bcs=(("u", "0"),)):
+    return {
+        "num_dimensions": 1,
+        "domain": {"from": "0", "to": "1"},
+        "unknowns": {"u": {}},
+        "pdes": {"pdes": [{"lhsstring": lhs, "rhsstring": rhs}]},
+        "bcs": {"bcs": [{"lhsstring": bc_lhs, "rhsstring": bc_rhs, "type": ["Dirichlet"]} for bc_lhs, bc_rhs in bcs]},
+    }
+
+
+def test_poisson_against_exact_solution():
+    x, values = preview.solve(simdata(), 10)
+    assert len(x) == 2 ** 10 + 1
+    # Δu = x², u(0) = u(1) = 0
+    assert np.abs(values - (x ** 4 - x) / 12).max() < 1e-7
+
+
+def test_error_decreases_with_the_level():
+    errors = []
+    for level in [4, 6, 8]:
+        x, values = preview.solve(simdata(), level)
+        errors.append(np.abs(values - (x ** 4 - x) / 12).max())
+    assert errors[0] > errors[1] > errors[2]
+
+
+def test_point_conditions_and_lower_order_terms():
+    # -u'' + π² u = 2π² sin(πx), u(0) = u(1) = 0 has the solution sin(πx)
+    x, values = preview.solve(simdata("-Δu + π^2⋅u", "2⋅π^2⋅sin(π⋅x)", (("u(0)", "0"), ("u(1)", "0"))), 10)
+    assert np.abs(values - np.sin(np.pi * x)).max() < 1e-5
+
+
+def test_expanded_parameter():
+    # what try_expand makes of f(x) with f = x ⋅ x
+    x, values = preview.solve(simdata(rhs="x ⋅ x(x)"), 8)
+    assert np.abs(values - (x ** 4 - x) / 12).max() < 1e-5
+
+
+@pytest.mark.parametrize("data", [
+    simdata(lhs="u⋅Δu"),
+    simdata(lhs="∂u"),
+    simdata(rhs="g(x)"),
+    simdata(bcs=(("u(0)", "0"),)),
+    simdata(bcs=(("u(0.5)", "0"), ("u(1)", "0"))),
+])
+def test_unsupported_problems(data):
+    with pytest.raises(preview.PreviewError):
+        preview.solve(data, 5)
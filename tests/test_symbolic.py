@@ -0,0 +1,77 @@
+import pytest
+
+from interview_kernel import symbolic
+
+
+@pytest.mark.parametrize("equation, parts", [
+    ("Δu = f(x)", ("Δu", "f(x)")),
+    ("-Δu + 2⋅u = x ⋅ x", ("-Δu + 2⋅u", "x ⋅ x")),
+    ("u = 0", ("u", "0")),
+    ("u(0) = 1", ("u(0)", "1")),
+    ("a = b = c", None),
+    ("Δu", None),
+])
+def test_split_equation(equation, parts):
+    assert symbolic.split_equation(equation) == parts
+
+
+@pytest.mark.parametrize("lhs, linear, order", [
+    ("Δu", True, 2),
+    ("∂u", True, 1),
+    ("∂ ∂ u", True, 2),
+    ("Δ Δ u", True, 4),
+    ("Δ(u)", True, 2),
+    ("twodiff u", True, 2),
+    ("laplace_operator(u)", True, 2),
+    ("-Δu + 2⋅u", True, 2),
+    ("u⋅Δu", False, 2),
+    ("Δu + u^2", False, 2),
+    ("u", True, 0),
+])
+def test_classify(lhs, linear, order):
+    assert symbolic.classify(lhs, ["u"]) == {"linear": linear, "order": order}
+
+
+def test_classify_unparsable():
+    assert symbolic.classify("Δu +", ["u"]) == {"linear": None, "order": None}
+
+
+@pytest.mark.parametrize("lhs, kind", [
+    ("u", 'function'),
+    ("u(0)", 'point'),
+    ("u(1.5)", 'point'),
+    ("u(x)", None),
+    ("∂u", None),
+    ("v", None),
+])
+def test_boundary_condition_kind(lhs, kind):
+    assert symbolic.boundary_condition_kind(lhs, "u") == kind
+
+
+known_types = {"u": "Ω ⟶ ℝ", "f": "Ω ⟶ ℝ", "c": "ℝ"}
+
+
+@pytest.mark.parametrize("expression, needs_wrapper", [
+    ("x ⋅ x", True),
+    ("sin(x)", True),
+    ("f(x)", True),
+    ("2", True),
+    ("c", True),
+    ("f", False),
+    ("u", False),
+    ("[ x : Ω ] x", False),
+    # not known locally, MMT has to decide
+    ("g", None),
+])
+def test_needs_function_wrapper(expression, needs_wrapper):
+    assert symbolic.needs_function_wrapper(expression, ["Ω"], known_types) == needs_wrapper
+
+
+def test_mentions_free():
+    assert symbolic.mentions_free("exp(x)", "x")
+    assert not symbolic.mentions_free("[ x : Ω ] x", "x")
+
+
+def test_has_word():
+    assert symbolic.has_word("it is linear", "linear")
+    assert not symbolic.has_word("nonlinear", "linear")